@@ -16,6 +16,7 @@ inclusion of fuzzy clustering, which Pycluster doesn't do.
 from .distances import distance
 from . import stats
 from . import partition
+from . import neighbors
 from . import hierarch
 from .hierarch import plot
 from .version import __version__
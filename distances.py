@@ -12,15 +12,38 @@ passed to these distance functions.
 All distances functions defined here are meant to calculate normalized versions
 of the distance where ever possible.
 
+Except for the spearman distances, the individual distance functions work
+along the last axis of their arguments and follow numpy's broadcasting rules.
+pdist makes use of this to compare whole blocks of data points at once rather
+than calling distance for each pair.
+
+Each distance alias is registered as a Metric, which holds the kernels used to
+compare a single pair, one point with many, and two blocks of points, along
+with what the distance supports.  New distances can be added with 
+registermetric and are then available to distance, pdist, cdist and every 
+other function which takes a distance alias.
+
+pdist, cdist and distance also accept scipy.sparse matrices for the distances
+which have a sparse kernel (e, p, b, L1, L2, u, r, x, h, t, y, j, d and z).  
+Sparse data is never made dense, and has no missing data.
+
 A complete version history and licence and copyright information are located
 in the source code.
 """
 
 import numpy
 import scipy.stats
+import scipy.sparse
 import warnings
+import multiprocessing
+import os
+import functools
+import mmap
+
+maxblock = 2**22 #Largest number of elements in a single broadcast block
+metrics = {} #Registered distance functions, keyed by alias
 
-def distance(a,b,weights=None,dist='e'):
+def distance(a,b,weights=None,dist='e',dtype=float):
     """External interface for distance functions.
     
     This function allows other packages to make use of this one without 
@@ -30,8 +53,9 @@ def distance(a,b,weights=None,dist='e'):
     this module will be available to any program calling this function.
     
     Parameters:
-        a,b : ndarray
-            The data points.  Expects two rank 1 arrays of the same length.
+        a,b : ndarray or sparse matrix
+            The data points.  Expects two rank 1 arrays of the same length, or
+            scipy.sparse matrices with a single row.
         weights : ndarray
             The weights for each dimension.  Expects rank 1 array of same 
             length as a & b.
@@ -59,9 +83,15 @@ def distance(a,b,weights=None,dist='e'):
             Notes: For the spearman distance the wildcard (*) should be one of
             the abbreviations for a pearson distance (c, a, u, r, or x).
             For the general minkowski metric the wildcard (*) should be
-            replaced with the integer specifying which minkowski metric you
-            want.  Also, L1 is equivalent to the cityblock distance and L2 is 
-            equivalent to the euclidean distance.
+            replaced with the number specifying which minkowski metric you
+            want, which need not be an integer.  Also, L1 is equivalent to 
+            the cityblock distance and L2 is equivalent to the euclidean 
+            distance.
+            Any alias added with registermetric, or a Metric, may also be 
+            given.
+        dtype : data-type
+            The floating point type used for the calculation.  numpy.float32
+            halves the memory used at the cost of precision.
     Returns:
         d : float
             The distance between the two data points.
@@ -69,9 +99,11 @@ def distance(a,b,weights=None,dist='e'):
         euclidian, peuclidian, cityblock, pcityblock, hamming, pearson, 
         abspearson, upearson, acosine, absupearson, spearman, kendall, 
         rogerstanimoto, sokalsneathsym, jaccard, dice, sokalsneathasym,
-        minkowski, & chebychev
+        minkowski, chebychev, pdist, cdist, & registermetric
     """
-    if type(a) is not numpy.ndarray and type(b) is not numpy.ndarray:
+    if scipy.sparse.issparse(a) or scipy.sparse.issparse(b):
+        return cdist(scipy.sparse.csr_matrix(a),scipy.sparse.csr_matrix(b),weights,dist,dtype=dtype)[0,0]
+    elif type(a) is not numpy.ndarray and type(b) is not numpy.ndarray:
         raise TypeError('Vectors must have type numpy.ndarray')
     elif type(a) is not numpy.ndarray:
         raise TypeError('First vector must have type numpy.ndarray')
@@ -84,55 +116,1186 @@ def distance(a,b,weights=None,dist='e'):
     elif numpy.isnan(a*b).all():
         d = numpy.nan
     else:
-        if not (weights is None) and dist[0] == 's':
-            warnings.warn('weights are not well defined for spearman distances and will be ignored',UserWarning,stacklevel=2)
-        elif not (weights is None) and dist == 'k':
-            warnings.warn('weights are not well defined for kendal distances and will be ignored',UserWarning,stacklevel=2)
-        elif not (weights is None) and dist == 'Linf':
-            warnings.warn('weights are not well defined for chebychev distances and will be ignored',UserWarning,stacklevel=2)
-        a = a.astype('float')
-        b = b.astype('float')
+        metric = getmetric(dist)
+        if not (weights is None) and not metric.weights:
+            warnings.warn('weights are not well defined for %s distances and will be ignored' % metric.name,UserWarning,stacklevel=2)
+        a = a.astype(dtype)
+        b = b.astype(dtype)
         if weights is None:
             weights = numpy.ones_like(a)
-        if dist == 'e':
-            d = euclidean(a,b,weights)
-        elif dist == 'p':
-            d = sqeuclidean(a,b,weights)
-        elif dist == 'b':
-            d = cityblock(a,b,weights)
-        elif dist == 'h':
-            d = hamming(a,b,weights)
-        elif dist == 'c':
-            d = pearson(a,b,weights)
-        elif dist == 'a':
-            d = abspearson(a,b,weights)
-        elif dist == 'u':
-            d = upearson(a,b,weights)
-        elif dist == 'r':
-            d = acosine(a,b,weights)
-        elif dist == 'x':
-            d = absupearson(a,b,weights)
-        elif dist[0] == 's':
-            d = spearman(a,b,dist[1])
-        elif dist == 'k':
-            d = kendall(a,b)
-        elif dist == 't':
-            d = rogerstanimoto(a,b,weights)
-        elif dist == 'y':
-            d = sokalsneathsym(a,b,weights)
-        elif dist == 'j':
-            d = jaccard(a,b,weights)
-        elif dist == 'd':
-            d = dice(a,b,weights)
-        elif dist == 'z':
-            d = sokalsneathasym(a,b,weights)
-        elif dist == 'Linf':
-            d = chebychev(a,b)
-        elif dist[0] == 'L':
-            d = minkowski(a,b,weights,int(dist[1:]))
+        d = metric.scalar(a,b,numpy.asarray(weights,dtype=dtype))
+    return d
+
+def pdist(data,weights=None,dist='e',verbose=False,out=None,chunk_rows=None,max_memory=None,n_jobs=None,binary=False,dtype=float):
+    """Vectorized distance between every pair of data points in a data set.
+    
+    Produces the same results as calling distance for each pair of rows in
+    data, but blocks of rows are compared at once using numpy broadcasting so
+    that arguments are checked and the distance alias is resolved only once.
+    The size of the blocks is controlled by chunk_rows or max_memory, or by the
+    module variable maxblock if neither is given.  Missing data (nan) is
+    handled exactly as it is by distance.
+    
+    The matrix is computed one block of rows at a time, working down the lower
+    half of the matrix.  Each block is written to out as soon as it is
+    complete, so that when out is a numpy.memmap or a function the memory used
+    is bounded by the block size rather than by the size of the matrix.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            Rank 2 array or scipy.sparse matrix. Each row is assumed to 
+            represent a single data point.  Sparse data is only available for
+            distances with a sparse kernel (see Metric).
+        weights : ndarray
+            Optional.  If given, a rank 1 array with length equal to the number
+            of columns in data.  Entries specify the weight for each dimension
+            in the distance function.
+        dist : string
+            Specifies the desired distance function by it's alias.  See
+            distance for the available aliases.
+        verbose : boolean
+            If true periodic updates on progress will be printed to the screen.
+        out : ndarray or function
+            Optional.  Where the distance matrix is written.  Either a rank 2
+            array (or numpy.memmap) with dimensions # rows of data x # rows of
+            data, or a function which is called as out(i,block) for each block.
+            block is the rank 2 array dm[i:i+len(block),:i+len(block)] of the
+            full distance matrix dm.
+        chunk_rows : integer
+            Optional.  The number of rows computed in each block.
+        max_memory : integer
+            Optional.  Approximate number of bytes that each intermediate array
+            used to compute a block may occupy.  Ignored if chunk_rows is given.
+        n_jobs : integer
+            Optional.  The number of processes used to compute the blocks.  -1
+            uses one process per cpu.  The results are identical to those
+            computed by a single process.  If out is a numpy.memmap of a file
+            each process writes its blocks straight into the file.
+        binary : boolean
+            If true, data must contain only 0, 1 and nan, and is packed 64 
+            dimensions to a word so that matches and mismatches can be counted
+            a word at a time.  Only available for the h, t, y, j, d and z 
+            distances, and only with equal weights.
+        dtype : data-type
+            The floating point type used for the data and the distance matrix.
+            With numpy.float32 nothing is converted to double precision, so
+            the memory used for both is halved.
+    Returns:
+        dm : ndarray
+            Rank 2 array containing the distance matrix for the data.  This
+            matrix is symmetric and all main diaganol elements are 0.  If out
+            is an array, then dm is out.  If out is a function then None is
+            returned.
+    See Also:
+        distance, pdisttiles
+    """
+    data,weights,metric = _prepare(data,weights,dist,dtype)
+    n = _npoints(data)
+    if out is None:
+        dm = numpy.zeros((n,n),dtype=dtype)
+    elif callable(out):
+        dm = None
+    elif numpy.shape(out) != (n,n):
+        raise ValueError('out must have dimensions %i x %i' % (n,n))
+    else:
+        dm = out
+    data,rows = _blockdata(data,weights,metric,chunk_rows,max_memory,binary)
+    for i,block in _tril(data,weights,metric,rows,verbose,n_jobs,dm):
+        if dm is None:
+            out(i,block)
+    return dm
+
+def pdisttiles(data,weights=None,dist='e',cutoff=None,verbose=False,chunk_rows=None,max_memory=None,n_jobs=None,binary=False,dtype=float):
+    """Generates the distance matrix of a data set one tile at a time.
+    
+    For consumers which only need to look at each distance once, such as
+    thresholding, histograms of distances or building a neighbour graph.  The
+    tiles are computed exactly as pdist computes its blocks, and only one is
+    held in memory at a time, so the whole matrix is never stored.  Tiles come
+    in order of their first row, and are the same for the same arguments.
+    
+    Without a cutoff each tile is a dense block of rows of the lower half of
+    the distance matrix, reaching up to and including the main diaganol.  The
+    part of a tile on or above the main diaganol is the mirror image of the
+    part below it, with diaganol elements of 0.  With a cutoff each tile lists
+    only the pairs below the main diaganol, i.e. each pair of data points 
+    once, whose distance is less than cutoff, in row major order.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            Rank 2 array or scipy.sparse matrix. Each row is assumed to 
+            represent a single data point.
+        weights : ndarray
+            Optional.  If given, a rank 1 array with length equal to the number
+            of columns in data.  Entries specify the weight for each dimension
+            in the distance function.
+        dist : string
+            Specifies the desired distance function by it's alias.  See
+            distance for the available aliases.
+        cutoff : float
+            Optional.  If given only distances less than cutoff are generated.
+            Distances which are nan are never less than cutoff.
+        verbose : boolean
+            If true periodic updates on progress will be printed to the screen.
+        chunk_rows, max_memory, n_jobs, binary, dtype
+            As for pdist.
+    Yields:
+        rows : ndarray
+            Without a cutoff, the rows of the distance matrix in the tile.  
+            With a cutoff, the row of each pair.
+        columns : ndarray
+            Without a cutoff, the columns of the distance matrix in the tile.
+            With a cutoff, the column of each pair, which is always less than
+            its row.
+        d : ndarray
+            Without a cutoff, rank 2 array where d[i,j] is the distance 
+            between data points rows[i] and columns[j].  With a cutoff, rank 1
+            array of the distance between the two points of each pair.
+    See Also:
+        pdist
+    """
+    data,weights,metric = _prepare(data,weights,dist,dtype)
+    data,rows = _blockdata(data,weights,metric,chunk_rows,max_memory,binary)
+    #The arguments are checked when pdisttiles is called, not when the first
+    #tile is asked for.
+    return _tiles(data,weights,metric,rows,cutoff,verbose,n_jobs)
+
+def _tiles(data,weights,metric,rows,cutoff,verbose,n_jobs):
+    """Generates the tiles of pdisttiles from the blocks of _tril."""
+    for i,block in _tril(data,weights,metric,rows,verbose,n_jobs):
+        j = i+len(block)
+        if cutoff is None:
+            yield numpy.arange(i,j),numpy.arange(j),block
         else:
-            message = 'Unrecognized distance fucntion (%s) provided.' % dist
-            raise ValueError(message)
+            with numpy.errstate(invalid='ignore'):
+                r,c = numpy.nonzero(numpy.tril(block < cutoff,i-1))
+            yield r+i,c,block[r,c]
+
+def cdist(a,b,weights=None,dist='e',binary=False,dtype=float):
+    """Vectorized distance between each data point in a and each in b.
+    
+    Produces the same results as calling distance(a[i],b[j],weights,dist) for
+    each i and j, but blocks of rows are compared at once using numpy
+    broadcasting.  Most useful when comparing a data set to a small number of
+    other points, e.g. cluster centroids.
+    
+    Parameters:
+        a,b : ndarray or sparse matrix
+            Rank 2 arrays or scipy.sparse matrices with the same number of 
+            columns.  Each row is assumed to represent a single data point.
+            If either is sparse both are compared as sparse matrices.
+        weights : ndarray
+            Optional.  If given, a rank 1 array with length equal to the number
+            of columns in a and b.  Entries specify the weight for each 
+            dimension in the distance function.
+        dist : string
+            Specifies the desired distance function by it's alias.  See
+            distance for the available aliases.
+        binary : boolean
+            If true, a and b are packed into bits.  See pdist.
+        dtype : data-type
+            The floating point type used for the data and the distances.
+    Returns:
+        d : ndarray
+            Rank 2 array with dimensions # rows of a x # rows of b.  d[i,j] is
+            the distance between a[i] and b[j].
+    See Also:
+        distance, pdist, kernel
+    """
+    a,weights,metric = _prepare(a,weights,dist,dtype)
+    if type(b) is not numpy.ndarray and not scipy.sparse.issparse(b):
+        raise TypeError('Data must have type numpy.ndarray')
+    elif b.ndim != 2:
+        raise ValueError('Data must be a rank 2 array')
+    elif b.shape[1] != a.shape[1]:
+        raise ValueError('Vectors must have the same length')
+    if scipy.sparse.issparse(a) or scipy.sparse.issparse(b):
+        if metric.sparse is None:
+            raise ValueError('sparse data is not available for %s distances' % metric.name)
+        elif binary:
+            raise ValueError('binary is not available for sparse data')
+        return _bound(_tosparse(a),_tosparse(b,dtype),weights,metric)
+    b = b.astype(dtype)
+    if not binary:
+        return _bound(a,b,weights,metric)
+    d = numpy.zeros((len(a),len(b)),dtype=dtype)
+    b,rows = _blockdata(b,weights,metric,binary=binary)
+    a = _packbinary(a,weights,metric)
+    for i in range(0,len(a),rows):
+        d[i:i+rows] = _pairwise(a[i:i+rows],b,weights,metric)
+    return d
+
+def kernel(dist='e',weights=None,dtype=float):
+    """Low level distance function with the distance and weights bound once.
+    
+    cdist checks and copies its arguments and resolves the distance alias
+    every time it is called.  Code which compares the same data set many 
+    times, such as the iterations of kmeans, can instead get a kernel once and
+    call it directly.  The kernel does no checking or conversion at all: a and
+    b must be rank 2 arrays of type dtype with the same number of columns, or 
+    PreparedData made with the same weights, and anything else gives 
+    undefined results.  Either may instead be a csr matrix of type dtype with
+    no duplicate or explicitly stored zero elements if the distance has a 
+    sparse kernel, in which case the other is made sparse.  Passing the data
+    set that is reused as a PreparedData also saves locating its missing data
+    on every call.
+    
+    Parameters:
+        dist : string
+            Specifies the desired distance function by it's alias.  See
+            distance for the available aliases.
+        weights : ndarray
+            Optional.  If given, a rank 1 array with length equal to the number
+            of columns of the data.  Entries specify the weight for each 
+            dimension in the distance function.
+        dtype : data-type
+            The floating point type of the data and the distances.
+    Returns:
+        f : function
+            Called as f(a,b), returns the same rank 2 array as 
+            cdist(a,b,weights,dist,dtype=dtype).
+    See Also:
+        cdist, PreparedData
+    """
+    metric = getmetric(dist)
+    if not (weights is None) and not metric.weights:
+        warnings.warn('weights are not well defined for %s distances and will be ignored' % metric.name,UserWarning,stacklevel=2)
+    if weights is not None:
+        weights = numpy.asarray(weights,dtype=dtype)
+    return functools.partial(_bound,weights=weights,metric=metric)
+
+def _bound(a,b,weights,metric):
+    """Distances between each row of a and each row of b, without checks.
+    
+    Parameters:
+        a,b : ndarray or PreparedData or sparse matrix
+            The data points.
+        weights : ndarray
+            The weights for each dimension or None.
+        metric : Metric
+            The metric.
+    Returns:
+        d : ndarray
+            Rank 2 array where d[i,j] is the distance between a[i] and b[j].
+    """
+    if scipy.sparse.issparse(a) or scipy.sparse.issparse(b):
+        if not scipy.sparse.issparse(a):
+            a = _tosparse(a.data if type(a) is PreparedData else a)
+        if not scipy.sparse.issparse(b):
+            b = _tosparse(b.data if type(b) is PreparedData else b)
+        if weights is None:
+            weights = numpy.ones(b.shape[1],dtype=b.dtype)
+        d = numpy.empty((a.shape[0],b.shape[0]),dtype=b.dtype)
+        rows = _blockrows(b.shape[0],_density(b),itemsize=b.dtype.itemsize)
+        for i in range(0,a.shape[0],rows):
+            d[i:i+rows] = _pairwise(a[i:i+rows],b,weights,metric)
+        return d
+    if type(a) is not PreparedData:
+        a = PreparedData(a,weights)
+    if type(b) is not PreparedData:
+        b = PreparedData(b,weights)
+    d = numpy.empty((len(a),len(b)),dtype=b.data.dtype)
+    rows = _blockrows(len(b),b.data.shape[1],itemsize=b.data.itemsize)
+    for i in range(0,len(a),rows):
+        d[i:i+rows] = _pairwise(a[i:i+rows],b,b.weights,metric)
+    return d
+
+def _tosparse(x,dtype=None):
+    """A copy of x as a csr matrix with no duplicate or explicit zero elements."""
+    x = scipy.sparse.csr_matrix(x,dtype=dtype,copy=True)
+    x.sum_duplicates()
+    x.eliminate_zeros()
+    return x
+
+def _density(x):
+    """Average number of columns two rows of sparse x share, used for blocks."""
+    counts = numpy.bincount(x.indices,minlength=x.shape[1])
+    return max(1,int(numpy.dot(counts,counts))//max(1,x.shape[0]**2))
+
+def _npoints(data):
+    """Number of data points in an array, PreparedData or sparse matrix."""
+    if scipy.sparse.issparse(data):
+        return data.shape[0]
+    return len(data)
+
+class Metric(object):
+    """A distance function and what is needed to compute it efficiently.
+    
+    A metric can be computed by up to three kernels: one which compares a 
+    single pair of points, one which compares one point with each of many, and
+    one which compares each point of one block with each point of another.  
+    Any kernel which is not given is built from the others.  If the scalar
+    kernel works along the last axis of its arguments and follows numpy's
+    broadcasting rules (broadcast is True) it is used directly for the other
+    two.  Otherwise one to many comparisons loop over the scalar kernel and
+    block comparisons loop over the one to many kernel.  Only the elementwise
+    method, never scalar, should be given arrays of several points, since it
+    loops over the pairs whenever the scalar kernel does not broadcast.
+    
+    The kernels are called as kernel(a,b,weights) if the metric supports
+    weights, and as kernel(a,b) if it does not.  If the metric does not handle
+    missing data, the dimensions which are missing from either point are 
+    removed before the scalar kernel is called, and pairs with missing data are
+    always compared one at a time.
+    
+    Properties:
+        alias : string
+            The alias used to select the metric.
+        name : string
+            The name of the distance, used in messages.
+        weights : boolean
+            Whether the kernels accept weights for each dimension.
+        metric : boolean
+            Whether the distance is a true metric, i.e. it is 0 only between 
+            identical points, symmetric, and obeys the triangle inequality.
+        nan : boolean
+            Whether the kernels handle missing data (nan) themselves.
+        broadcast : boolean
+            Whether the scalar kernel follows numpy's broadcasting rules.
+        binary : function
+            Optional.  Kernel for data packed into bits, called as 
+            binary(a,b,m) with a and b packed by the binary option of pdist and
+            m the number of dimensions.  None if the metric has none.
+        prepared : function
+            Optional.  Block kernel called as prepared(a,b) with a and b 
+            PreparedData, which can use their precomputed missing data masks.
+            None if the metric has none, in which case the pairwise kernel is
+            used.
+        sparse : function
+            Optional.  Block kernel called as sparse(a,b,weights) with a and b
+            scipy.sparse csr matrices, which must not make them dense.  None
+            if the metric has none, in which case sparse data is refused.
+    """
+    def __init__(self,alias,scalar,name=None,weights=True,metric=False,nan=True,broadcast=False,onetomany=None,pairwise=None,binary=None,prepared=None,sparse=None):
+        """Creates the metric.  See registermetric for the parameters."""
+        self.alias = alias
+        self.name = alias if name is None else name
+        self.weights = weights
+        self.metric = metric
+        self.nan = nan
+        self.broadcast = broadcast
+        self.binary = binary
+        self.prepared = prepared
+        self.sparse = sparse
+        self._scalar = scalar
+        self._onetomany = onetomany
+        self._pairwise = pairwise
+    def __repr__(self):
+        return 'Metric(%r)' % self.alias
+    def _call(self,kernel,a,b,weights):
+        """Calls kernel with or without weights."""
+        if self.weights:
+            return kernel(a,b,weights)
+        return kernel(a,b)
+    def scalar(self,a,b,weights):
+        """The distance between rank 1 arrays a and b."""
+        if not self.nan:
+            present = ~(numpy.isnan(a)+numpy.isnan(b))
+            a,b,weights = a[present],b[present],weights[present]
+        return self._call(self._scalar,a,b,weights)
+    def elementwise(self,a,b,weights):
+        """The distance between corresponding points of a and b.
+        
+        a and b are arrays of points along their last axis, and the points
+        are paired by numpy's broadcasting rules, e.g. a of shape (n,1,m) and
+        b of shape (n,k,m) give the (n,k) distances from each a[i,0] to each
+        b[i,j].  Pairs with no dimensions in common are not treated 
+        specially; use pdist or cdist for that.
+        """
+        if self.broadcast and self.nan:
+            return numpy.asarray(self._call(self._scalar,a,b,weights))
+        a,b = numpy.broadcast_arrays(a,b)
+        shape = a.shape[:-1]
+        a = a.reshape((-1,a.shape[-1]))
+        b = b.reshape((-1,b.shape[-1]))
+        if self.broadcast:
+            d = numpy.asarray(self._call(self._scalar,a,b,weights),dtype=a.dtype).reshape(len(a))
+            pairs = numpy.flatnonzero(numpy.any(numpy.isnan(a),axis=1)+numpy.any(numpy.isnan(b),axis=1))
+        else:
+            d = numpy.empty(len(a),dtype=a.dtype)
+            pairs = range(len(a))
+        for m in pairs:
+            d[m] = self.scalar(a[m],b[m],weights)
+        return d.reshape(shape)
+    def onetomany(self,a,b,weights):
+        """The distance between rank 1 array a and each row of rank 2 array b."""
+        if self._onetomany is not None:
+            d = self._call(self._onetomany,a,b,weights)
+        elif self.broadcast:
+            d = self._call(self._scalar,a,b,weights)
+        elif self._pairwise is not None:
+            d = self._call(self._pairwise,a[numpy.newaxis],b,weights)[0]
+        else:
+            d = [self.scalar(a,b[j],weights) for j in range(len(b))]
+        d = numpy.asarray(d,dtype=a.dtype).reshape(len(b))
+        if not self.nan:
+            for j in numpy.flatnonzero(numpy.any(numpy.isnan(b),axis=1)+numpy.any(numpy.isnan(a))):
+                d[j] = self.scalar(a,b[j],weights)
+        return d
+    def pairwise(self,a,b,weights):
+        """The distance between each row of a and each row of b.
+        
+        Pairs with no dimensions in common are not treated specially; use
+        pdist or cdist for that.
+        """
+        if self._pairwise is not None:
+            d = self._call(self._pairwise,a,b,weights)
+        elif self.broadcast:
+            d = self._call(self._scalar,a[:,numpy.newaxis,:],b[numpy.newaxis,:,:],weights)
+        elif self._onetomany is not None:
+            d = [self._call(self._onetomany,a[i],b,weights) for i in range(len(a))]
+        else:
+            d = [[self.scalar(a[i],b[j],weights) for j in range(len(b))] for i in range(len(a))]
+        d = numpy.asarray(d,dtype=a.dtype).reshape((len(a),len(b)))
+        if not self.nan:
+            amissing = numpy.any(numpy.isnan(a),axis=1)
+            bmissing = numpy.any(numpy.isnan(b),axis=1)
+            for i,j in zip(*numpy.nonzero(amissing[:,numpy.newaxis]+bmissing)):
+                d[i,j] = self.scalar(a[i],b[j],weights)
+        return d
+
+def registermetric(alias,scalar,name=None,weights=True,metric=False,nan=True,broadcast=False,onetomany=None,pairwise=None,binary=None,prepared=None,sparse=None):
+    """Adds a distance function which can then be selected by its alias.
+    
+    Once registered, the alias can be given as dist to distance, pdist, cdist
+    and every function elsewhere in the package which accepts a distance alias,
+    and the distance is computed in blocks just like the built in ones.
+    
+    Parameters:
+        alias : string
+            The alias used to select the distance.  Must not already be in use.
+        scalar : function
+            Computes the distance between two rank 1 arrays, called as
+            scalar(a,b,weights) or scalar(a,b) (see weights).
+        name : string
+            Optional.  The name of the distance, used in messages.  Defaults to
+            the alias.
+        weights : boolean
+            Whether the kernels accept weights.  If false, weights given by 
+            the user are ignored with a warning.
+        metric : boolean
+            Whether the distance is a true metric.
+        nan : boolean
+            Whether the kernels handle missing data (nan).  If false, only the
+            dimensions present in both points are passed to the scalar kernel.
+        broadcast : boolean
+            Whether scalar works along the last axis of its arguments and
+            follows numpy's broadcasting rules, so that it can compare whole
+            blocks of points at once.
+        onetomany : function
+            Optional.  Computes the distance between rank 1 array a and each
+            row of rank 2 array b, returning a rank 1 array.
+        pairwise : function
+            Optional.  Computes the distance between each row of rank 2 array a
+            and each row of rank 2 array b, returning a rank 2 array.
+        binary : function
+            Optional.  Computes the distance between data packed into bits.
+            See Metric.
+        prepared : function
+            Optional.  Computes the distance between each row of PreparedData
+            a and each row of PreparedData b, returning a rank 2 array.
+        sparse : function
+            Optional.  Computes the distance between each row of sparse matrix
+            a and each row of sparse matrix b.  See Metric.
+    Returns:
+        metric : Metric
+            The registered metric.
+    See Also:
+        Metric, getmetric
+    """
+    if alias in metrics:
+        raise ValueError('A distance function is already registered as %s' % alias)
+    metrics[alias] = Metric(alias,scalar,name,weights,metric,nan,broadcast,onetomany,pairwise,binary,prepared,sparse)
+    return metrics[alias]
+
+def getmetric(dist):
+    """The Metric registered for a distance alias.
+    
+    Minkowski metrics (L followed by a positive number) are registered the 
+    first time they are asked for.
+    
+    Parameters:
+        dist : string or Metric
+            The distance alias.  A Metric is returned unchanged.
+    Returns:
+        metric : Metric
+            The metric selected by dist.
+    """
+    if type(dist) is Metric:
+        return dist
+    elif dist in metrics:
+        return metrics[dist]
+    elif type(dist) is str and dist[:1] == 'L' and _order(dist[1:]) is not None:
+        p = _order(dist[1:])
+        sparse = None
+        if p == 2:
+            prepared = _euclideanprepared
+            sparse = functools.partial(_sumsquaressparse,dist='e')
+        else:
+            prepared = functools.partial(_minkowskiprepared,p=p)
+        if p == 1:
+            sparse = _cityblocksparse
+        return registermetric(dist,functools.partial(minkowski,p=p),'minkowski',metric=p >= 1,broadcast=True,prepared=prepared,sparse=sparse)
+    raise ValueError('Unrecognized distance fucntion (%s) provided.' % dist)
+
+def _order(p):
+    """The order of a minkowski alias, or None if p is not a positive number."""
+    try:
+        p = float(p)
+    except ValueError:
+        return None
+    if not (0 < p < numpy.inf):
+        return None
+    elif p.is_integer():
+        return int(p)
+    return p
+
+class PreparedData(object):
+    """A data set with its missing data located once for the distance kernels.
+    
+    The distance functions find the dimensions two points have in common
+    with ~numpy.isnan(a)*~numpy.isnan(b) for every pair.  PreparedData finds 
+    the dimensions present in each point once, so that block kernels can get
+    the (weighted) number of dimensions each pair has in common from a single
+    matrix product of the masks, and work on data where missing values have 
+    been replaced by 0 instead of using nansum.
+    
+    Slicing a PreparedData (e.g. prepared[i:j]) gives a PreparedData of those
+    rows without recomputing anything.
+    
+    Properties:
+        data : ndarray
+            Rank 2 array of data points, with nan for missing data.
+        weights : ndarray
+            The weights for each dimension.
+        valid : ndarray
+            Boolean array which is True where data is not missing.
+        filled : ndarray
+            data with the missing values replaced by 0.
+        counts : ndarray
+            The weighted number of dimensions present in each data point.
+        complete : boolean
+            True if no data is missing.
+    """
+    def __init__(self,data,weights=None):
+        """Prepares the data set.
+        
+        Parameters:
+            data : ndarray
+                Rank 2 float array.  Each row is assumed to represent a single
+                data point.
+            weights : ndarray
+                Optional.  The weights for each dimension.  Equal weights are
+                used if not given.
+        """
+        if numpy.ndim(data) != 2:
+            raise ValueError('Data must be a rank 2 array')
+        self.data = data
+        if weights is None:
+            self.weights = numpy.ones(data.shape[1],dtype=data.dtype)
+        else:
+            self.weights = numpy.asarray(weights,dtype=data.dtype)
+        self.valid = ~numpy.isnan(data)
+        self.complete = bool(numpy.all(self.valid))
+        if self.complete:
+            self.filled = data
+        else:
+            self.filled = numpy.where(self.valid,data,0)
+        self.counts = numpy.dot(self.valid,self.weights)
+    def __len__(self):
+        return len(self.data)
+    def __getitem__(self,index):
+        if type(index) is not slice:
+            raise TypeError('PreparedData can only be sliced.')
+        prepared = PreparedData.__new__(PreparedData)
+        prepared.data = self.data[index]
+        prepared.weights = self.weights
+        prepared.valid = self.valid[index]
+        prepared.filled = self.filled[index]
+        prepared.counts = self.counts[index]
+        prepared.complete = self.complete or bool(numpy.all(prepared.valid))
+        return prepared
+    def common(self,other,weighted=True):
+        """Number of dimensions each point has in common with each in other.
+        
+        Parameters:
+            other : PreparedData
+                The data set to compare with.
+            weighted : boolean
+                Whether each dimension counts as its weight or as 1.
+        Returns:
+            N : ndarray
+                Rank 2 array where N[i,j] is the (weighted) number of 
+                dimensions present in both self.data[i] and other.data[j].
+        """
+        if weighted:
+            mask = self.valid*self.weights
+        else:
+            mask = self.valid.astype(self.data.dtype)
+        if self.complete and other.complete:
+            return numpy.full((len(self),len(other)),numpy.sum(mask[:1]),dtype=mask.dtype)
+        return numpy.dot(mask,numpy.transpose(other.valid).astype(mask.dtype))
+
+def _blockdata(data,weights,metric,chunk_rows=None,max_memory=None,binary=False):
+    """Wraps data for the block kernels and finds the number of rows per block.
+    
+    Returns:
+        data : PreparedData or ndarray or sparse matrix
+            data packed by _packbinary if binary, data itself if it is sparse,
+            otherwise PreparedData.
+        rows : integer
+            The number of rows in each block.
+    """
+    if scipy.sparse.issparse(data):
+        if binary:
+            raise ValueError('binary is not available for sparse data')
+        return data,_blockrows(data.shape[0],_density(data),chunk_rows,max_memory,data.dtype.itemsize)
+    elif binary:
+        data = _packbinary(data,weights,metric)
+        return data,_blockrows(len(data),data.shape[1],chunk_rows,max_memory,data.itemsize)
+    rows = _blockrows(len(data),data.shape[1],chunk_rows,max_memory,data.itemsize)
+    return PreparedData(data,weights),rows
+
+def _prepare(data,weights,dist,dtype=float):
+    """Checks and formats the arguments of the vectorized distance functions.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            Rank 2 array of data points.
+        weights : ndarray
+            The weights for each dimension or None.
+        dist : string or Metric
+            The distance alias.
+        dtype : data-type
+            The floating point type used for the data and weights.
+    Returns:
+        data : ndarray or sparse matrix
+            data as a float array, or a float csr matrix if data is sparse.
+        weights : ndarray
+            The weights for each dimension, with None replaced by equal
+            weighting.
+        metric : Metric
+            The metric selected by dist.
+    """
+    sparse = scipy.sparse.issparse(data)
+    if type(data) is not numpy.ndarray and not sparse:
+        raise TypeError('Data must have type numpy.ndarray')
+    elif data.ndim != 2:
+        raise ValueError('Data must be a rank 2 array')
+    elif not (weights is None) and len(weights) != data.shape[1]:
+        raise ValueError('There must be the same number of weights as the vector length')
+    metric = getmetric(dist)
+    if sparse and metric.sparse is None:
+        raise ValueError('sparse data is not available for %s distances' % metric.name)
+    elif not (weights is None) and not metric.weights:
+        warnings.warn('weights are not well defined for %s distances and will be ignored' % metric.name,UserWarning,stacklevel=3)
+    if sparse:
+        data = _tosparse(data,dtype)
+    else:
+        data = data.astype(dtype)
+    if weights is None:
+        weights = numpy.ones(data.shape[1],dtype=dtype)
+    else:
+        weights = numpy.asarray(weights,dtype=dtype)
+    return data,weights,metric
+
+def _packbinary(data,weights,metric):
+    """Packs binary data into bits for the binary distances.
+    
+    Parameters:
+        data : ndarray
+            Rank 2 float array containing only 0, 1 and nan.
+        weights : ndarray
+            The weights for each dimension, which must all be equal.
+        metric : Metric
+            The metric, which must have a binary kernel.
+    Returns:
+        packed : ndarray
+            Rank 3 uint64 array with dimensions # rows of data x # words x 2.
+            packed[:,:,0] holds the bits that are 1 and packed[:,:,1] the bits
+            that are not missing.
+    """
+    if metric.binary is None:
+        raise ValueError('binary is not available for %s distances' % metric.name)
+    elif numpy.any(weights != weights[:1]):
+        raise ValueError('binary is only available with equal weights')
+    present = ~numpy.isnan(data)
+    if numpy.any(present*(data != 0)*(data != 1)):
+        raise ValueError('binary data may only contain 0, 1 and nan')
+    words = -(-data.shape[1]//64)
+    packed = numpy.zeros((len(data),words*8,2),dtype=numpy.uint8)
+    packed[:,:(data.shape[1]+7)//8,0] = numpy.packbits(data == 1,axis=1,bitorder='little')
+    packed[:,:(data.shape[1]+7)//8,1] = numpy.packbits(present,axis=1,bitorder='little')
+    return numpy.ascontiguousarray(numpy.transpose(packed,(0,2,1))).view(numpy.uint64).transpose(0,2,1)
+
+def _popsum(x):
+    """Number of set bits along the last axis of an array of uint64 words."""
+    if hasattr(numpy,'bitwise_count'):
+        return numpy.sum(numpy.bitwise_count(x),axis=-1,dtype=int)
+    x = numpy.ascontiguousarray(x).view(numpy.uint8)
+    return numpy.sum(_bytecount[x],axis=-1,dtype=int)
+
+_bytecount = numpy.array([bin(i).count('1') for i in range(256)]) #Set bits in each byte, used when numpy has no bitwise_count
+
+def _blockrows(n,m,chunk_rows=None,max_memory=None,itemsize=8):
+    """Number of rows that fit in a block when compared to n rows of m columns."""
+    if chunk_rows is not None:
+        return max(1,int(chunk_rows))
+    elif max_memory is not None:
+        return max(1,int(max_memory)//(itemsize*max(1,n*m)))
+    return max(1,maxblock//max(1,n*m))
+
+def _tril(data,weights,metric,rows,verbose=False,n_jobs=None,out=None,condensed=False):
+    """Generates the lower half of the distance matrix one block at a time.
+    
+    Arguments are not checked, they should already have been formatted by
+    _prepare.  When more than one job is requested the blocks are computed by
+    a multiprocessing.Pool, but they are still generated in order and each one
+    is computed exactly as it would be by a single process.
+    
+    If out is given each block is written to it (see _writeblock) before it is
+    generated.  When the blocks are computed by a pool and out is a writable 
+    numpy.memmap of a file, each worker writes its blocks straight into the 
+    file, so that no block is sent back to this process, and None is 
+    generated in place of the block.  Any other out is written by this 
+    process, since memory which is not backed by a file cannot be shared with
+    the workers under every multiprocessing start method.
+    
+    Parameters:
+        data : PreparedData or ndarray or sparse matrix
+            The data points, prepared by _blockdata.
+        weights : ndarray
+            The weights for each dimension.
+        metric : Metric
+            The metric.
+        rows : integer
+            The number of rows in each block.
+        verbose : boolean
+            If true periodic updates on progress will be printed to the screen.
+        n_jobs : integer
+            Optional.  The number of processes used to compute the blocks.
+            None or 1 computes them in this process, -1 uses one process per
+            cpu.
+        out : ndarray
+            Optional.  The full (n x n) or, if condensed is True, condensed 
+            distance matrix the blocks are written to.
+        condensed : boolean
+            Whether out is a condensed distance matrix.
+    Yields:
+        i : integer
+            The index of the first row in the block.
+        block : ndarray
+            Rows i to i+len(block) of the distance matrix, including only the
+            first i+len(block) columns.  The square part of the block that
+            straddles the main diaganol is symmetric with diaganol elements of
+            0.  None if the block was written to out by a worker.
+    """
+    n = _npoints(data)
+    current = 0
+    starts = range(0,n,rows)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs is None or n_jobs <= 1 or len(starts) <= 1:
+        pool = None
+        blocks = (_trilblock(data,weights,metric,i,rows) for i in starts)
+    else:
+        if _mapped(out):
+            target = (out.filename,out.dtype,out.offset,out.shape,condensed)
+        else:
+            target = None
+        pool = multiprocessing.Pool(min(n_jobs,len(starts)),_initworker,(data,weights,metric,rows,target))
+        blocks = pool.imap(_workerblock,starts)
+    try:
+        for i,block in zip(starts,blocks):
+            if out is not None and block is not None:
+                _writeblock(out,i,block,condensed)
+            yield i,block
+            j = min(i+rows,n)
+            if verbose and n > 1 and j*(j-1)*100/(n*(n-1)) > current:
+                current = j*(j-1)*100/(n*(n-1))
+                print('%i%% complete' % current)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+def _trilblock(data,weights,metric,i,rows):
+    """Computes the block of _tril starting at row i."""
+    j = min(i+rows,_npoints(data))
+    block = _pairwise(data[i:j],data[:j],weights,metric)
+    diag = numpy.tril(block[:,i:],-1)
+    block[:,i:] = diag + numpy.transpose(diag)
+    return block
+
+def _writeblock(out,i,block,condensed):
+    """Writes the block of _tril starting at row i to the full or condensed
+    distance matrix out.  Different blocks write to different elements."""
+    j = i+len(block)
+    if condensed:
+        lower = numpy.arange(j)[numpy.newaxis,:] < numpy.arange(i,j)[:,numpy.newaxis]
+        out[i*(i-1)//2:j*(j-1)//2] = block[lower]
+    else:
+        out[i:j,:j] = block
+        out[:i,i:j] = numpy.transpose(block[:,:i])
+
+def _mapped(out):
+    """Whether out is a whole numpy.memmap of a file which other processes can
+    open and write to."""
+    return type(out) is numpy.memmap and out.filename is not None and out.mode in ['r+','w+'] and isinstance(out.base,mmap.mmap) and out.flags.c_contiguous
+
+_worker = None #Arguments of _trilblock shared by all blocks in a worker process
+
+def _initworker(data,weights,metric,rows,target):
+    """Stores the arguments shared by all blocks in a worker process, opening
+    the file the blocks are written to if there is one."""
+    global _worker
+    if target is not None:
+        filename,dtype,offset,shape,condensed = target
+        target = (numpy.memmap(filename,dtype=dtype,mode='r+',offset=offset,shape=shape),condensed)
+    _worker = (data,weights,metric,rows,target)
+
+def _workerblock(i):
+    """Computes the block of _tril starting at row i in a worker process, and
+    writes it to the file if there is one."""
+    data,weights,metric,rows,target = _worker
+    block = _trilblock(data,weights,metric,i,rows)
+    if target is None:
+        return block
+    out,condensed = target
+    _writeblock(out,i,block,condensed)
+    return None
+
+def _pairwise(a,b,weights,metric):
+    """Distances between each row of a and each row of b.
+    
+    Arguments are not checked, they should already have been formatted by
+    _prepare.  Pairs of rows which have no dimensions in common are assigned a
+    distance of nan, just as in distance.
+    
+    Parameters:
+        a,b : PreparedData or ndarray or sparse matrix
+            PreparedData with the same number of columns, data packed by 
+            _packbinary, or csr matrices.
+        weights : ndarray
+            The weights for each dimension.
+        metric : Metric
+            The metric.
+    Returns:
+        d : ndarray
+            Rank 2 array where d[i,j] is the distance between a[i] and b[j].
+    """
+    if scipy.sparse.issparse(a):
+        return numpy.asarray(metric.sparse(a,b,weights),dtype=a.dtype)
+    elif type(a) is not PreparedData:
+        return metric.binary(a,b,len(weights))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if metric.prepared is not None:
+            d = numpy.asarray(metric.prepared(a,b),dtype=a.data.dtype)
+        else:
+            d = metric.pairwise(a.data,b.data,weights)
+    if not (a.complete and b.complete):
+        d[a.common(b,False) == 0] = numpy.nan
+    return d
+
+def _spearmanpairwise(a,b,dist):
+    """Block kernel for the spearman distances.
+    
+    Each row is ranked once over the dimensions it has and the ranks are
+    compared with the pearson distance given by dist.  Those ranks are only 
+    right for pairs missing the same dimensions, so the other pairs are ranked
+    again over the dimensions they have in common.
+    """
+    d = _pairwise(PreparedData(_rankdata(a)),PreparedData(_rankdata(b)),numpy.ones(a.shape[1],dtype=a.dtype),metrics[dist])
+    apresent = (~numpy.isnan(a)).astype(a.dtype)
+    bpresent = (~numpy.isnan(b)).astype(b.dtype)
+    n = numpy.dot(apresent,numpy.transpose(bpresent))
+    same = (n == numpy.sum(apresent,axis=1)[:,numpy.newaxis])*(n == numpy.sum(bpresent,axis=1))
+    for i,j in zip(*numpy.nonzero((n > 0)*~same)):
+        d[i,j] = spearman(a[i],b[j],dist)
+    return d
+
+def _correlationpairwise(a,b,weights,dist,kernel):
+    """Block kernel for the pearson distances.
+    
+    Rows without missing data go through _correlation; only pairs involving a
+    row with missing data are compared by broadcasting kernel, which masks 
+    each pair.
+    """
+    d = numpy.zeros((len(a),len(b)),dtype=a.dtype)
+    acomplete = ~numpy.any(numpy.isnan(a),axis=1)
+    bcomplete = ~numpy.any(numpy.isnan(b),axis=1)
+    d[numpy.ix_(acomplete,bcomplete)] = _correlation(a[acomplete],b[bcomplete],weights,dist)
+    d[~acomplete] = kernel(a[~acomplete][:,numpy.newaxis,:],b[numpy.newaxis,:,:],weights)
+    d[numpy.ix_(acomplete,~bcomplete)] = kernel(a[acomplete][:,numpy.newaxis,:],b[~bcomplete][numpy.newaxis,:,:],weights)
+    return d
+
+def _sumsquares(a,b):
+    """Weighted sum of squared differences over the dimensions pairs share.
+    
+    Uses the expansion (a-b)**2 = a**2 - 2*a*b + b**2 so that the sum is made
+    of three matrix products of the masked data.  The data is first centred on
+    the mean of b to reduce round off, and pairs whose sum is still small 
+    compared to the size of the points are summed directly.
+    
+    Parameters:
+        a,b : PreparedData
+            The data points.
+    Returns:
+        s : ndarray
+            Rank 2 array where s[i,j] is the sum for a.data[i] and b.data[j].
+    """
+    w = a.weights
+    centre = numpy.sum(b.filled,axis=0)/numpy.maximum(numpy.sum(b.valid,axis=0),1)
+    x = (a.filled-centre)*a.valid
+    y = (b.filled-centre)*b.valid
+    xx = numpy.dot(x**2,w)
+    yy = numpy.dot(y**2,w)
+    if a.complete and b.complete:
+        s = xx[:,numpy.newaxis] + yy
+    else:
+        s = numpy.dot(x**2*w,numpy.transpose(b.valid).astype(x.dtype)) + numpy.dot(a.valid*w,numpy.transpose(y**2))
+    s -= 2*numpy.dot(x*w,numpy.transpose(y))
+    i,j = numpy.nonzero(s <= numpy.sqrt(numpy.finfo(s.dtype).eps)*(xx[:,numpy.newaxis]+yy))
+    if len(i) > 0:
+        s[i,j] = numpy.dot(((x[i]-y[j])*(a.valid[i]*b.valid[j]))**2,w)
+    return s
+
+def _euclideanprepared(a,b):
+    """Block kernel for the euclidean distance."""
+    return numpy.sqrt(_sumsquares(a,b)/a.common(b))
+
+def _sqeuclideanprepared(a,b):
+    """Block kernel for the squared euclidean distance."""
+    return _sumsquares(a,b)/a.common(b)
+
+def _minkowskiprepared(a,b,p):
+    """Block kernel for the cityblock, minkowski and chebychev distances."""
+    diff = a.filled[:,numpy.newaxis,:]-b.filled[numpy.newaxis,:,:]
+    if not (a.complete and b.complete):
+        diff *= a.valid[:,numpy.newaxis,:]*b.valid[numpy.newaxis,:,:]
+    if p == numpy.inf:
+        numpy.abs(diff,out=diff)
+        if not numpy.all(a.weights > 0):
+            diff *= a.weights > 0
+        return numpy.max(diff,axis=-1,initial=0)
+    return _root(numpy.dot(_powabs(diff,p),a.weights)/a.common(b),p)
+
+def _powabs(x,p):
+    """abs(x)**p computed in place, by multiplication alone for p of 1 to 4."""
+    numpy.abs(x,out=x)
+    if p == 2:
+        x *= x
+    elif p == 3:
+        x *= x*x
+    elif p == 4:
+        x *= x
+        x *= x
+    elif p != 1:
+        x **= p
+    return x
+
+def _root(x,p):
+    """The pth root of x, using square roots where possible."""
+    if p == 1:
+        return x
+    elif p == 2:
+        return numpy.sqrt(x)
+    elif p == 4:
+        return numpy.sqrt(numpy.sqrt(x))
+    return x**(1/p)
+
+def _matchingprepared(a,b,dist):
+    """Block kernel for the hamming and jaccard families.
+    
+    As with hamming, dimensions missing from either point count as mismatches
+    in the hamming family.
+    """
+    mismatch = a.filled[:,numpy.newaxis,:] != b.filled[numpy.newaxis,:,:]
+    if not (a.complete and b.complete):
+        mismatch *= a.valid[:,numpy.newaxis,:]*b.valid[numpy.newaxis,:,:]
+    mismatch = numpy.dot(mismatch.astype(a.weights.dtype),a.weights)
+    N = a.common(b)
+    if dist in ['h','t','y']:
+        d = (mismatch + numpy.sum(a.weights) - N)/N
+    else:
+        azero = (a.data == 0)*a.weights
+        bzero = numpy.transpose(b.data == 0).astype(azero.dtype)
+        d = mismatch/(N - numpy.dot(azero,bzero))
+    if dist in ['t','z']:
+        d = 2./(1./d+1.)
+    elif dist in ['y','d']:
+        d = 1./(2./d-1.)
+    return d
+
+def _binary(a,b,m,dist):
+    """Binary distances between each row of a and each row of b.
+    
+    Gives the same results as the h, t, y, j, d and z distances with equal
+    weights, including counting dimensions missing from either point as
+    mismatches in the hamming distance.
+    
+    Parameters:
+        a,b : ndarray
+            Data packed by _packbinary.
+        m : integer
+            The number of dimensions before packing.
+        dist : string
+            The distance alias.
+    Returns:
+        d : ndarray
+            Rank 2 array where d[i,j] is the distance between a[i] and b[j].
+    """
+    abits = a[:,numpy.newaxis,:,0]
+    bbits = b[numpy.newaxis,:,:,0]
+    valid = a[:,numpy.newaxis,:,1] & b[numpy.newaxis,:,:,1]
+    N = _popsum(valid)
+    mismatch = _popsum((abits ^ bbits) & valid)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if dist in ['h','t','y']:
+            d = (mismatch + m - N)/N
+        else:
+            d = mismatch/_popsum((abits | bbits) & valid)
+        if dist in ['t','z']:
+            d = 2./(1./d+1.)
+        elif dist in ['y','d']:
+            d = 1./(2./d-1.)
+    d[N == 0] = numpy.nan
+    return d
+
+def _correlation(a,b,weights,dist):
+    """Pearson family distances between rows of a and b without missing data.
+    
+    The mean, standard deviation or norm of each row is found once and the 
+    sums over the dimensions of each pair are all done with one matrix product.
+    
+    Parameters:
+        a,b : ndarray
+            Rank 2 float arrays with the same number of columns and no missing
+            data.
+        weights : ndarray
+            The weights for each dimension.
+        dist : string
+            One of 'c', 'a', 'u', 'r' or 'x'.
+    Returns:
+        d : ndarray
+            Rank 2 array where d[i,j] is the distance between a[i] and b[j].
+    """
+    N = numpy.sum(weights)
+    if dist in ['c','a']:
+        a = a - numpy.dot(a,weights)[:,numpy.newaxis]/N
+        b = b - numpy.dot(b,weights)[:,numpy.newaxis]/N
+    a = a/numpy.sqrt(numpy.dot(a**2,weights)/N)[:,numpy.newaxis]
+    b = b/numpy.sqrt(numpy.dot(b**2,weights)/N)[:,numpy.newaxis]
+    if dist in ['c','a']:
+        #pearson sums with nansum, so a constant row does not correlate with
+        #anything rather than giving nan.
+        a[numpy.isnan(a)] = 0.
+        b[numpy.isnan(b)] = 0.
+    r = numpy.clip(numpy.dot(a*weights,numpy.transpose(b))/N,-1.,1.)
+    if dist == 'r':
+        return numpy.arccos(r)/numpy.pi
+    d = (1. - r)/2.
+    if dist == 'a':
+        d = 1. - numpy.abs(d-1)
+    elif dist == 'x':
+        d = 1. - numpy.abs(2.*d-1)
+    return d
+
+def _overlap(a,b,f):
+    """Sums f over the dimensions in which both points of a pair are nonzero.
+    
+    Every nonzero element of a is matched with the nonzero elements of b in 
+    the same column, so the work done is that of the sparse matrix product of
+    a and b.
+    
+    Parameters:
+        a,b : sparse matrix
+            csr matrices with the same number of columns.
+        f : function
+            Called as f(x,y,k) with rank 1 arrays holding the nonzero elements
+            x of a and y of b which share column k, returning a rank 1 array.
+    Returns:
+        s : ndarray
+            Rank 2 array where s[i,j] is the sum of f for a[i] and b[j].
+    """
+    b = scipy.sparse.csc_matrix(b)
+    arows = numpy.repeat(numpy.arange(a.shape[0]),numpy.diff(a.indptr))
+    counts = numpy.diff(b.indptr)[a.indices]
+    starts = numpy.cumsum(counts)-counts
+    index = numpy.arange(numpy.sum(counts))-numpy.repeat(starts-b.indptr[a.indices],counts)
+    i = numpy.repeat(arows,counts)
+    k = numpy.repeat(a.indices,counts)
+    values = f(numpy.repeat(a.data,counts),b.data[index],k)
+    s = numpy.bincount(i*b.shape[0]+b.indices[index],values,a.shape[0]*b.shape[0])
+    return s.reshape((a.shape[0],b.shape[0]))
+
+def _rowsum(x,weights):
+    """Weighted sum of each row of sparse matrix x as a rank 1 array."""
+    return numpy.asarray(x @ weights).reshape(x.shape[0])
+
+def _sumsquaressparse(a,b,weights,dist):
+    """Sparse kernel for the euclidean and squared euclidean distances.
+    
+    As in _sumsquares the sum of squares comes from the expansion
+    (a-b)**2 = a**2 - 2*a*b + b**2, and pairs whose sum is small compared to
+    the size of the points are summed directly.
+    """
+    xx = _rowsum(a.multiply(a),weights)
+    yy = _rowsum(b.multiply(b),weights)
+    s = xx[:,numpy.newaxis] + yy - 2*(a.multiply(weights[numpy.newaxis,:]) @ b.T).toarray()
+    i,j = numpy.nonzero(s <= numpy.sqrt(numpy.finfo(s.dtype).eps)*(xx[:,numpy.newaxis]+yy))
+    if len(i) > 0:
+        diff = scipy.sparse.csr_matrix(a[i] - b[j])
+        s[i,j] = _rowsum(diff.multiply(diff),weights)
+    s = numpy.maximum(s,0)/numpy.sum(weights)
+    if dist == 'e':
+        return numpy.sqrt(s)
+    return s
+
+def _cityblocksparse(a,b,weights):
+    """Sparse kernel for the cityblock distance.
+    
+    The sum of abs(a) and abs(b) over all dimensions is corrected on the 
+    dimensions where both are nonzero.
+    """
+    s = _rowsum(abs(a),weights)[:,numpy.newaxis] + _rowsum(abs(b),weights)
+    s += _overlap(a,b,lambda x,y,k: weights[k]*(numpy.abs(x-y)-numpy.abs(x)-numpy.abs(y)))
+    return numpy.maximum(s,0)/numpy.sum(weights)
+
+def _correlationsparse(a,b,weights,dist):
+    """Sparse kernel for the uncentered pearson distances."""
+    xx = numpy.sqrt(_rowsum(a.multiply(a),weights))
+    yy = numpy.sqrt(_rowsum(b.multiply(b),weights))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        r = numpy.clip((a.multiply(weights[numpy.newaxis,:]) @ b.T).toarray()/xx[:,numpy.newaxis]/yy,-1.,1.)
+    if dist == 'r':
+        return numpy.arccos(r)/numpy.pi
+    elif dist == 'x':
+        return 1. - numpy.abs(r)
+    return (1. - r)/2.
+
+def _matchingsparse(a,b,weights,dist):
+    """Sparse kernel for the hamming and jaccard families.
+    
+    Dimensions in which both points are 0 are matches, and for the jaccard 
+    family are left out, so only the nonzero elements need to be compared.
+    """
+    anz = scipy.sparse.csr_matrix(a != 0,dtype=a.dtype)
+    bnz = scipy.sparse.csr_matrix(b != 0,dtype=b.dtype)
+    union = _rowsum(anz,weights)[:,numpy.newaxis] + _rowsum(bnz,weights) - (anz.multiply(weights[numpy.newaxis,:]) @ bnz.T).toarray()
+    mismatch = union - _overlap(a,b,lambda x,y,k: weights[k]*(x == y))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if dist in ['h','t','y']:
+            d = mismatch/numpy.sum(weights)
+        else:
+            d = mismatch/union
+        if dist in ['t','z']:
+            d = 2./(1./d+1.)
+        elif dist in ['y','d']:
+            d = 1./(2./d-1.)
     return d
 
 def euclidean(a,b,weights):
@@ -159,8 +1322,8 @@ def euclidean(a,b,weights):
         weight of the ith dimension.
     """
     result = weights*(a-b)**2
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)
-    return numpy.sqrt(numpy.nansum(result)/N)
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)
+    return numpy.sqrt(numpy.nansum(result,axis=-1)/N)
 
 def sqeuclidean(a,b,weights):
     """The normalized euclidian distance between two data points.
@@ -186,8 +1349,8 @@ def sqeuclidean(a,b,weights):
         weight of the ith dimension.
     """
     result = weights*(a-b)**2
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)
-    return numpy.nansum(result)/N
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)
+    return numpy.nansum(result,axis=-1)/N
     
 def cityblock(a,b,weights):
     """Calculates the normalized city block distance between two data points.
@@ -213,8 +1376,8 @@ def cityblock(a,b,weights):
         weight of the ith dimension.
     """
     result = weights*numpy.abs((a-b))
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)
-    return numpy.nansum(result)/N
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)
+    return numpy.nansum(result,axis=-1)/N
 
 def hamming(a,b,weights):
     """Calculates the hamming distance between two data points.
@@ -245,8 +1408,8 @@ def hamming(a,b,weights):
         vectors, and w[i] is the weight of the ith dimension.
     """
     result = weights*(a != b)
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)
-    return numpy.nansum(result)/N
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)
+    return numpy.nansum(result,axis=-1)/N
 
 def pearson(a,b,weights):
     """Distance between two points based on the pearson correlation coefficient.
@@ -280,13 +1443,13 @@ def pearson(a,b,weights):
     """
     a = ~numpy.isnan(b)*a
     b = ~numpy.isnan(a)*b
-    amean = numpy.nansum(a*weights)/numpy.nansum(~numpy.isnan(a)*weights)
-    bmean = numpy.nansum(b*weights)/numpy.nansum(~numpy.isnan(b)*weights)
-    astd = numpy.sqrt(numpy.nansum((weights*(a-amean)**2))/numpy.nansum((~numpy.isnan(a)*weights)))
-    bstd = numpy.sqrt(numpy.nansum((weights*(b-bmean)**2))/numpy.nansum((~numpy.isnan(b)*weights)))
+    amean = numpy.nansum(a*weights,axis=-1,keepdims=True)/numpy.nansum(~numpy.isnan(a)*weights,axis=-1,keepdims=True)
+    bmean = numpy.nansum(b*weights,axis=-1,keepdims=True)/numpy.nansum(~numpy.isnan(b)*weights,axis=-1,keepdims=True)
+    astd = numpy.sqrt(numpy.nansum((weights*(a-amean)**2),axis=-1,keepdims=True)/numpy.nansum((~numpy.isnan(a)*weights),axis=-1,keepdims=True))
+    bstd = numpy.sqrt(numpy.nansum((weights*(b-bmean)**2),axis=-1,keepdims=True)/numpy.nansum((~numpy.isnan(b)*weights),axis=-1,keepdims=True))
     result = weights*((a-amean)/astd)*((b-bmean)/bstd)
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)
-    return (1. - numpy.nansum(result)/N)/2.
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)
+    return (1. - numpy.nansum(result,axis=-1)/N)/2.
 
 def abspearson(a,b,weights):
     """Distance between two points based on the pearson correlation coefficient.
@@ -360,7 +1523,7 @@ def upearson(a,b,weights):
     result = weights*a*b
     d1 = weights*a**2
     d2 = weights*b**2
-    return (1. - numpy.nansum(result)/numpy.sqrt((numpy.nansum(d1)*numpy.nansum(d2))))/2.
+    return (1. - numpy.nansum(result,axis=-1)/numpy.sqrt((numpy.nansum(d1,axis=-1)*numpy.nansum(d2,axis=-1))))/2.
 
 def absupearson(a,b,weights):
     """Distance between two points based on the pearson correlation coefficient.
@@ -441,7 +1604,9 @@ def acosine(a,b,weights):
     result = weights*a*b
     d1 = weights*a**2
     d2 = weights*b**2
-    return (numpy.arccos(numpy.nansum(result)/numpy.sqrt((numpy.nansum(d1)*numpy.nansum(d2)))))/numpy.pi
+    r = numpy.nansum(result,axis=-1)/numpy.sqrt((numpy.nansum(d1,axis=-1)*numpy.nansum(d2,axis=-1)))
+    #Rounding can put r just outside [-1,1] for parallel vectors
+    return numpy.arccos(numpy.clip(r,-1.,1.))/numpy.pi
 
 def spearman(a,b,dist = 'c'):
     """Pearson distance with rank arrays instead of data arrays.
@@ -465,15 +1630,10 @@ def spearman(a,b,dist = 'c'):
     """
     #Because nan variables (missing data) cannot be ranked they screw up the 
     #ranking function and must be eliminated before hand.
-    missing = numpy.isnan(a)+numpy.isnan(b)
-    arankable = []
-    brankable = []
-    for i in range(len(missing)):
-        if not missing[i]:
-            arankable.append(a[i])
-            brankable.append(b[i])
-    arank = scipy.stats.rankdata(numpy.array(arankable))
-    brank = scipy.stats.rankdata(numpy.array(brankable))
+    present = ~(numpy.isnan(a)+numpy.isnan(b))
+    dtype = numpy.result_type(a,b,numpy.float32)
+    arank = scipy.stats.rankdata(a[present]).astype(dtype)
+    brank = scipy.stats.rankdata(b[present]).astype(dtype)
     if dist == 'c':
         d = pearson(arank,brank,numpy.ones_like(arank))
     elif dist == 'a':
@@ -486,6 +1646,35 @@ def spearman(a,b,dist = 'c'):
         d = absupearson(arank,brank,numpy.ones_like(arank))
     return d
 
+def _rankdata(x):
+    """Ranks along the last axis of x, ignoring missing data.
+    
+    Tied values are given the average of the ranks they span, as with 
+    scipy.stats.rankdata, and missing data stays nan.
+    
+    Parameters:
+        x : ndarray
+            Rank 2 array.
+    Returns:
+        rank : ndarray
+            Float array the same shape as x with the rank of each value within
+            its row, starting from 1.
+    """
+    order = numpy.argsort(x,axis=1,kind='stable')
+    rows = numpy.arange(len(x))[:,numpy.newaxis]
+    index = numpy.arange(x.shape[1])
+    s = x[rows,order]
+    new = numpy.ones(s.shape,dtype=bool)
+    new[:,1:] = s[:,1:] != s[:,:-1]
+    last = numpy.ones(s.shape,dtype=bool)
+    last[:,:-1] = new[:,1:]
+    start = numpy.maximum.accumulate(numpy.where(new,index,0),axis=1)
+    end = numpy.minimum.accumulate(numpy.where(last,index,len(index))[:,::-1],axis=1)[:,::-1]
+    rank = numpy.empty(x.shape,dtype=x.dtype)
+    rank[rows,order] = (start+end)/2. + 1
+    rank[numpy.isnan(x)] = numpy.nan
+    return rank
+
 def kendall(a,b):
     """Calculates the distance between two points based on kendall's tau.
     
@@ -497,56 +1686,140 @@ def kendall(a,b):
     To convert tau to a normalized distance it is subtracted from 1 and divided
     by 2.
     
+    The number of discordant pairs is found by counting the inversions needed
+    to merge sort one ranking when ordered by the other, as described in 
+    Knight, W. R. (1966).  A Computer Method for Calculating Kendall's Tau with
+    Ungrouped Data.  Journal of the American Statistical Association, 61(314),
+    436-439.  This takes O(n log n) operations instead of O(n^2).
+    
+    Like the other distance functions, kendall works along the last axis of 
+    its arguments and broadcasts, so kendall(a,b) with a rank 1 and b rank 2 
+    gives the distance from a to every row of b.
+    
     Parameters:
         a,b : ndarray
-            The data points.  Expects two rank 1 arrays of the same length.
+            The data points.  Expects two arrays whose last axes have the same
+            length.
     Returns:
-        d : float
+        d : float or ndarray
             The kedall distance between the two data points.
     """
+    dtype = numpy.result_type(numpy.asarray(a).dtype,numpy.asarray(b).dtype,numpy.float32)
+    a,b = numpy.broadcast_arrays(numpy.asarray(a,dtype),numpy.asarray(b,dtype))
+    shape = a.shape[:-1]
+    a = a.reshape((numpy.prod(shape,dtype=int),a.shape[-1]))
+    b = b.reshape(a.shape)
     #Because nan variables (missing data) cannot be ranked they screw up the 
-    #ranking function and must be eliminated before hand.
+    #ranking function and must be eliminated before hand.  Pairs without 
+    #missing data are done all at once, the rest one at a time.
     missing = numpy.isnan(a)+numpy.isnan(b)
-    arankable = []
-    brankable = []
-    for i in range(len(missing)):
-        if not missing[i]:
-            arankable.append(a[i])
-            brankable.append(b[i])
-    arank = scipy.stats.rankdata(numpy.array(arankable))
-    brank = scipy.stats.rankdata(numpy.array(brankable))
-    reorder = []
-    for i in range(len(arank)):
-        reorder.append([arank[i],brank[i]])
-    reorder.sort()
-    #brankreorder = numpy.array(reorder)[:,1]
-    S = 0.
-    for i in range(len(reorder)):
-        for j in range(i+1,len(reorder)):
-            if reorder[i][0] != reorder[j][0]:
-                if reorder[i][1] < reorder[j][1]:
-                    S += 1.
-                elif reorder[i][1] > reorder[j][1]:
-                    S -= 1.
-    N = numpy.sum(1-missing)
-    N = N*(N-1)/2
-    aunique = numpy.unique(arank)
-    bunique = numpy.unique(brank)
-    T = 0
-    U = 0
-    if len(aunique) < len(arank):
-        for i in aunique:
-            t = list(arank).count(i)
-            if t > 1:
-                T += t*(t-1.)/2.
-    if len(bunique) < len(brank):
-        for i in bunique:
-            u = list(brank).count(i)
-            if u > 1:
-                U += u*(u-1.)/2.
-    tau = S/numpy.sqrt((N-T)*(N-U))
-    return (1 - tau)/2.
+    whole = ~numpy.any(missing,axis=1)
+    tau = numpy.zeros(len(a))
+    if numpy.any(whole):
+        tau[whole] = _kendalltau(a[whole],b[whole])
+    for i in numpy.flatnonzero(~whole):
+        present = ~missing[i]
+        tau[i] = _kendalltau(a[i,present][numpy.newaxis],b[i,present][numpy.newaxis])[0]
+    d = ((1 - tau)/2.).astype(dtype)
+    if shape == ():
+        return d[0]
+    return d.reshape(shape)
+
+def _kendalltau(a,b):
+    """Kendall's tau_b between corresponding rows of a and b.
+    
+    Parameters:
+        a,b : ndarray
+            Rank 2 arrays of the same shape without missing data.
+    Returns:
+        tau : ndarray
+            Rank 1 array of tau_b for each row.
+    """
+    k,n = a.shape
+    rows = numpy.arange(k)[:,numpy.newaxis]
+    arank,T = _ranktie(a)
+    brank,U = _ranktie(b)
+    #Ordering by a and then b means tied values of a never count as inversions 
+    #of b and pairs tied in both can be found from the sorted keys.
+    keys = arank*n+brank
+    order = numpy.argsort(keys,axis=1,kind='stable')
+    V = _tiepairs(keys[rows,order])
+    inversions = _inversions(brank[rows,order],n)
+    N = n*(n-1)/2.
+    S = N - T - U + V - 2*inversions
+    return S/numpy.sqrt((N-T)*(N-U))
+
+def _ranktie(x):
+    """Dense integer ranks along the last axis of x and the number of tied pairs.
+    
+    Parameters:
+        x : ndarray
+            Rank 2 array.
+    Returns:
+        rank : ndarray
+            Integer array the same shape as x where equal values share a rank
+            and ranks run from 0 without gaps.
+        ties : ndarray
+            Rank 1 array with the number of pairs of equal values in each row,
+            i.e. the sum of t*(t-1)/2 over groups of t ties.
+    """
+    order = numpy.argsort(x,axis=1,kind='stable')
+    rows = numpy.arange(len(x))[:,numpy.newaxis]
+    s = x[rows,order]
+    new = numpy.ones(s.shape,dtype=bool)
+    new[:,1:] = s[:,1:] != s[:,:-1]
+    dense = numpy.cumsum(new,axis=1) - 1
+    rank = numpy.empty(x.shape,dtype=numpy.int64)
+    rank[rows,order] = dense
+    return rank,_tiepairs(dense)
+
+def _tiepairs(s):
+    """Number of pairs of equal values in each row of a row-sorted array.
+    
+    Each element is counted once for every equal element before it, which sums
+    to t*(t-1)/2 for a group of t ties.
+    """
+    index = numpy.arange(s.shape[1])
+    new = numpy.ones(s.shape,dtype=bool)
+    new[:,1:] = s[:,1:] != s[:,:-1]
+    start = numpy.maximum.accumulate(numpy.where(new,index,0),axis=1)
+    return numpy.sum(index-start,axis=1)
+
+def _inversions(x,m):
+    """Number of inversions in each row of x, counted by a bottom up merge sort.
     
+    Every row is merged at the same time.  During each pass the values are
+    offset by the run they belong to, so that a single searchsorted can count, 
+    for every element of a right hand run, the elements of its left hand run 
+    which are greater.  A stable sort of two sorted runs is linear, so each pass
+    is O(n) and the whole count is O(n log n).
+    
+    Parameters:
+        x : ndarray
+            Rank 2 integer array with values in range(m).
+        m : int
+            Upper limit of the values in x.
+    Returns:
+        count : ndarray
+            Rank 1 array with the number of pairs i < j where x[i] > x[j].
+    """
+    k,n = x.shape
+    count = numpy.zeros(k)
+    index = numpy.arange(n)
+    rows = numpy.arange(k)[:,numpy.newaxis]
+    width = 1
+    while width < n:
+        run = index//(2*width)
+        offset = (rows*(run[-1]+1) + run)*m
+        keys = x + offset
+        right = (index//width)%2 == 1
+        left = keys[:,~right].ravel()
+        end = rows*numpy.sum(~right) + (run[right]+1)*width
+        count += numpy.sum(end-numpy.searchsorted(left,keys[:,right],'right'),axis=1)
+        x = numpy.sort(keys,axis=1,kind='stable') - offset
+        width *= 2
+    return count
+
 def rogerstanimoto(a,b,weights):
     """Hamming distance with similarties weighted extra.
     
@@ -614,8 +1887,8 @@ def jaccard(a,b,weights):
             The distance between the two data points using this metric.
     """
     result = weights*(a != b)*~numpy.isnan(a)*~numpy.isnan(b)
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)-numpy.nansum((a == 0)*(b == 0)*weights)
-    return numpy.nansum(result)/N
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)-numpy.nansum((a == 0)*(b == 0)*weights,axis=-1)
+    return numpy.nansum(result,axis=-1)/N
     
 def dice(a,b,weights):
     """The Jaccard distance with simmilarities weighted extra.
@@ -668,8 +1941,9 @@ def minkowski(a,b,weights,p):
         weights : ndarray
             The weights for each dimension.  Expects rank 1 array of same 
             length as a & b.
-        p : integer
-            The order of the Minkowski distance desired.
+        p : float
+            The order of the Minkowski distance desired.  Need not be an
+            integer, but must be positive.
     Returns:
         d : float
             The Minkowski distance between the two data points.
@@ -677,19 +1951,46 @@ def minkowski(a,b,weights,p):
         The cityblock distance (L1) the euclidian (L2) and the chebychev
         (Linf) are special cases of the minkowski distance.
     """
-    result = weights*numpy.abs(a-b)**p
-    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights)
-    return (numpy.nansum(result)/N)**(1/p)
+    result = weights*_powabs(numpy.subtract(a,b,dtype=numpy.result_type(a,b,numpy.float32)),p)
+    N = numpy.nansum(~numpy.isnan(a)*~numpy.isnan(b)*weights,axis=-1)
+    return _root(numpy.nansum(result,axis=-1)/N,p)
 
-def chebychev(a,b):
+def chebychev(a,b,weights=None):
     """Calculates the Chebychev distance between two data points.
     
     Parameters:
         a,b : ndarray
             The data points.  Expects two rank 1 arrays of the same length.
+        weights : ndarray
+            Optional.  The weights for each dimension.  Expects rank 1 array
+            of same length as a & b.
     Returns:
         d : float
             The chebychev distance between the two data points.
+    Notes:
+        The chebychev distance is the largest absolute difference between a
+        and b over the dimensions they have in common.  It is the limit of 
+        the normalized minkowski distance as p goes to infinity, so 
+        dimensions with a weight of 0 are ignored but the size of the other
+        weights makes no difference.
     """
-    result = numpy.nanmax(a-b)
-    return result
+    result = numpy.abs(a-b)
+    if weights is not None:
+        result = numpy.where(weights > 0,result,numpy.nan)
+    return numpy.nanmax(result,axis=-1)
+
+registermetric('e',euclidean,'euclidean',metric=True,broadcast=True,prepared=_euclideanprepared,sparse=functools.partial(_sumsquaressparse,dist='e'))
+registermetric('p',sqeuclidean,'squared euclidean',broadcast=True,prepared=_sqeuclideanprepared,sparse=functools.partial(_sumsquaressparse,dist='p'))
+registermetric('b',cityblock,'cityblock',metric=True,broadcast=True,prepared=functools.partial(_minkowskiprepared,p=1),sparse=_cityblocksparse)
+registermetric('h',hamming,'hamming',metric=True,broadcast=True,binary=functools.partial(_binary,dist='h'),prepared=functools.partial(_matchingprepared,dist='h'),sparse=functools.partial(_matchingsparse,dist='h'))
+for _alias,_kernel,_name in [('c',pearson,'pearson'),('a',abspearson,'absolute pearson'),('u',upearson,'uncentered pearson'),('r',acosine,'arccosine'),('x',absupearson,'absolute uncentered pearson')]:
+    registermetric(_alias,_kernel,_name,metric=_alias == 'r',broadcast=True,pairwise=functools.partial(_correlationpairwise,dist=_alias,kernel=_kernel),sparse=functools.partial(_correlationsparse,dist=_alias) if _alias in ['u','r','x'] else None)
+    registermetric('s'+_alias,functools.partial(spearman,dist=_alias),'spearman',weights=False,pairwise=functools.partial(_spearmanpairwise,dist=_alias))
+registermetric('k',kendall,'kendall',weights=False,broadcast=True)
+registermetric('t',rogerstanimoto,'rogers tanimoto',broadcast=True,binary=functools.partial(_binary,dist='t'),prepared=functools.partial(_matchingprepared,dist='t'),sparse=functools.partial(_matchingsparse,dist='t'))
+registermetric('y',sokalsneathsym,'sokal sneath',broadcast=True,binary=functools.partial(_binary,dist='y'),prepared=functools.partial(_matchingprepared,dist='y'),sparse=functools.partial(_matchingsparse,dist='y'))
+registermetric('j',jaccard,'jaccard',broadcast=True,binary=functools.partial(_binary,dist='j'),prepared=functools.partial(_matchingprepared,dist='j'),sparse=functools.partial(_matchingsparse,dist='j'))
+registermetric('d',dice,'dice',broadcast=True,binary=functools.partial(_binary,dist='d'),prepared=functools.partial(_matchingprepared,dist='d'),sparse=functools.partial(_matchingsparse,dist='d'))
+registermetric('z',sokalsneathasym,'sokal sneath',broadcast=True,binary=functools.partial(_binary,dist='z'),prepared=functools.partial(_matchingprepared,dist='z'),sparse=functools.partial(_matchingsparse,dist='z'))
+registermetric('Linf',chebychev,'chebychev',metric=True,broadcast=True,prepared=functools.partial(_minkowskiprepared,p=numpy.inf))
+del _alias,_kernel,_name
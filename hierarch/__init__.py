@@ -9,9 +9,11 @@ in the source code.
 """
 
 import numpy
+import scipy.sparse
 import cluster.stats as stats
 import cluster._support as _support
 import cluster.distances as distances
+import cluster.neighbors as neighbors
 import types
 
 rtol = 1.0000000000000001e-005
@@ -456,7 +458,7 @@ def loadaggtree(filename):
         nodes.append(AggNode(left,right,distance,leftalias,rightalias))
     return AggTree(nodes)
 
-def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancematrix=None,verbose=False):
+def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancematrix=None,verbose=False,dtype=float,nneighbors=None):
     """Implements agglomerative hierarchical clustering.
     
     Where possible this function makes use of the Lance-Williams update formula
@@ -543,24 +545,59 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
                             cluster.  Values should be 0 for clusters which
                             don't yet exist.
                        See wardLN for an example function.
-        distancematrix : ndarray or list of ndarrays
-            Either a rank 2 array or a list of rank 1 arrays containing the 
-            distances between each data point.  distancematrix[i][j] is the
-            distance between point i and point j.  If distancematrix
-            is given without data, then centroid-linkage (link == 'c*') cannot
-            be used except in 1 case: link == 'ca' and dist == 'e'.
+        distancematrix : ndarray or stats.CondensedDistanceMatrix or list
+            Either a rank 2 array, a CondensedDistanceMatrix, or a list of rank
+            1 arrays containing the distances between each data point.  
+            distancematrix[i][j] is the distance between point i and point j.
+            For single-linkage (link == 's') it may also be a scipy.sparse
+            matrix such as one made by stats.distancegraph, whose stored 
+            elements are the only distances considered.  The tree is built
+            from the minimum spanning tree of the graph, without a dense
+            matrix.  Parts of the graph which are not joined are linked by 
+            their exact smallest distance, which requires data.  tie is 
+            ignored.
+            If distancematrix is given without data, then centroid-linkage
+            (link == 'c*') cannot be used except in 1 case: link == 'ca' and
+            dist == 'e'.
             If distancematrix is given then data, weights, and dist are ignored
             for all non-centroid methods and for the centroid method mentioned
             above.
         verbose: boolean
             If True then the algorithm will print periodic updates to the screen
             to indicate where it is in the process.
+        dtype : data-type
+            The floating point type of the working distance matrix.  
+            numpy.float32 halves the memory it uses.
+        nneighbors : integer
+            Optional.  Only for single-linkage (link == 's').  If given, the
+            distance matrix is not computed.  Instead the approximate 
+            nneighbors nearest neighbours of each data point are found with a
+            neighbors.RPForest, or exactly with a neighbors.VPTree for the 
+            other true metrics, and the tree is built from the minimum 
+            spanning tree of the graph joining each point to its neighbours.
+            Parts of the graph which are not joined are linked by their exact
+            smallest distance.  The result is usually the exact single-linkage
+            tree when nneighbors is large enough, and takes time and memory
+            roughly proportional to the number of data points rather than its
+            square.  Requires data and one of the distances supported by
+            RPForest or VPTree.  tie is ignored.
     Returns:
         tree : AggTree
             The hierarchical clustering solution.
     See Also:
-        stats.singleclustercentroid, stats.fulldistancematrix, wardLN
+        stats.singleclustercentroid, stats.fulldistancematrix, wardLN, 
+        neighbors.RPForest, stats.distancegraph
     """
+    if scipy.sparse.issparse(distancematrix):
+        if link != 's':
+            raise ValueError('A sparse distancematrix can only be used with single-linkage.')
+        return _graphsinglelink(distancematrix,data,weights,dist,verbose,dtype)
+    elif nneighbors is not None:
+        if link != 's':
+            raise ValueError('nneighbors can only be used with single-linkage.')
+        elif data is None:
+            raise RuntimeError('nneighbors cannot be used without data.')
+        return _approximatesinglelink(data,weights,dist,nneighbors,verbose,dtype)
     if data is None and distancematrix is None:
         raise RuntimeError('Either data or distancematrix must be given.')
     elif not (data is None) and not (distancematrix is None) and len(data) != len(distancematrix):
@@ -568,22 +605,28 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
     elif data is None and type(link) is bytes:
         if link[0] == 'c' and not (link == 'ca' and dist == 'p'):
             raise RuntimeError('Centroid-linkage cannot be used without data.')
-    elif distancematrix is None:
+    if distancematrix is None:
+        N = len(data)
+    else:
+        N = len(distancematrix)
+    if N < 2:
+        raise ValueError('At least two data points are needed to build a tree.')
+    working = numpy.zeros((2*N-1,2*N-1),dtype=dtype)
+    if distancematrix is None:
         if verbose:
             print('Calculating distance matrix.')
-        distancematrix = stats.fulldistancematrix(data,weights,dist,verbose)
+        stats.fulldistancematrix(data,weights,dist,verbose,out=working[:N,:N],dtype=dtype)
+    elif type(distancematrix) is stats.CondensedDistanceMatrix:
+        distancematrix.square(out=working[:N,:N])
     elif type(distancematrix) is list:
-        for i in range(len(distancematrix)):
-            distancematrix[i].resize(len(distancematrix))
-        distancematrix = numpy.array(distancematrix)
-        distancematrix = distancematrix + numpy.transpose(distancematrix)
-    N = len(distancematrix)
+        for i in range(1,N):
+            working[i,:i] = working[:i,i] = distancematrix[i][:i]
+    else:
+        working[:N,:N] = distancematrix
+    distancematrix = working
     if verbose:
         print('%i joinings will be required' % (N-1))
     current = list(range(N))
-    distancematrix = numpy.resize(distancematrix,(2*N-1,N))
-    distancematrix = numpy.transpose(distancematrix).copy()
-    distancematrix = numpy.resize(distancematrix,(2*N-1,2*N-1))
     if verbose:
         print('Finding cluster 1')
     c = []
@@ -610,6 +653,8 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
     if type(link) is str:
         if link[0] == 'c':
             centroid = []
+            kernel = distances.kernel(dist,weights,dtype)
+            unweighted = distances.kernel(dist,dtype=dtype)
     LW = True
     while len(tree) < N-1:
         current.remove(n1)
@@ -691,9 +736,7 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
                                 index[m+1] += 1
                     for i in current:
                         if i >= 0:
-                            d = numpy.zeros(len(cent))
-                            for n in range(len(cent)):
-                                d[n] = distances.distance(data[i],cent[n],dist=dist)
+                            d = unweighted(numpy.asarray(data[i:i+1],dtype=dtype),numpy.asarray(cent,dtype=dtype))
                             if link[2] == 'm':
                                 distancematrix[-len(tree),i] = distancematrix[i,-len(tree)] = d.max()
                             elif link[2] == 's':
@@ -703,10 +746,7 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
                             else:
                                 raise ValueError('Link method ' + link + ' not supported.')
                         else:
-                            d = numpy.zeros((len(cent),len(centroid[i])))
-                            for n in range(len(cent)):
-                                for m in range(len(centroid[i])):
-                                    d[n][m] = distances.distance(centroid[i][m],cent[n],weights,dist)
+                            d = kernel(numpy.asarray(centroid[i],dtype=dtype),numpy.asarray(cent,dtype=dtype))
                             if link[2] == 'm':
                                 distancematrix[-len(tree),i] = distancematrix[i,-len(tree)] = d.max()
                             elif link[2] == 's':
@@ -717,11 +757,14 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
                                 raise ValueError('Link method ' + link + ' not supported.')
                     centroid[0] = cent.copy()
                 else:
+                    points = []
                     for i in current:
                         if i >= 0:
-                            distancematrix[-len(tree),i] = distancematrix[i,-len(tree)] = distances.distance(data[i],centroid[0],weights,dist)
+                            points.append(data[i])
                         else:
-                            distancematrix[-len(tree),i] = distancematrix[i,-len(tree)] = distances.distance(centroid[i],centroid[0],weights,dist)
+                            points.append(centroid[i])
+                    d = kernel(numpy.array(points,dtype=dtype),numpy.asarray(centroid[0][numpy.newaxis],dtype=dtype))
+                    distancematrix[-len(tree),current] = distancematrix[current,-len(tree)] = d[:,0]
             else:
                 raise ValueError('Link method ' + link + ' not supported.')
         elif type(link) is float:
@@ -834,6 +877,134 @@ def aggtreecluster(data=None,weights=None,dist='e',tie=None,link='m',distancemat
         tree.append(AggNode(n1,n2,m))
     return tree
 
+def _approximatesinglelink(data,weights,dist,nneighbors,verbose=False,dtype=float):
+    """Single-linkage tree from an approximate nearest neighbour graph.
+    
+    See the nneighbors option of aggtreecluster.
+    """
+    if verbose:
+        print('Finding neighbours.')
+    if distances.getmetric(dist).alias in ['e','L2','p','u','r']:
+        index = neighbors.RPForest(data,weights,dist,dtype=dtype)
+    else:
+        index = neighbors.VPTree(data,weights,dist,dtype=dtype)
+    N = len(index)
+    d,j = index.neighbors(min(nneighbors,N-1))
+    i = numpy.repeat(numpy.arange(N),d.shape[1])
+    return _graphtree(N,i,j.reshape(-1),d.reshape(-1),index.data,index.weights,dist,verbose,dtype)
+
+def _graphsinglelink(graph,data,weights,dist,verbose=False,dtype=float):
+    """Single-linkage tree from a sparse distance graph.
+    
+    See the distancematrix option of aggtreecluster.
+    """
+    if graph.shape[0] != graph.shape[1]:
+        raise ValueError('A sparse distancematrix must be square.')
+    elif not (data is None) and len(data) != graph.shape[0]:
+        raise RuntimeError('data and distancematrix are of incompatible sizes.')
+    elif not (data is None):
+        data,weights,metric = distances._prepare(data,weights,dist,dtype)
+    graph = graph.tocoo()
+    return _graphtree(graph.shape[0],graph.row,graph.col,graph.data,data,weights,dist,verbose,dtype)
+
+def _graphtree(N,i,j,d,data,weights,dist,verbose=False,dtype=float):
+    """Single-linkage tree from the edges (i[k],j[k]) of length d[k] of a
+    distance graph over N data points.
+    
+    Parts of the graph which are not joined are linked by their exact smallest
+    distance, computed from data formatted by distances._prepare.  If data is
+    None they cannot be linked and a ValueError is raised.
+    """
+    if N < 2:
+        raise ValueError('At least two data points are needed to build a tree.')
+    while True:
+        nodes,roots = _spanningtree(N,i,j,d)
+        if len(nodes) >= N-1:
+            break
+        elif data is None:
+            raise ValueError('The distance graph does not join all of the data points, so data is needed to link its parts.')
+        kernel = distances.kernel(dist,weights,dtype)
+        #Link each part of the graph except the largest to its nearest point
+        #outside of it.
+        sizes = numpy.bincount(roots,minlength=N)
+        links = []
+        for root in numpy.flatnonzero(sizes)[numpy.argsort(-sizes[sizes > 0])][1:]:
+            inside = numpy.flatnonzero(roots == root)
+            outside = numpy.flatnonzero(roots != root)
+            best = (numpy.inf,-1,-1)
+            rows = max(1,distances.maxblock//len(outside))
+            for k in range(0,len(inside),rows):
+                block = kernel(data[inside[k:k+rows]],data[outside])
+                block[numpy.isnan(block)] = numpy.inf
+                m = numpy.unravel_index(numpy.argmin(block),block.shape)
+                if block[m] < best[0]:
+                    best = (block[m],inside[k+m[0]],outside[m[1]])
+            if best[1] < 0:
+                raise ValueError('Data points with no dimensions in common with any other cannot be clustered.')
+            links.append(best)
+        if verbose:
+            print('Linking %i parts of the neighbour graph.' % (len(links)+1))
+        links = numpy.array(links)
+        i = numpy.concatenate([i,links[:,1].astype(int)])
+        j = numpy.concatenate([j,links[:,2].astype(int)])
+        d = numpy.concatenate([d,links[:,0]])
+    return _aggtree(nodes)
+
+def _spanningtree(N,i,j,d):
+    """Joins N points along the edges (i[k],j[k]) of length d[k], shortest first.
+    
+    Edges with j[k] < 0 or a distance of nan or inf are ignored.
+    
+    Returns:
+        nodes : list of AggNode
+            The joinings made, in the order they were made.
+        roots : ndarray
+            The point which represents the cluster each point is in when no
+            edges are left.
+    """
+    keep = (j >= 0)*numpy.isfinite(d)
+    i,j,d = i[keep],j[keep],d[keep]
+    order = numpy.argsort(d,kind='stable')
+    parent = list(range(N))
+    cluster = list(range(N))
+    nodes = []
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x],x = root,parent[x]
+        return root
+    i,j = i.tolist(),j.tolist()
+    for e in order:
+        a = find(i[e])
+        b = find(j[e])
+        if a != b:
+            nodes.append(AggNode(cluster[a],cluster[b],d[e]))
+            parent[b] = a
+            cluster[a] = -len(nodes)
+            if len(nodes) == N-1:
+                break
+    roots = numpy.array([find(x) for x in range(N)],dtype=int)
+    return nodes,roots
+
+def _aggtree(nodes):
+    """An AggTree of nodes given in the order they were made.
+    
+    Equivalent to AggTree(nodes[::-1]) but without checking the nodes, which
+    takes time proportional to the square of the number of nodes.
+    """
+    pop = []
+    for node in nodes:
+        pop.append(sum(pop[-x-1] if x < 0 else 1 for x in (node.left,node.right)))
+    tree = AggTree.__new__(AggTree)
+    tree.nodes = nodes[::-1]
+    tree.pop = pop[::-1]
+    tree.assigned = [nodes[0].right,nodes[0].left]
+    for node in nodes[1:]:
+        tree.assigned += [node.left,node.right]
+    return tree
+
 def wardLW(n1,n2,tree,N):
     """Calculates the coeficients for the Lance-Williams formula for Ward's method.
     
@@ -0,0 +1,503 @@
+"""Indexes for finding the nearest neighbours of data points.
+
+Finding the nearest neighbours of every point in a data set by comparing each
+point with every other takes time proportional to the square of the number of
+points.  The indexes here are built once over the rows of a data set and then
+answer nearest neighbour queries by comparing each query point with only a
+small number of candidates.
+
+A complete version history and licence and copyright information are located
+in the source code.
+"""
+
+import numpy
+from . import distances
+
+class RPForest(object):
+    """Approximate nearest neighbour index made of random projection trees.
+
+    Each tree splits the data in two at the median of its projection onto the
+    line through two randomly chosen points, and then splits each half in the
+    same way until no more than leafsize points remain.  A query point is
+    passed down every tree, and the points in the leaves it reaches are the
+    candidates it is compared with exactly.  The true nearest neighbours are
+    usually, but not always, among the candidates; more trees or larger leaves
+    find them more often at the cost of more comparisons.
+
+    Only the euclidean (e or L2), squared euclidean (p) and cosine based
+    uncentered pearson (u and r) distances are supported.  For the cosine
+    distances the trees are built over the data points scaled to unit length.
+    Missing data is treated as 0 when building the trees, and handled as usual
+    when the candidates are compared.
+
+    Properties:
+        data : ndarray
+            Rank 2 array of the indexed data points.
+        weights : ndarray
+            The weights for each dimension.
+        metric : distances.Metric
+            The distance used to compare candidates.
+        ntrees : integer
+            The number of trees.
+        leafsize : integer
+            The largest number of points in a leaf.
+    """
+    def __init__(self,data,weights=None,dist='e',ntrees=8,leafsize=32,seed=None,dtype=float):
+        """Builds the index.
+
+        Parameters:
+            data : ndarray
+                Rank 2 array.  Each row is assumed to represent a single data
+                point.
+            weights : ndarray
+                Optional.  If given, a rank 1 array with length equal to the
+                number of columns in data.  Entries specify the weight for
+                each dimension in the distance function.
+            dist : string
+                The distance alias.  One of e, L2, p, u or r.
+            ntrees : integer
+                The number of trees.
+            leafsize : integer
+                The largest number of points in a leaf.
+            seed : integer
+                Optional.  Seed for the random choice of splits.  If not given
+                numpy.random is used.
+            dtype : data-type
+                The floating point type used for the data and distances.
+        """
+        data,weights,metric = distances._prepare(data,weights,dist,dtype)
+        if metric.alias not in ['e','L2','p','u','r']:
+            raise ValueError('RPForest is not available for %s distances' % metric.name)
+        elif ntrees < 1 or leafsize < 1:
+            raise ValueError('ntrees and leafsize must be at least 1')
+        self.data = data
+        self.weights = weights
+        self.metric = metric
+        self.ntrees = int(ntrees)
+        self.leafsize = int(leafsize)
+        if seed is None:
+            random = numpy.random
+        else:
+            random = numpy.random.RandomState(seed)
+        self._complete = not numpy.any(numpy.isnan(data))
+        self._points = self._project(data)
+        self._trees = [self._tree(self._points,random) for i in range(self.ntrees)]
+    def __len__(self):
+        return len(self.data)
+    def _project(self,data):
+        """The points the trees are built from: weighted, zero filled and, for
+        the cosine distances, of unit length."""
+        points = numpy.where(numpy.isnan(data),0,data)*numpy.sqrt(self.weights)
+        if self.metric.alias in ['u','r']:
+            norm = numpy.sqrt(numpy.sum(points**2,axis=1))
+            points /= numpy.where(norm > 0,norm,1)[:,numpy.newaxis]
+        return points
+    def _tree(self,points,random):
+        """Builds one tree.
+
+        Returns:
+            root : integer
+                The root node.  Internal nodes are numbered from 0 and leaf l
+                is numbered -(l+1).
+            normals : ndarray
+                Rank 2 array with the direction projected onto at each internal
+                node.
+            offsets : ndarray
+                The projection at which each internal node splits; points at
+                or below it go to the first child.
+            children : ndarray
+                Rank 2 array with the two children of each internal node.
+            leaves : ndarray
+                Rank 2 array with the points in each leaf, padded with -1.
+        """
+        normals = []
+        offsets = []
+        children = []
+        leaves = []
+        def grow(members):
+            if len(members) <= self.leafsize:
+                leaves.append(members)
+                return -len(leaves)
+            i,j = random.choice(len(members),2,replace=False)
+            normal = points[members[i]]-points[members[j]]
+            if not numpy.any(normal):
+                normal = random.standard_normal(points.shape[1])
+            projection = numpy.dot(points[members],normal)
+            order = numpy.argsort(projection,kind='stable')
+            half = len(members)//2
+            node = len(normals)
+            normals.append(normal)
+            offsets.append((projection[order[half-1]]+projection[order[half]])/2.)
+            children.append([0,0])
+            children[node] = [grow(members[order[:half]]),grow(members[order[half:]])]
+            return node
+        root = grow(numpy.arange(len(points)))
+        padded = numpy.full((len(leaves),self.leafsize),-1,dtype=int)
+        for l,members in enumerate(leaves):
+            padded[l,:len(members)] = members
+        normals = numpy.array(normals,dtype=points.dtype).reshape((-1,points.shape[1]))
+        return root,normals,numpy.array(offsets,dtype=points.dtype),numpy.array(children,dtype=int).reshape((-1,2)),padded
+    def query(self,points,k=1):
+        """Approximate k nearest neighbours of each query point.
+
+        Parameters:
+            points : ndarray
+                Rank 2 array of query points with the same number of columns
+                as data.
+            k : integer
+                The number of neighbours.
+        Returns:
+            d : ndarray
+                Rank 2 array where d[i] holds the distances from points[i] to
+                its neighbours, from nearest to farthest.
+            index : ndarray
+                Rank 2 integer array where index[i] holds the rows of data
+                which are the neighbours of points[i].  Candidates with no
+                dimensions in common with the query point are not counted.  If
+                fewer than k candidates are found the remaining entries are
+                -1, with a distance of inf.
+        """
+        points = numpy.asarray(points,dtype=self.data.dtype)
+        if points.ndim != 2 or points.shape[1] != self.data.shape[1]:
+            raise ValueError('points must be a rank 2 array with %i columns' % self.data.shape[1])
+        projected = self._project(points)
+        candidates = []
+        for root,normals,offsets,children,leaves in self._trees:
+            node = numpy.full(len(points),root,dtype=int)
+            active = numpy.flatnonzero(node >= 0)
+            while len(active) > 0:
+                n = node[active]
+                side = numpy.einsum('ij,ij->i',projected[active],normals[n]) > offsets[n]
+                node[active] = children[n,side.astype(int)]
+                active = active[node[active] >= 0]
+            candidates.append(leaves[-node-1])
+        return self._nearest(points,projected,numpy.concatenate(candidates,axis=1),k)
+    def _nearest(self,points,projected,candidates,k):
+        """The k nearest of the candidates (rows of data, or -1) for each point."""
+        candidates = numpy.sort(candidates,axis=1)
+        candidates[:,1:][candidates[:,1:] == candidates[:,:-1]] = -1
+        if candidates.shape[1] < k:
+            candidates = numpy.concatenate([candidates,numpy.full((len(points),k-candidates.shape[1]),-1,dtype=int)],axis=1)
+        d = numpy.full(candidates.shape,numpy.inf,dtype=self.data.dtype)
+        rows = max(1,distances.maxblock//max(1,candidates.shape[1]*self.data.shape[1]))
+        complete = self._complete and not numpy.any(numpy.isnan(points))
+        with numpy.errstate(all='ignore'):
+            for i in range(0,len(points),rows):
+                block = candidates[i:i+rows]
+                if complete:
+                    d[i:i+rows] = self._compare(projected[i:i+rows],self._points[block])
+                else:
+                    d[i:i+rows] = self.metric.elementwise(points[i:i+rows,numpy.newaxis,:],self.data[block],self.weights)
+        d[numpy.isnan(d)+(candidates < 0)] = numpy.inf
+        if k < d.shape[1]:
+            nearest = numpy.argpartition(d,k-1,axis=1)[:,:k]
+            candidates = numpy.take_along_axis(candidates,nearest,axis=1)
+            d = numpy.take_along_axis(d,nearest,axis=1)
+        nearest = numpy.argsort(d,axis=1,kind='stable')
+        index = numpy.take_along_axis(candidates,nearest,axis=1)
+        d = numpy.take_along_axis(d,nearest,axis=1)
+        index[numpy.isinf(d)] = -1
+        return d,index
+    def _compare(self,a,b):
+        """Distances between projected points a[i] and b[i,j] without missing
+        data, computed in the space the trees are built in."""
+        if self.metric.alias in ['u','r']:
+            r = numpy.clip(numpy.einsum('ik,ijk->ij',a,b),-1.,1.)
+            r[numpy.all(a == 0,axis=1)] = numpy.nan
+            r[numpy.all(b == 0,axis=2)] = numpy.nan
+            if self.metric.alias == 'r':
+                return numpy.arccos(r)/numpy.pi
+            return (1.-r)/2.
+        diff = b-a[:,numpy.newaxis,:]
+        d = numpy.einsum('ijk,ijk->ij',diff,diff)/numpy.sum(self.weights)
+        if self.metric.alias == 'p':
+            return d
+        return numpy.sqrt(d)
+    def neighbors(self,k=1):
+        """Approximate k nearest neighbours of each indexed data point.
+
+        Each point is left out of its own neighbours.
+
+        Parameters:
+            k : integer
+                The number of neighbours.
+        Returns:
+            d, index : ndarray
+                As returned by query, with one row for each row of data.
+        See Also:
+            query
+        """
+        d,index = self.query(self.data,k+1)
+        #The neighbours of a point's neighbours are likely to be its neighbours
+        #too, so they are added to the candidates once.
+        candidates = numpy.where(index[:,:,numpy.newaxis] >= 0,index[index],-1)
+        candidates = numpy.concatenate([index,candidates.reshape((len(index),-1))],axis=1)
+        return _withoutself(*self._nearest(self.data,self._points,candidates,k+1))
+
+class VPTree(object):
+    """Exact nearest neighbour index for true metrics made of a vantage point
+    tree.
+
+    Each node of the tree holds one data point, the vantage point, and splits
+    the remaining points in two at the median of their distance to it, until
+    no more than leafsize points remain.  Each half lies in a shell around the
+    vantage point, so by the triangle inequality no point in a half can be 
+    closer to a query point than the distance from the query point to that
+    shell.  Halves which cannot hold a closer point than those already found
+    are skipped, which makes queries much faster than comparing with every
+    point while giving exactly the same answer.  All query points are passed
+    down the tree together.
+
+    Only distances which are true metrics (those with Metric.metric set, such
+    as e, b, h, r, Linf or L<p> with p at least 1) are supported, and the data
+    may not have missing values, which would break the triangle inequality.
+
+    Properties:
+        data : ndarray
+            Rank 2 array of the indexed data points.
+        weights : ndarray
+            The weights for each dimension.
+        metric : distances.Metric
+            The distance.
+        leafsize : integer
+            The largest number of points in a leaf.
+    """
+    def __init__(self,data,weights=None,dist='e',leafsize=32,seed=None,dtype=float):
+        """Builds the index.
+
+        Parameters:
+            data : ndarray
+                Rank 2 array.  Each row is assumed to represent a single data
+                point.
+            weights : ndarray
+                Optional.  If given, a rank 1 array with length equal to the
+                number of columns in data.  Entries specify the weight for
+                each dimension in the distance function.
+            dist : string
+                The distance alias.  Must be a true metric.
+            leafsize : integer
+                The largest number of points in a leaf.
+            seed : integer
+                Optional.  Seed for the random choice of vantage points.  If
+                not given numpy.random is used.
+            dtype : data-type
+                The floating point type used for the data and distances.
+        """
+        data,weights,metric = distances._prepare(data,weights,dist,dtype)
+        if not metric.metric:
+            raise ValueError('VPTree is only available for true metrics, not %s distances' % metric.name)
+        elif numpy.any(numpy.isnan(data)):
+            raise ValueError('VPTree cannot be used with missing data')
+        elif leafsize < 1:
+            raise ValueError('leafsize must be at least 1')
+        self.data = data
+        self.weights = weights
+        self.metric = metric
+        self.leafsize = int(leafsize)
+        if seed is None:
+            random = numpy.random
+        else:
+            random = numpy.random.RandomState(seed)
+        vantage = []
+        shells = []
+        children = []
+        leaves = []
+        def grow(members):
+            if len(members) <= self.leafsize:
+                leaves.append(members)
+                return -len(leaves)
+            i = random.randint(len(members))
+            point = members[i]
+            members = numpy.delete(members,i)
+            d = self._distances(data[point:point+1],members)[0]
+            order = numpy.argsort(d,kind='stable')
+            half = len(members)//2
+            node = len(vantage)
+            vantage.append(point)
+            shells.append([[d[order[0]],d[order[half-1]]],[d[order[half]],d[order[-1]]]])
+            children.append([0,0])
+            children[node] = [grow(members[order[:half]]),grow(members[order[half:]])]
+            return node
+        self._root = grow(numpy.arange(len(data)))
+        self._vantage = numpy.array(vantage,dtype=int)
+        self._shells = numpy.array(shells,dtype=data.dtype).reshape((-1,2,2))
+        self._children = numpy.array(children,dtype=int).reshape((-1,2))
+        self._leaves = numpy.full((len(leaves),self.leafsize),-1,dtype=int)
+        for l,members in enumerate(leaves):
+            self._leaves[l,:len(members)] = members
+    def __len__(self):
+        return len(self.data)
+    def _distances(self,points,index):
+        """Distances from each query point to the rows of data in index, which
+        is either rank 1 and shared by all points or rank 2 with one row for
+        each point.  Entries of index which are -1 give inf."""
+        d = numpy.empty((len(points),index.shape[-1]),dtype=self.data.dtype)
+        rows = max(1,distances.maxblock//max(1,index.shape[-1]*self.data.shape[1]))
+        with numpy.errstate(all='ignore'):
+            for i in range(0,len(points),rows):
+                block = index if index.ndim == 1 else index[i:i+rows]
+                d[i:i+rows] = self.metric.elementwise(points[i:i+rows,numpy.newaxis,:],self.data[block],self.weights)
+        d[numpy.isnan(d)+(index < 0)] = numpy.inf
+        return d
+    def _bounds(self,node,d):
+        """The smallest distance from query points at distance d from the
+        vantage point of node to each of its two halves."""
+        shells = self._shells[node]
+        #The shells are widened so rounding cannot exclude a point which is
+        #just inside.  Distances near 0 through arccos, as for r, are only
+        #accurate to about the square root of the precision.
+        d = d[...,numpy.newaxis]
+        slack = numpy.sqrt(numpy.finfo(self.data.dtype).eps)*(d+shells[...,1])
+        with numpy.errstate(invalid='ignore'):
+            return numpy.maximum(numpy.maximum(shells[...,0]-d,d-shells[...,1])-slack,0)
+    def _search(self,points,bound,found):
+        """Passes the query points down the tree together, leaving out those
+        which cannot be within the bound of any point below a node.
+
+        Parameters:
+            points : ndarray
+                The query points.
+            bound : function
+                Called with an array of query point indexes, returns the
+                largest distance still of interest for each.
+            found : function
+                Called as found(q,index,d) for each block of distances d, where
+                d[i,j] is the distance from points[q[i]] to the row of data in
+                index[j], or index[i,j] if index is rank 2.
+        """
+        stack = [(self._root,numpy.arange(len(points)),numpy.zeros(len(points),dtype=self.data.dtype))]
+        while stack:
+            node,q,lower = stack.pop()
+            q = q[lower <= bound(q)]
+            if len(q) == 0:
+                continue
+            elif node < 0:
+                members = self._leaves[-node-1]
+                members = members[members >= 0]
+                found(q,members,self._distances(points[q],members))
+                continue
+            point = self._vantage[node:node+1]
+            d = self._distances(points[q],point)
+            found(q,point,d)
+            lower = self._bounds(node,d[:,0])
+            inside,outside = self._children[node]
+            #The half nearer to most of the points is searched first.
+            if numpy.sum(lower[:,0]) <= numpy.sum(lower[:,1]):
+                stack.append((outside,q,lower[:,1]))
+                stack.append((inside,q,lower[:,0]))
+            else:
+                stack.append((inside,q,lower[:,0]))
+                stack.append((outside,q,lower[:,1]))
+    def _points(self,points):
+        points = numpy.asarray(points,dtype=self.data.dtype)
+        if points.ndim != 2 or points.shape[1] != self.data.shape[1]:
+            raise ValueError('points must be a rank 2 array with %i columns' % self.data.shape[1])
+        elif numpy.any(numpy.isnan(points)):
+            raise ValueError('VPTree cannot be used with missing data')
+        return points
+    def query(self,points,k=1):
+        """The k nearest neighbours of each query point.
+
+        Parameters:
+            points : ndarray
+                Rank 2 array of query points with the same number of columns
+                as data.
+            k : integer
+                The number of neighbours.
+        Returns:
+            d : ndarray
+                Rank 2 array where d[i] holds the distances from points[i] to
+                its neighbours, from nearest to farthest.
+            index : ndarray
+                Rank 2 integer array where index[i] holds the rows of data
+                which are the neighbours of points[i].  If fewer than k points
+                are at a defined distance the remaining entries are -1, with a
+                distance of inf.
+        See Also:
+            radius
+        """
+        points = self._points(points)
+        d = numpy.full((len(points),k),numpy.inf,dtype=self.data.dtype)
+        index = numpy.full((len(points),k),-1,dtype=int)
+        def found(q,members,block):
+            members = numpy.broadcast_to(members,block.shape)
+            #Points already found on the way down are not counted twice.
+            block = numpy.where(numpy.any(members[:,:,numpy.newaxis] == index[q][:,numpy.newaxis,:],axis=2),numpy.inf,block)
+            dq = numpy.concatenate([d[q],block],axis=1)
+            iq = numpy.concatenate([index[q],members],axis=1)
+            nearest = numpy.argpartition(dq,k-1,axis=1)[:,:k]
+            d[q] = numpy.take_along_axis(dq,nearest,axis=1)
+            index[q] = numpy.take_along_axis(iq,nearest,axis=1)
+        #Each point first goes straight down to the leaf it would be in, so
+        #that the search starts from good neighbours and can skip more.
+        node = numpy.full(len(points),self._root,dtype=int)
+        active = numpy.flatnonzero(node >= 0)
+        while len(active) > 0:
+            n = node[active]
+            point = self._vantage[n][:,numpy.newaxis]
+            dv = self._distances(points[active],point)
+            found(active,point,dv)
+            lower = self._bounds(n,dv[:,0])
+            node[active] = self._children[n,(lower[:,1] < lower[:,0]).astype(int)]
+            active = active[node[active] >= 0]
+        found(numpy.arange(len(points)),self._leaves[-node-1],self._distances(points,self._leaves[-node-1]))
+        self._search(points,lambda q: numpy.max(d[q],axis=1),found)
+        nearest = numpy.argsort(d,axis=1,kind='stable')
+        d = numpy.take_along_axis(d,nearest,axis=1)
+        index = numpy.take_along_axis(index,nearest,axis=1)
+        index[numpy.isinf(d)] = -1
+        return d,index
+    def radius(self,points,r):
+        """All neighbours of each query point within a given distance.
+
+        Parameters:
+            points : ndarray
+                Rank 2 array of query points with the same number of columns
+                as data.
+            r : float
+                The largest distance from a query point to its neighbours.
+        Returns:
+            d : list of ndarray
+                d[i] holds the distances from points[i] to its neighbours,
+                from nearest to farthest.
+            index : list of ndarray
+                index[i] holds the rows of data which are the neighbours of
+                points[i].
+        See Also:
+            query
+        """
+        points = self._points(points)
+        pairs = []
+        def found(q,members,block):
+            i,j = numpy.nonzero(block <= r)
+            pairs.append((q[i],numpy.broadcast_to(members,block.shape)[i,j],block[i,j]))
+        self._search(points,lambda q: r,found)
+        if pairs:
+            q,index,d = [numpy.concatenate(x) for x in zip(*pairs)]
+        else:
+            q,index,d = numpy.zeros(0,dtype=int),numpy.zeros(0,dtype=int),numpy.zeros(0,dtype=self.data.dtype)
+        order = numpy.lexsort((index,d,q))
+        split = numpy.cumsum(numpy.bincount(q,minlength=len(points)))[:-1]
+        return numpy.split(d[order],split),numpy.split(index[order],split)
+    def neighbors(self,k=1):
+        """The k nearest neighbours of each indexed data point.
+
+        Each point is left out of its own neighbours.
+
+        Parameters:
+            k : integer
+                The number of neighbours.
+        Returns:
+            d, index : ndarray
+                As returned by query, with one row for each row of data.
+        See Also:
+            query
+        """
+        return _withoutself(*self.query(self.data,k+1))
+
+def _withoutself(d,index):
+    """Removes each indexed point from its own k+1 nearest neighbours, or the
+    farthest neighbour when it is not among them."""
+    own = index == numpy.arange(len(index))[:,numpy.newaxis]
+    own[~numpy.any(own,axis=1),-1] = True
+    return d[~own].reshape((len(index),-1)),index[~own].reshape((len(index),-1))
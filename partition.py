@@ -12,11 +12,19 @@ in the source code.
 import numpy
 from . import distances
 import scipy
+import scipy.sparse
 from . import _support
 from . import stats
+from . import neighbors
 import warnings
+import multiprocessing
+import os
 
-def kmeans(data,nclusters=2,weights=None,method='a',dist='e',initial=None,threshold=0.05):
+_inits = ['random','k-means++','k-means||'] #Accepted values of init for kmeans and cmeans
+_rounds = 5 #Number of sampling passes over the data for k-means||
+_selects = ['sse','mode'] #Accepted values of select for kmeans
+
+def kmeans(data,nclusters=2,weights=None,method='a',dist='e',initial=None,threshold=0.05,dtype=float,approximate=False,algorithm='lloyd',init='random',n_init=1,n_jobs=None,seed=None,select='sse',diagnostics=False):
     """Exclusive partitional clustering.
     
     Data points are grouped into the given number of clusters based on their
@@ -26,19 +34,22 @@ def kmeans(data,nclusters=2,weights=None,method='a',dist='e',initial=None,thresh
     until there is little to no change in the group assignments.
     Because of the non-deterministic nature of the k-means algorithm for
     randomly generated intitial centroids, the usual practice is to run the
-    algorithm several times and to use the most frequently occuring solution.
-    This code does not implement that practice, leaving it up to the user to
-    determine if that is appropriate.  Furthermore, this code is even less
-    deterministic than normal because it uses the random reassignment of a
-    single point to handle an empty cluster.
+    algorithm several times and to use either the most frequently occuring 
+    solution or the one with the smallest sum of squared errors, which n_init
+    and select do.  This code is even less deterministic than normal because
+    it uses the random reassignment of a single point to handle an empty 
+    cluster.
     
     While the transpose parameter has been removed, the behavior formerly
     obtained by setting transpose to True can be duplicated by the command
     numpy.transpose(kmeans(numpy.transpose(data),...)).
     
     Parameters:
-        data : ndarray
-            Expects a rank 2 array.  Contains the data to be clustered.
+        data : ndarray or sparse matrix
+            Expects a rank 2 array.  Contains the data to be clustered.  A
+            scipy.sparse matrix is never made dense, but can only be used with
+            the arithmetic mean (a) and a distance with a sparse kernel (see
+            distances.Metric).
         nclusters : integer
             The number of clusters that the data should be divided into.
         weights : ndarray
@@ -62,40 +73,267 @@ def kmeans(data,nclusters=2,weights=None,method='a',dist='e',initial=None,thresh
             Percent of points which can change cluster on final iteration.
             Function stops the first time the percentage of points changing
             cluster drops to or below this number.
+        dtype : data-type
+            The floating point type used for the data, centroids, distances 
+            and levs.  numpy.float32 halves the memory used.
+        approximate : boolean
+            If True, each point is assigned to the nearest centroid found by a
+            neighbors.RPForest built over the centroids at each iteration,
+            rather than comparing it with every centroid.  This is faster when
+            nclusters is large, but a point is sometimes assigned to a 
+            centroid which is not the nearest.  Only for the distances 
+            supported by RPForest, and not for sparse data.
+        algorithm : string
+            How points are assigned to their nearest centroid:
+            lloyd - Every point is compared with every centroid (default).
+            elkan - Bounds on the distance from each point to each centroid
+                    are kept between iterations, and by the triangle 
+                    inequality most comparisons are skipped once the 
+                    centroids settle.  Uses memory for # rows of data x
+                    nclusters bounds.
+            hamerly - As elkan but with one bound for all the other 
+                      centroids, which uses less memory and skips fewer
+                      comparisons.
+            elkan and hamerly give the same assignments as lloyd, but are
+            only available for distances which are true metrics (see
+            distances.Metric) and dense data without missing values.
+        init : string
+            How the initial centroids are chosen when initial is not given:
+            random    - Uniformly at random between the smallest and largest
+                        values in data (default).
+            k-means++ - Data points chosen one at a time, each with 
+                        probability proportional to its squared distance 
+                        from the nearest point already chosen.  Needs
+                        nclusters passes over the data.
+            k-means|| - A few passes over the data each sample many points
+                        at once, again in proportion to their squared 
+                        distance from those already chosen, and k-means++ 
+                        then picks nclusters of the sampled points, each 
+                        weighted by the number of data points nearest to
+                        it.  Much faster than k-means++ for large data and
+                        nclusters, and nearly as good.
+            Both k-means++ and k-means|| work with any dist and usually need
+            fewer iterations and empty cluster repairs than random.
+        n_init : integer
+            The number of times the algorithm is run, each from its own 
+            random start.  One of the solutions is chosen by select.
+        n_jobs : integer
+            Optional.  The number of processes the runs are shared between.
+            None or 1 runs them all in this process, -1 uses one process per
+            cpu.  The result does not depend on n_jobs.
+        seed : integer
+            Optional.  Seed for the random numbers.  Each run draws from its 
+            own independent stream spawned from seed by 
+            numpy.random.SeedSequence, so a given seed and n_init always give
+            the same result.  If neither seed nor n_init is given 
+            numpy.random is used.
+        select : string
+            How the solution is chosen from the n_init runs:
+            sse  - The solution with the smallest sum of squared errors, the
+                   sum over all points of the squared distance (by dist,
+                   with weights) to the centroid of its cluster (default).
+                   Without weights this is the sum of stats.SEmatrix, which
+                   ignores weights.
+            mode - The solution found most often, where solutions which
+                   differ only in the order of the clusters are the same (as
+                   for stats.levscompare).  Ties go to the smaller sum of 
+                   squared errors.
+        diagnostics : boolean
+            If True the diagnostics of each run are returned as well.
     Returns:
         levs : ndarray
             A rank 2 array with dimensions # rows of data x nclusters
             containing 0's and 1's.  Each row/column should contain one
             and only one 1 to indicate which cluster that data point belongs
             to.  Each column/row indicates a different cluster.     
+        runs : ndarray
+            Only if diagnostics is True.  A record array with one record for
+            each run, in order, with fields:
+            sse        - The sum of squared errors of its solution.
+            iterations - The number of assignments made.
+            repairs    - The number of empty clusters given a random point.
+            matches    - The number of runs (including itself) which found 
+                         the same solution.
+            selected   - True for the run whose solution is levs.
     See Also:
-        stats.singleclustercentroid, distances.distance
+        stats.singleclustercentroid, distances.distance, distances.cdist,
+        neighbors.RPForest
     """
-    if initial is None:
-        initial = numpy.random.random((nclusters,len(data[0])))*(numpy.max(data)-numpy.min(data))+numpy.min(data)
-    elif stats.levscheck(initial)[0]:
-        initial = stats.clustercentroids(data,initial,1.,method)
-    levs = numpy.zeros((len(data),nclusters))
-    again = True
-    while again:
-        levs_new = numpy.zeros((len(data),nclusters))
-        for i in range(len(data)):
-            d = list(numpy.apply_along_axis(distances.distance,1,initial,data[i],weights,dist))
-            levs_new[i,d.index(min(d))] = 1
-        if numpy.sum(numpy.abs(levs_new-levs))/(2*len(data[0])) <= threshold:
-            again = False
-        test = stats.levscheck(levs_new)
-        if not test[0]:
-            again = True
-            for i in test[2]:
-                j = numpy.random.random_integers(len(data))-1
-                levs_new[j] = 0
-                levs_new[j,i] = 1
-        initial = stats.clustercentroids(data,levs_new,1.,method)
-        levs = levs_new
-    return levs
+    data,prepared = _prepare(data,weights,dtype)
+    if init not in _inits:
+        raise ValueError('Unrecognized init %s' % init)
+    elif select not in _selects:
+        raise ValueError('Unrecognized select %s' % select)
+    elif n_init < 1:
+        raise ValueError('n_init must be at least 1')
+    elif approximate and scipy.sparse.issparse(data):
+        raise ValueError('approximate is not available for sparse data')
+    elif algorithm not in ['lloyd','elkan','hamerly']:
+        raise ValueError('Unrecognized algorithm %s' % algorithm)
+    elif algorithm != 'lloyd':
+        metric = distances.getmetric(dist)
+        if approximate:
+            raise ValueError('approximate can only be used with the lloyd algorithm')
+        elif not metric.metric:
+            raise ValueError('The %s algorithm is only available for true metrics, not %s distances' % (algorithm,metric.name))
+        elif scipy.sparse.issparse(data) or numpy.any(numpy.isnan(data)):
+            raise ValueError('The %s algorithm is not available for sparse data or data with missing values' % algorithm)
+    settings = (nclusters,weights,method,dist,initial,threshold,dtype,approximate,algorithm,init)
+    if seed is None and n_init == 1:
+        runs = [_kmeans(data,prepared,settings,numpy.random)]
+    else:
+        streams = numpy.random.SeedSequence(seed).spawn(n_init)
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if n_jobs is None or n_jobs <= 1 or n_init <= 1:
+            runs = [_kmeans(data,prepared,settings,_randomstate(stream)) for stream in streams]
+        else:
+            pool = multiprocessing.Pool(min(n_jobs,n_init),_initworker,(data,settings))
+            try:
+                runs = pool.map(_workerrun,streams)
+            finally:
+                pool.terminate()
+    nearest = [run[0] for run in runs]
+    if len(runs) == 1 and not diagnostics:
+        best = 0
+    else:
+        kernel = distances.kernel(dist,weights,dtype)
+        sse = numpy.array([_sse(data,prepared,i,nclusters,method,kernel) for i in nearest])
+        #Solutions are the same when their clusters, numbered in order of 
+        #first appearance, are.
+        labels = [_firstorder(i).tobytes() for i in nearest]
+        matches = numpy.array([labels.count(i) for i in labels])
+        if select == 'mode':
+            best = numpy.lexsort((sse,-matches))[0]
+        else:
+            best = numpy.argmin(sse)
+    levs = numpy.zeros((data.shape[0],nclusters),dtype=dtype)
+    levs[numpy.arange(data.shape[0]),nearest[best]] = 1
+    if not diagnostics:
+        return levs
+    records = numpy.zeros(len(runs),dtype=[('sse',float),('iterations',int),('repairs',int),('matches',int),('selected',bool)])
+    records['sse'] = sse
+    records['iterations'] = [run[1] for run in runs]
+    records['repairs'] = [run[2] for run in runs]
+    records['matches'] = matches
+    records['selected'][best] = True
+    return levs,records.view(numpy.recarray)
+    
+def minibatch_kmeans(data,nclusters=2,weights=None,dist='e',initial=None,batchsize=1024,maxiter=100,tol=0.,seed=None,dtype=float):
+    """Exclusive partitional clustering from small random batches of data.
     
-def cmeans(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=None,rtol=1.0000000000000001e-005,atol=1e-008):
+    Instead of assigning every data point at each iteration as kmeans does,
+    each iteration assigns only a batch of points to their nearest centroid
+    and moves each centroid towards the mean of its batch members.  The step
+    taken by a centroid shrinks as it gathers members (its learning rate is
+    one over the number of points it has been given, per dimension), so each
+    centroid is the running mean of every point ever assigned to it.  Only 
+    one batch needs to be in memory at a time, so data may be a numpy.memmap
+    or an iterator over batches of a data set too large to load.
+    
+    Because the centroids are found from samples the result is close to, but
+    not the same as, that of kmeans.  Since the mean is only the centroid 
+    which minimizes squared euclidean distances, only the euclidean family of
+    distances is supported.
+    
+    Parameters:
+        data : ndarray or iterable
+            Either a rank 2 array (or numpy.memmap) containing the data to be
+            clustered, from which batchsize rows are drawn at random for each
+            iteration, or an iterable of rank 2 arrays with the same number of 
+            columns, each of which is used as one batch in the order given.
+            Missing data (nan) is allowed.
+        nclusters : integer
+            The number of clusters that the data should be divided into.
+        weights : ndarray
+            Optional.  Expects a rank 1 array with length equal to the number
+            of columns in data.  Entries are weights for each dimension in
+            calculating the distance.
+        dist : string
+            Specifies the distance function to use when finding the distance
+            between points and the centroids.  One of e, p or L2.
+        initial : ndarray
+            Optional.  Expects a rank 2 array with dimensions nclusters x 
+            # columns in data containing the initial guess for the locations of
+            the centroids.  If none is given nclusters distinct points of the
+            first batch are used.
+        batchsize : integer
+            The number of rows drawn from data for each iteration.  Ignored if
+            data is an iterable.
+        maxiter : integer
+            The largest number of batches used.
+        tol : float
+            Stop early once no centroid moves more than tol, by the distance
+            dist, in a single iteration.  The default of 0 uses all maxiter 
+            batches.
+        seed : integer
+            Optional.  Seed for the random choice of batches and initial 
+            centroids.  If not given numpy.random is used.
+        dtype : data-type
+            The floating point type used for the batches, centroids and
+            distances.
+    Returns:
+        cdata : ndarray
+            Rank 2 array containing the centroids.  Each row is a centroid.  
+            The cluster of each data point is its nearest centroid, e.g. the
+            argmin along axis 1 of distances.cdist(data,cdata,weights,dist).
+            A centroid which is never given a point stays where it started.
+    See Also:
+        kmeans, distances.cdist
+    """
+    metric = distances.getmetric(dist)
+    if metric.alias not in ['e','p','L2']:
+        raise ValueError('minibatch_kmeans is not available for %s distances' % metric.name)
+    elif scipy.sparse.issparse(data):
+        raise TypeError('minibatch_kmeans does not accept sparse data')
+    if seed is None:
+        random = numpy.random
+    else:
+        random = numpy.random.RandomState(seed)
+    if isinstance(data,numpy.ndarray):
+        if data.ndim != 2:
+            raise ValueError('Data must be a rank 2 array')
+        elif len(data) < 1:
+            raise ValueError('Data must have at least one row')
+        #Sorted indexes read a memmap in file order.
+        batches = (data[numpy.sort(random.randint(0,len(data),batchsize))] for i in range(maxiter))
+    else:
+        batches = iter(data)
+    kernel = distances.kernel(dist,weights,dtype)
+    cdata = None
+    if initial is not None:
+        cdata = numpy.array(initial,dtype=dtype)
+    for i,batch in zip(range(maxiter),batches):
+        batch = numpy.asarray(batch,dtype=dtype)
+        if batch.ndim != 2:
+            raise ValueError('Each batch must be a rank 2 array')
+        if cdata is None:
+            if len(batch) < nclusters:
+                raise ValueError('The first batch must have at least nclusters rows when initial is not given')
+            cdata = batch[random.choice(len(batch),nclusters,replace=False)]
+            cdata = numpy.where(numpy.isnan(cdata),numpy.nanmean(batch,axis=0),cdata)
+        if i == 0:
+            counts = numpy.zeros(cdata.shape,dtype=dtype)
+        if batch.shape[1] != cdata.shape[1]:
+            raise ValueError('Each batch must have %i columns' % cdata.shape[1])
+        nearest = _assign(kernel(cdata,batch))
+        members = scipy.sparse.csr_matrix((numpy.ones(len(batch),dtype=dtype),(nearest,numpy.arange(len(batch)))),shape=(nclusters,len(batch)))
+        valid = ~numpy.isnan(batch)
+        gained = members @ valid.astype(dtype)
+        counts += gained
+        previous = cdata.copy()
+        with numpy.errstate(all='ignore'):
+            step = numpy.where(counts > 0,1/counts,0)
+        #The centroid moves by the batch sum less its own share, scaled by the
+        #learning rate, which leaves it at the mean of all its points so far.
+        cdata += step*((members @ numpy.where(valid,batch,0))-gained*cdata)
+        if tol > 0 and numpy.all(numpy.diagonal(kernel(previous,cdata)) <= tol):
+            break
+    if cdata is None:
+        raise ValueError('No batches were given')
+    return cdata
+
+def cmeans(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=None,rtol=1.0000000000000001e-005,atol=1e-008,dtype=float,init='random'):
     """Fuzzy partitional clustering.
     
     While the transpose parameter has been removed, the behavior formerly
@@ -103,8 +341,9 @@ def cmeans(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=None,r
     numpy.transpose(cmeans(numpy.transpose(data),...)).
     
     Parameters:
-        data : ndarray
-            Expects a rank 2 array.  Contains the data to be clustered.
+        data : ndarray or sparse matrix
+            Expects a rank 2 array.  Contains the data to be clustered.  See
+            kmeans for the use of a scipy.sparse matrix.
         nclusters : integer
             The number of clusters that the data should be divided into.
         weights : ndarray
@@ -136,32 +375,48 @@ def cmeans(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=None,r
             comes into play for those elements of the new levs that are very 
             small or zero; it says how small the previous iteration's levs must
             be also.
+        dtype : data-type
+            The floating point type used for the data, centroids, distances 
+            and levs.  numpy.float32 halves the memory used.
+        init : string
+            How the initial levs are chosen when initial is not given.  
+            random (default) gives random levs.  k-means++ and k-means|| 
+            choose initial centroids as kmeans does, and each point starts 
+            wholly in the cluster of its nearest centroid.
     Returns:
         levs : ndarray
             A rank 2 array with dimensions # rows of data x nclusters
             containing the level to which each data point belongs to each
             cluster.
     See Also:
-        stats.singleclustercentroid, distances.distance
+        stats.singleclustercentroid, distances.distance, distances.cdist
     """
+    data,prepared = _prepare(data,weights,dtype)
+    if init not in _inits:
+        raise ValueError('Unrecognized init %s' % init)
     if p == 1:
         if initial is None:
-            levs = kmeans(data,nclusters,weights,method,dist)
+            levs = kmeans(data,nclusters,weights,method,dist,dtype=dtype,init=init)
         else:
-            cdata = stats.clustercentroids(data,initial,p,method)
-            levs = kmeans(data,nclusters,weights,method,dist,cdata)
+            cdata = stats.clustercentroids(data,numpy.asarray(initial,dtype=dtype),p,method)
+            levs = kmeans(data,nclusters,weights,method,dist,cdata,dtype=dtype)
     else:
-        if initial is None:
-            initial = numpy.random.random((len(data),nclusters))
+        kernel = distances.kernel(dist,weights,dtype)
+        if initial is None and init != 'random':
+            nearest = _assign(kernel(_seed(data,prepared,nclusters,kernel,init),prepared))
+            initial = numpy.zeros((data.shape[0],nclusters))
+            initial[numpy.arange(data.shape[0]),nearest] = 1
+        elif initial is None:
+            initial = numpy.random.random((data.shape[0],nclusters))
             initial *= 1./numpy.sum(initial,axis=0)
+        initial = numpy.asarray(initial,dtype=dtype)
         levs = numpy.zeros_like(initial)
         again = True
         while again:
             cdata = stats.clustercentroids(data,initial,p,method)
-            for i in range(len(data)):
-                d = numpy.apply_along_axis(distances.distance,1,cdata,data[i],weights,dist)
-                d = (1/d**2)**(1/(p-1))
-                levs[i] = d/numpy.sum(d)
+            d = numpy.transpose(kernel(numpy.asarray(cdata,dtype=dtype),prepared))
+            d = (1/d**2)**(1/(p-1))
+            levs[:] = d/numpy.sum(d,axis=1)[:,numpy.newaxis]
             if numpy.allclose(initial,levs,rtol,atol):
                 again = False
             initial = levs
@@ -226,7 +481,7 @@ def cmeans_noise(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=
             containing the level to which each data point belongs to each
             cluster.  The last column/row is the noise cluster.
     See Also:
-        stats.singleclustercentroid, distances.distance
+        stats.singleclustercentroid, distances.distance, distances.cdist
     """
     if p == 1:
         raise ValueError('p cannot be 1 when a noise cluster is present.')
@@ -236,14 +491,14 @@ def cmeans_noise(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=
             initial *= 1./numpy.sum(initial,axis=0)        
         initial = numpy.append(initial,numpy.zeros((len(data),1)),axis=1)
         levs = numpy.zeros_like(initial)
+        kernel = distances.kernel(dist,weights)
+        prepared = distances.PreparedData(numpy.asarray(data,dtype=float),weights)
         again = True
         while again:
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
                 cdata = stats.clustercentroids(data,initial,p,method)
-            d = numpy.zeros_like(levs)
-            for i in range(len(data)):
-                d[i] = numpy.apply_along_axis(distances.distance,1,cdata,data[i],weights,dist)
+            d = numpy.transpose(kernel(numpy.asarray(cdata,dtype=float),prepared))
             d[:,-1] = 0
             d[:,-1] = numpy.sum(d**2)/(nclusters*len(data)*l)
             d = (1/d**2)**(1/(p-1))
@@ -252,3 +507,380 @@ def cmeans_noise(data,nclusters=2,weights=None,p=2.,method='a',dist='e',initial=
                 again = False
             initial = levs
     return levs
+
+def _prepare(data,weights,dtype):
+    """Converts data to dtype and prepares it once for distances.kernel.
+    
+    Returns:
+        data : ndarray or sparse matrix
+            data as an array of type dtype, or as a csr matrix if it is 
+            sparse.
+        prepared : PreparedData or sparse matrix
+            data ready to be passed to the kernel.
+    """
+    if scipy.sparse.issparse(data):
+        data = distances._tosparse(data,dtype)
+        return data,data
+    data = numpy.asarray(data,dtype=dtype)
+    return data,distances.PreparedData(data,weights)
+
+def _assign(d):
+    """The index of the nearest centroid to each point, from the rank 2 array
+    d of distances from each centroid to each point.  A nan distance is never
+    the nearest unless all of a point's distances are nan."""
+    return numpy.argmin(numpy.where(numpy.isnan(d),numpy.inf,d),axis=0)
+
+def _centroids(data,nearest,nclusters,method):
+    """Centroids of the clusters of an exclusive clustering.
+    
+    The arithmetic (a), absolute (s), quadratic (q) and harmonic (h) means are
+    found for all clusters at once as sums over the members of each cluster, 
+    ignoring missing data exactly as stats.singleclustercentroid does.  Other
+    methods use stats.clustercentroids.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            The data points.
+        nearest : ndarray
+            The cluster each data point belongs to.
+        nclusters : integer
+            The number of clusters.
+        method : string
+            See stats.singleclustercentroid.
+    Returns:
+        cdata : ndarray
+            Rank 2 array containing the centroids.
+    """
+    members = scipy.sparse.csr_matrix((numpy.ones(len(nearest),dtype=data.dtype),(nearest,numpy.arange(len(nearest)))),shape=(nclusters,data.shape[0]))
+    if scipy.sparse.issparse(data):
+        if method != 'a':
+            raise ValueError('Only the arithmetic mean is supported for sparse data.')
+        return (members @ data).toarray()/numpy.asarray(members.sum(axis=1))
+    elif method not in ['a','s','q','h'] or (method == 'h' and numpy.any(data == 0)):
+        levs = numpy.zeros((data.shape[0],nclusters),dtype=data.dtype)
+        levs[numpy.arange(data.shape[0]),nearest] = 1
+        return stats.clustercentroids(data,levs,1.,method)
+    valid = ~numpy.isnan(data)
+    count = members @ valid.astype(data.dtype)
+    x = numpy.where(valid,data,0)
+    with numpy.errstate(all='ignore'):
+        if method == 'a':
+            return (members @ x)/count
+        elif method == 's':
+            return (members @ numpy.abs(x))/count
+        elif method == 'q':
+            return numpy.sqrt((members @ x**2)/count)
+        return count/(members @ numpy.where(valid,1/x,0))
+
+def _kmeans(data,prepared,settings,random):
+    """A single run of kmeans, with its random numbers drawn from random.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            The data points, as returned by _prepare.
+        prepared : PreparedData or sparse matrix
+            data ready to be passed to the kernel.
+        settings : tuple
+            nclusters, weights, method, dist, initial, threshold, dtype, 
+            approximate, algorithm and init, already checked by kmeans.
+        random : module or RandomState
+            The source of random numbers.
+    Returns:
+        nearest : ndarray
+            The cluster each data point belongs to.
+        iterations : integer
+            The number of assignments made.
+        repairs : integer
+            The number of empty clusters given a random point.
+    """
+    nclusters,weights,method,dist,initial,threshold,dtype,approximate,algorithm,init = settings
+    if algorithm != 'lloyd':
+        bounds = _Bounds(data,distances._prepare(data,weights,dist,dtype)[1],distances.getmetric(dist),algorithm)
+    kernel = distances.kernel(dist,weights,dtype)
+    if initial is None and init != 'random':
+        initial = _seed(data,prepared,nclusters,kernel,init,random)
+    elif initial is None:
+        initial = random.random_sample((nclusters,data.shape[1]))*(data.max()-data.min())+data.min()
+    elif stats.levscheck(initial)[0]:
+        initial = stats.clustercentroids(data,numpy.asarray(initial,dtype=dtype),1.,method)
+    initial = numpy.asarray(initial,dtype=dtype)
+    nearest = None
+    iterations = 0
+    repairs = 0
+    again = True
+    while again:
+        if approximate:
+            nearest_new = neighbors.RPForest(initial,weights,dist,seed=random.randint(2**31),dtype=dtype).query(data,1)[1][:,0]
+            missing = numpy.flatnonzero(nearest_new < 0)
+            if len(missing) > 0:
+                nearest_new[missing] = _assign(kernel(data[missing],initial).T)
+        elif algorithm != 'lloyd':
+            nearest_new = bounds.assign(initial)
+        else:
+            nearest_new = _assign(kernel(initial,prepared))
+        iterations += 1
+        #Until the first assignment every point counts as having moved once,
+        #after it a point which moves counts twice, as in the levs arrays.
+        if nearest is None:
+            moved = data.shape[0]
+        else:
+            moved = 2*numpy.count_nonzero(nearest_new != nearest)
+        if moved/(2*data.shape[1]) <= threshold:
+            again = False
+        empty = numpy.flatnonzero(numpy.bincount(nearest_new,minlength=nclusters) == 0)
+        if len(empty) > 0:
+            again = True
+            repairs += len(empty)
+            for i in empty:
+                j = random.randint(data.shape[0])
+                nearest_new[j] = i
+                if algorithm != 'lloyd':
+                    bounds.reassign(j,i)
+        initial = numpy.asarray(_centroids(data,nearest_new,nclusters,method),dtype=dtype)
+        nearest = nearest_new
+    return nearest,iterations,repairs
+
+def _randomstate(stream):
+    """A RandomState drawing from the numpy.random.SeedSequence stream."""
+    return numpy.random.RandomState(numpy.random.MT19937(stream))
+
+_worker = None #Arguments of _kmeans shared by all runs in a worker process
+
+def _initworker(data,settings):
+    """Stores the arguments shared by all runs in a worker process."""
+    global _worker
+    _worker = (data,settings)
+
+def _workerrun(stream):
+    """Makes the run of kmeans using the random numbers of stream in a worker
+    process."""
+    data,settings = _worker
+    nclusters,weights,method,dist,initial,threshold,dtype,approximate,algorithm,init = settings
+    return _kmeans(data,_prepare(data,weights,dtype)[1],settings,_randomstate(stream))
+
+def _sse(data,prepared,nearest,nclusters,method,kernel):
+    """The weighted within cluster sum of squared errors: the sum of the 
+    squared distances, by kernel and so with its weights, from each point to
+    the centroid of its cluster.  nan distances are ignored and the points 
+    are worked through in blocks of at most distances.maxblock distances."""
+    cdata = numpy.asarray(_centroids(data,nearest,nclusters,method),dtype=data.dtype)
+    total = 0.
+    rows = max(1,distances.maxblock//nclusters)
+    for i in range(0,data.shape[0],rows):
+        d = kernel(cdata,prepared[i:i+rows])
+        total += numpy.nansum(d[nearest[i:i+rows],numpy.arange(d.shape[1])]**2)
+    return total
+
+def _firstorder(nearest):
+    """nearest with the clusters renumbered in order of first appearance."""
+    clusters,first,inverse = numpy.unique(nearest,return_index=True,return_inverse=True)
+    order = numpy.empty(len(clusters),dtype=int)
+    order[numpy.argsort(first)] = numpy.arange(len(clusters))
+    return order[inverse.ravel()]
+
+def _seed(data,prepared,nclusters,kernel,init,random=numpy.random):
+    """Initial centroids chosen by k-means++ or k-means||.
+    
+    k-means|| (Bahmani et al. 2012) starts from one random point and in each
+    of _rounds passes samples every point independently with probability
+    2*nclusters*D**2/sum(D**2), where D is its distance from the nearest
+    point sampled so far.  The sample, usually a few times nclusters points,
+    is then reduced to nclusters centroids by k-means++ with each sampled
+    point weighted by the number of data points nearest to it.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            The data points.
+        prepared : PreparedData or sparse matrix
+            data ready to be passed to kernel.
+        nclusters : integer
+            The number of centroids.
+        kernel : function
+            See distances.kernel.
+        init : string
+            k-means++ or k-means||.
+        random : module or RandomState
+            The source of random numbers.
+    Returns:
+        cdata : ndarray
+            Rank 2 array containing the centroids.
+    """
+    if init == 'k-means++':
+        return _plusplus(data,prepared,nclusters,kernel,random)
+    n = data.shape[0]
+    chosen = numpy.array([random.randint(n)])
+    nearest = _closest(_rows(data,chosen),prepared,n,kernel)[0]
+    for i in range(_rounds):
+        total = numpy.sum(nearest)
+        if not total > 0:
+            break
+        new = numpy.flatnonzero(random.random_sample(n) < 2*nclusters*nearest/total)
+        if len(new) > 0:
+            chosen = numpy.append(chosen,new)
+            nearest = numpy.minimum(nearest,_closest(_rows(data,new),prepared,n,kernel)[0])
+    if len(chosen) <= nclusters:
+        return _plusplus(data,prepared,nclusters,kernel,random)
+    candidates = _rows(data,chosen)
+    mass = numpy.bincount(_closest(candidates,prepared,n,kernel)[1],minlength=len(chosen))
+    return _plusplus(candidates,candidates,nclusters,kernel,random,mass)
+
+def _plusplus(data,prepared,nclusters,kernel,random,mass=None):
+    """k-means++ (Arthur and Vassilvitskii 2007): each centroid is a point 
+    chosen with probability proportional to mass times its squared distance 
+    from the nearest centroid already chosen.  See _seed."""
+    n = data.shape[0]
+    if mass is None:
+        mass = numpy.ones(n)
+    chosen = [_draw(mass,random)]
+    nearest = _closest(_rows(data,chosen),prepared,n,kernel)[0]
+    for i in range(1,nclusters):
+        #Once every point is at a chosen centroid any point will do.
+        chosen.append(_draw(mass*nearest if numpy.any(mass*nearest > 0) else mass,random))
+        nearest = numpy.minimum(nearest,_closest(_rows(data,chosen[-1:]),prepared,n,kernel)[0])
+    return _rows(data,chosen)
+
+def _draw(p,random):
+    """An index chosen with probability proportional to p."""
+    cumulative = numpy.cumsum(p)
+    return min(int(numpy.searchsorted(cumulative,random.random_sample()*cumulative[-1],side='right')),len(p)-1)
+
+def _rows(data,index):
+    """The rows index of data as a dense array."""
+    rows = data[index]
+    if scipy.sparse.issparse(rows):
+        rows = rows.toarray()
+    return numpy.array(rows)
+
+def _closest(centers,prepared,n,kernel):
+    """The squared distance from each of the n points in prepared to the 
+    nearest of centers, and the index of that center, working through the 
+    points in blocks of at most distances.maxblock distances.  A point with 
+    only nan distances counts as being at distance 0 from the first center."""
+    squared = numpy.zeros(n)
+    index = numpy.zeros(n,dtype=int)
+    rows = max(1,distances.maxblock//len(centers))
+    for i in range(0,n,rows):
+        d = kernel(centers,prepared[i:i+rows])
+        index[i:i+rows] = _assign(d)
+        d = d[index[i:i+rows],numpy.arange(d.shape[1])]
+        squared[i:i+rows] = numpy.where(numpy.isnan(d),0,d)**2
+    return squared,index
+
+class _Bounds(object):
+    """Bounds on the distances from each data point to the centroids, used by
+    kmeans to skip distances which cannot change the nearest centroid.
+    
+    After each assignment the distance to a point's own centroid is at most
+    upper, and its distance to every other centroid is at least lower (one 
+    bound for all of them for hamerly, one for each centroid for elkan).  When
+    the centroids move the bounds are loosened by how far they moved, which by
+    the triangle inequality keeps them true, and a point is only compared with
+    the centroids its bounds cannot rule out.  Distances are only skipped when
+    the bounds clear them by more than rounding could account for, so the 
+    assignments are those of comparing every point with every centroid.
+    
+    Properties:
+        evaluations : integer
+            The number of point to centroid distances computed so far.
+    """
+    def __init__(self,data,weights,metric,algorithm):
+        self.data = data
+        self.weights = weights
+        self.metric = metric
+        self.elkan = algorithm == 'elkan'
+        self.centroids = None
+        self.evaluations = 0
+        self._slack = numpy.sqrt(numpy.finfo(data.dtype).eps)
+    def _loose(self,d):
+        """d widened by more than the rounding error of a distance."""
+        return d+self._slack*(1+d)
+    def _distances(self,i,j):
+        """Distances from data point i[m] to centroid j[m] for each m."""
+        d = numpy.empty(len(i),dtype=self.data.dtype)
+        rows = max(1,distances.maxblock//max(1,self.data.shape[1]))
+        with numpy.errstate(all='ignore'):
+            for m in range(0,len(i),rows):
+                d[m:m+rows] = self.metric.elementwise(self.data[i[m:m+rows]],self.centroids[j[m:m+rows]],self.weights)
+        self.evaluations += len(i)
+        return numpy.where(numpy.isnan(d),numpy.inf,d)
+    def _all(self,i):
+        """Distances from data points i to every centroid."""
+        k = len(self.centroids)
+        d = self._distances(numpy.repeat(i,k),numpy.tile(numpy.arange(k),len(i)))
+        return d.reshape((len(i),k))
+    def assign(self,centroids):
+        """The nearest centroid to each data point."""
+        n,k = len(self.data),len(centroids)
+        if self.centroids is None:
+            self.centroids = centroids.copy()
+            d = self._all(numpy.arange(n))
+            self.nearest = numpy.argmin(d,axis=1)
+            self.upper = d[numpy.arange(n),self.nearest]
+            if self.elkan:
+                self.lower = d
+            else:
+                d[numpy.arange(n),self.nearest] = numpy.inf
+                self.lower = numpy.min(d,axis=1)
+            return self.nearest.copy()
+        with numpy.errstate(all='ignore'):
+            shift = self.metric.elementwise(self.centroids,centroids,self.weights)
+        shift = numpy.where(numpy.isnan(shift),numpy.inf,shift)
+        self.centroids = centroids.copy()
+        self.upper += shift[self.nearest]
+        if self.elkan:
+            self.lower = numpy.maximum(self.lower-shift,0)
+        else:
+            #Every other centroid moved at most the largest shift, or the 
+            #second largest for the points of the centroid which moved most.
+            order = numpy.argsort(-shift,kind='stable')
+            most = numpy.where(self.nearest == order[0],shift[order[min(1,k-1)]],shift[order[0]])
+            self.lower = numpy.maximum(self.lower-most,0)
+        #Half the distance from a centroid to the nearest other centroid.  A
+        #point nearer than this to its own centroid cannot move.
+        with numpy.errstate(all='ignore'):
+            cc = self.metric.pairwise(centroids,centroids,self.weights)/2
+        cc[numpy.isnan(cc)] = 0
+        numpy.fill_diagonal(cc,numpy.inf)
+        half = numpy.min(cc,axis=1)
+        if self.elkan:
+            self._elkan(cc,half)
+        else:
+            self._hamerly(half)
+        return self.nearest.copy()
+    def _hamerly(self,half):
+        bound = numpy.maximum(half[self.nearest],self.lower)
+        check = numpy.flatnonzero(self._loose(self.upper) >= bound)
+        self.upper[check] = self._distances(check,self.nearest[check])
+        check = check[self._loose(self.upper[check]) >= bound[check]]
+        if len(check) > 0:
+            d = self._all(check)
+            self.nearest[check] = numpy.argmin(d,axis=1)
+            self.upper[check] = d[numpy.arange(len(check)),self.nearest[check]]
+            d[numpy.arange(len(check)),self.nearest[check]] = numpy.inf
+            self.lower[check] = numpy.min(d,axis=1)
+    def _elkan(self,cc,half):
+        check = numpy.flatnonzero(self._loose(self.upper) >= half[self.nearest])
+        candidates = self._candidates(check,cc)
+        check = check[numpy.any(candidates,axis=1)]
+        own = self.nearest[check]
+        self.upper[check] = self.lower[check,own] = self._distances(check,own)
+        candidates = self._candidates(check,cc)
+        i,j = numpy.nonzero(candidates)
+        self.lower[check[i],j] = self._distances(check[i],j)
+        candidates[numpy.arange(len(check)),own] = True
+        d = numpy.where(candidates,self.lower[check],numpy.inf)
+        self.nearest[check] = numpy.argmin(d,axis=1)
+        self.upper[check] = numpy.min(d,axis=1)
+    def _candidates(self,check,cc):
+        """Which centroids other than their own the points check may be
+        nearer to."""
+        upper = self._loose(self.upper[check])[:,numpy.newaxis]
+        candidates = (upper >= self.lower[check])*(upper >= cc[self.nearest[check]])
+        candidates[numpy.arange(len(check)),self.nearest[check]] = False
+        return candidates
+    def reassign(self,i,j):
+        """Moves data point i to cluster j without comparing it."""
+        self.nearest[i] = j
+        self.upper[i] = numpy.inf
+        if not self.elkan:
+            self.lower[i] = 0
@@ -11,10 +11,161 @@ in the source code.
 import numpy
 from . import distances
 import scipy
+import scipy.sparse
 from . import _support
 import warnings
+import hashlib
 
-def distancematrix(data,weights=None,dist='e',verbose=False):
+headersize = 256 #Number of bytes reserved for the header of a distance matrix file
+
+class CondensedDistanceMatrix(object):
+    """A distance matrix stored as the lower half of the matrix in a single array.
+    
+    Since a distance matrix is symmetric and all its main diaganol elements are
+    0, only the elements below the main diaganol need to be stored.  These are
+    stored row after row in a single rank 1 array, so the row i occupies
+    elements i*(i-1)/2 to i*(i+1)/2 of the array.  Since the matrix is
+    symmetric this is also the upper half of the matrix stored column after
+    column.  The array can be any kind of ndarray, including a numpy.memmap.
+    
+    For compatibility with the list of arrays that distancematrix used to
+    return, dm[i] is the (rank 1) part of row i which is below the main
+    diaganol, so that dm[i][j] is the distance between points i and j when
+    j < i.  Any element of the full matrix can be obtained with dm[i,j], and
+    a full row of the matrix with dm.row(i).
+    
+    Properties:
+        array : ndarray
+            The rank 1 array containing the lower half of the matrix.
+        n : int
+            The number of data points (i.e. the number of rows in the full
+            matrix).
+    """
+    def __init__(self,dm):
+        """Creates the condensed matrix.
+        
+        Parameters:
+            dm : ndarray or list of ndarray
+                Either the rank 1 array of elements below the main diaganol
+                (which will be used without copying), the full rank 2 distance
+                matrix, or a list of the rows of the lower half of the matrix
+                (as returned by distancematrix before this class was
+                introduced).
+        """
+        if type(dm) is CondensedDistanceMatrix:
+            self.array = dm.array
+            self.n = dm.n
+        elif type(dm) is list:
+            self.n = len(dm)
+            self.array = numpy.zeros(self.n*(self.n-1)//2)
+            for i in range(self.n):
+                self.array[i*(i-1)//2:i*(i+1)//2] = dm[i][:i]
+        elif numpy.ndim(dm) == 2:
+            if numpy.shape(dm)[0] != numpy.shape(dm)[1]:
+                raise ValueError('Distance matrix must be square.')
+            self.n = len(dm)
+            self.array = numpy.zeros(self.n*(self.n-1)//2,dtype=numpy.result_type(dm,float))
+            dm = numpy.asanyarray(dm)
+            for start,stop,i,j in _trilindices(self.n):
+                self.array[start:stop] = dm[i,j]
+        elif numpy.ndim(dm) == 1:
+            self.n = int(round((1+numpy.sqrt(1+8*len(dm)))/2))
+            if self.n*(self.n-1)//2 != len(dm):
+                raise ValueError('Length of condensed distance matrix is not a triangular number.')
+            self.array = dm
+        else:
+            raise TypeError('Distance matrix must be a list, rank 1 array, or rank 2 array.')
+    def __len__(self):
+        return self.n
+    def __getitem__(self,i):
+        """dm[i] gives the lower half of row i, dm[i,j] gives an element."""
+        if type(i) is tuple:
+            i,j = i
+            i = numpy.asarray(i)%self.n
+            j = numpy.asarray(j)%self.n
+            i,j = numpy.broadcast_arrays(i,j)
+            high = numpy.maximum(i,j)
+            low = numpy.minimum(i,j)
+            #Only the elements off the diaganol are looked up, since the array
+            #is empty when n is 1.
+            d = numpy.zeros(i.shape,dtype=self.array.dtype)
+            off = i != j
+            d[off] = self.array[high[off]*(high[off]-1)//2+low[off]]
+            if d.ndim == 0:
+                d = float(d)
+            return d
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError('Index %i is out of range.' % i)
+        return self.array[i*(i-1)//2:i*(i+1)//2]
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+    def row(self,i):
+        """The full row i of the distance matrix.
+        
+        Parameters:
+            i : int
+                The index of the data point.
+        Returns:
+            d : ndarray
+                Rank 1 array containing the distance between point i and each
+                point in the data set.
+        """
+        if i < 0:
+            i += self.n
+        d = numpy.zeros(self.n,dtype=self.array.dtype)
+        d[:i] = self.array[i*(i-1)//2:i*(i+1)//2]
+        k = numpy.arange(i+1,self.n)
+        d[i+1:] = self.array[k*(k-1)//2+i]
+        return d
+    def square(self,out=None):
+        """Converts to the full (square) distance matrix.
+        
+        Parameters:
+            out : ndarray
+                Optional.  Rank 2 array with dimensions n x n into which the
+                full matrix is written.
+        Returns:
+            dm : ndarray
+                The full distance matrix.  This matrix is symmetric with all
+                main diaganol elements equal to 0.
+        """
+        if out is None:
+            out = numpy.zeros((self.n,self.n),dtype=self.array.dtype)
+        elif numpy.shape(out) != (self.n,self.n):
+            raise ValueError('out must have dimensions %i x %i' % (self.n,self.n))
+        for start,stop,i,j in _trilindices(self.n):
+            out[i,j] = out[j,i] = self.array[start:stop]
+        numpy.fill_diagonal(out,0)
+        return out
+
+def _trilindices(n):
+    """Generates the row and column indices of the elements below the main
+    diaganol of an n x n matrix, in the order they are stored by 
+    CondensedDistanceMatrix, in blocks of whole rows of about 
+    distances.maxblock elements to bound the memory used by the indices.
+    
+    Yields:
+        start, stop : integer
+            The block holds elements start to stop of the condensed array.
+        i, j : ndarray
+            The row and column of each element of the block.
+    """
+    row = 1
+    while row < n:
+        start = row*(row-1)//2
+        #The largest end row whose block holds at most maxblock elements.
+        end = int((1+numpy.sqrt(1+8*(start+distances.maxblock)))/2)
+        end = min(max(end,row+1),n)
+        stop = end*(end-1)//2
+        i = numpy.repeat(numpy.arange(row,end),numpy.arange(row,end))
+        j = numpy.arange(start,stop)-i*(i-1)//2
+        yield start,stop,i,j
+        row = end
+
+def distancematrix(data,weights=None,dist='e',verbose=False,out=None,chunk_rows=None,max_memory=None,n_jobs=None,binary=False,dtype=float):
     """Computes the distance matrix for a given data set.
     
     The distance matrix indicates the distance between each data point in the
@@ -25,13 +176,19 @@ def distancematrix(data,weights=None,dist='e',verbose=False):
     needed memory by only storing the lower half matrix, excluding the main
     diaganol.
     
+    The matrix is computed one block of rows at a time and each block is
+    written to out as soon as it is complete.  By giving a numpy.memmap or a
+    function as out, the memory used is bounded by the block size rather than
+    by the size of the matrix.
+    
     While the transpose parameter has been removed, the behavior formerly
     obtained by setting transpose to True can be duplicated by the command
     distancematrix(numpy.transpose(data),...).
     
     Parameters:
-        data : ndarray
+        data : ndarray or sparse matrix
             Rank 2 array. Each row is assumed to represent a single data point.
+            See distances.pdist for the use of a scipy.sparse matrix.
         weights : ndarray
             Optional.  If given, a rank 1 array with length equal to the number
             of columns in data.  Entries specify the weight for each dimension
@@ -40,34 +197,58 @@ def distancematrix(data,weights=None,dist='e',verbose=False):
             Specifies the desired distance function by it's alias.
         verbose : boolean
             If true periodic updates on progress will be printed to the screen.
+        out : ndarray or function
+            Optional.  Where the distance matrix is written.  Either a rank 1
+            array (or numpy.memmap) with length N*(N-1)/2, where N is the number
+            of rows in data, or a function.  An array is filled with the rows of
+            the lower half of the matrix one after the other.  A function is
+            called as out(i,block) for each block, where block is rows i to
+            i+len(block) of the full distance matrix including only the first
+            i+len(block) columns.
+        chunk_rows : integer
+            Optional.  The number of rows computed in each block.
+        max_memory : integer
+            Optional.  Approximate number of bytes that each intermediate array
+            used to compute a block may occupy.  Ignored if chunk_rows is given.
+        n_jobs : integer
+            Optional.  The number of processes used to compute the blocks.  -1
+            uses one process per cpu.  The results are identical to those
+            computed by a single process.  If out is a numpy.memmap of a file
+            each process writes its blocks straight into the file.
+        binary : boolean
+            If true, data containing only 0, 1 and nan is packed into bits to
+            compute the h, t, y, j, d and z distances.  See distances.pdist.
+        dtype : data-type
+            The floating point type used for the data and the distance matrix.
+            numpy.float32 halves the memory used.
     Returns:
-        dm : list of ndarray
-            Returns only the lower left half of the matrix, not including the 
+        dm : CondensedDistanceMatrix
+            Stores only the lower left half of the matrix, not including the 
             main diaganol.  Upper right half elements are a mirror of the lower
             left half and main diaganol elements are all zero.  Thus, each row
-            has one more element than the one above, and the first row has no
-            elements.
+            dm[i] has one more element than the one above, and the first row
+            has no elements.  If out is an array then dm is backed by out.  If
+            out is a function then None is returned.
     See Also:
-        distances.distance
+        CondensedDistanceMatrix, distances.distance, distances.pdist
     """
-    dm = []
-    if verbose:
-        N = len(data)*(len(data)-1)/2
-        current = 0
-        n = 0
-    for i in range(len(data)):
-        row = []
-        for j in range(i):
-            row.append(distances.distance(data[i],data[j],weights,dist))
-            if verbose:
-                n += 1
-                if n*100/N > current:
-                    current = n*100/N
-                    print('%i%% complete' % current)
-        dm.append(numpy.array(row))
+    data,weights,metric = distances._prepare(data,weights,dist,dtype)
+    n = distances._npoints(data)
+    if out is None:
+        dm = CondensedDistanceMatrix(numpy.zeros(n*(n-1)//2,dtype=dtype))
+    elif callable(out):
+        dm = None
+    elif numpy.shape(out) != (n*(n-1)//2,):
+        raise ValueError('out must be a rank 1 array with length %i' % (n*(n-1)//2))
+    else:
+        dm = CondensedDistanceMatrix(out)
+    data,rows = distances._blockdata(data,weights,metric,chunk_rows,max_memory,binary)
+    for i,block in distances._tril(data,weights,metric,rows,verbose,n_jobs,None if dm is None else dm.array,True):
+        if dm is None:
+            out(i,block)
     return dm
 
-def fulldistancematrix(data,weights=None,dist='e',verbose=False):
+def fulldistancematrix(data,weights=None,dist='e',verbose=False,out=None,chunk_rows=None,max_memory=None,n_jobs=None,binary=False,dtype=float):
     """Computes the distance matrix for a given data set.
     
     Same as distancematrix but retruns the full distance matrix.  Requires more
@@ -78,8 +259,9 @@ def fulldistancematrix(data,weights=None,dist='e',verbose=False):
     fulldistancematrix(numpy.transpose(data),...).
     
     Parameters:
-        data : ndarray
+        data : ndarray or sparse matrix
             Rank 2 array. Each row is assumed to represent a single data point.
+            See distances.pdist for the use of a scipy.sparse matrix.
         weights : ndarray
             Optional.  If given, a rank 1 array with length equal to the number
             of columns in data.  Entries specify the weight for each dimension
@@ -88,28 +270,234 @@ def fulldistancematrix(data,weights=None,dist='e',verbose=False):
             Specifies the desired distance function by it's alias.
         verbose : boolean
             If true periodic updates on progress will be printed to the screen.
+        out : ndarray or function
+            Optional.  Where the distance matrix is written.  Either a rank 2
+            array (or numpy.memmap) with dimensions N x N, where N is the number
+            of rows in data, or a function.  See distances.pdist for details.
+        chunk_rows : integer
+            Optional.  The number of rows computed in each block.
+        max_memory : integer
+            Optional.  Approximate number of bytes that each intermediate array
+            used to compute a block may occupy.  Ignored if chunk_rows is given.
+        n_jobs : integer
+            Optional.  The number of processes used to compute the blocks.  -1
+            uses one process per cpu.
+        binary : boolean
+            If true, data containing only 0, 1 and nan is packed into bits to
+            compute the h, t, y, j, d and z distances.  See distances.pdist.
+        dtype : data-type
+            The floating point type used for the data and the distance matrix.
+            numpy.float32 halves the memory used.
     Returns:
         dm : ndarray
             Returns the distance matrix for the data.  This matrix is symmetric
-            and with all main diaganol elements equal to 0.
+            and with all main diaganol elements equal to 0.  If out is an array
+            then dm is out.  If out is a function then None is returned.
+    See Also:
+        distancematrix, distances.pdist
+    """
+    return distances.pdist(data,weights,dist,verbose,out,chunk_rows,max_memory,n_jobs,binary,dtype)
+
+def distancegraph(data,weights=None,dist='e',radius=None,k=None,verbose=False,chunk_rows=None,max_memory=None,n_jobs=None,binary=False,dtype=float):
+    """Computes a sparse graph of the short distances in a data set.
+    
+    Only the distances up to a radius, or from each data point to its k
+    nearest neighbours, are kept.  The distances are computed in blocks by
+    distances.pdisttiles, so the memory used is bounded by the block size and
+    the size of the graph rather than by the size of the full distance matrix.
+    
+    Parameters:
+        data : ndarray or sparse matrix
+            Rank 2 array. Each row is assumed to represent a single data point.
+            See distances.pdist for the use of a scipy.sparse matrix.
+        weights : ndarray
+            Optional.  If given, a rank 1 array with length equal to the number
+            of columns in data.  Entries specify the weight for each dimension
+            in the distance function.
+        dist : string
+            Specifies the desired distance function by it's alias.
+        radius : float
+            Keep every distance between two different data points which is at
+            most radius.  Exactly one of radius and k must be given.
+        k : integer
+            Keep the distances from each data point to its k nearest 
+            neighbours, not counting itself.  Ties are broken arbitrarily.
+        verbose, chunk_rows, max_memory, n_jobs, binary, dtype
+            As for distancematrix.
+    Returns:
+        graph : scipy.sparse.csr_matrix
+            Matrix with dimensions N x N, where N is the number of rows in 
+            data.  graph[i,j] is the distance between data points i and j if
+            it is kept.  The graph is symmetric for a radius, but for k row i
+            holds the neighbours of point i, which need not have i as one of 
+            theirs.  Distances of 0 are stored explicitly, so the edges are 
+            the stored elements of the graph rather than its nonzero elements.
+            Distances which are nan are never kept.
     See Also:
-        distancematrix    
+        distancematrix, distances.pdisttiles, hierarch.aggtreecluster
     """
-    dm = numpy.zeros((len(data),len(data)))
-    if verbose:
-        N = len(data)*(len(data)-1)/2
-        current = 0
-        n = 0
-    for i in range(len(data)):
-        for j in range(i):
-            dm[j][i] = dm[i][j] = distances.distance(data[i],data[j],weights,dist)
-            if verbose:
-                n += 1
-                if n*100/N > current:
-                    current = n*100/N
-                    print('%i%% complete' % current)
+    if (radius is None) == (k is None):
+        raise ValueError('Exactly one of radius and k must be given')
+    elif k is not None and k < 1:
+        raise ValueError('k must be at least 1')
+    tiles = distances.pdisttiles(data,weights,dist,None,verbose,chunk_rows,max_memory,n_jobs,binary,dtype)
+    n = data.shape[0]
+    rows = []
+    columns = []
+    d = []
+    if radius is not None:
+        for r,c,block in tiles:
+            with numpy.errstate(invalid='ignore'):
+                i,j = numpy.nonzero(numpy.tril(block <= radius,r[0]-1))
+            rows.append(r[i])
+            columns.append(c[j])
+            d.append(block[i,j])
+        rows,columns,d = [numpy.concatenate(x) for x in [rows,columns,d]]
+        rows,columns,d = numpy.concatenate([rows,columns]),numpy.concatenate([columns,rows]),numpy.concatenate([d,d])
+    else:
+        k = min(int(k),max(1,n-1))
+        nearest = numpy.full((n,k),numpy.inf,dtype=dtype)
+        index = numpy.full((n,k),-1,dtype=int)
+        for r,c,block in tiles:
+            i = r[0]
+            block[numpy.isnan(block)] = numpy.inf
+            block[numpy.arange(len(r)),r] = numpy.inf
+            #Each tile holds the distances from its rows to the columns before
+            #them, and, by symmetry, from those columns to its rows.
+            _mergenearest(nearest,index,r,block,c)
+            _mergenearest(nearest,index,c[:i],numpy.transpose(block[:,:i]),r)
+        keep = numpy.isfinite(nearest)
+        rows = numpy.repeat(numpy.arange(n),k)[keep.reshape(-1)]
+        columns = index[keep]
+        d = nearest[keep]
+    return scipy.sparse.csr_matrix((d,(rows,columns)),shape=(n,n),dtype=dtype)
+
+def _mergenearest(nearest,index,rows,d,columns):
+    """Merges the distances d[i,j] from data point rows[i] to columns[j] into
+    the k nearest distances and neighbours found so far for rows[i]."""
+    k = nearest.shape[1]
+    dq = numpy.concatenate([nearest[rows],d],axis=1)
+    iq = numpy.concatenate([index[rows],numpy.broadcast_to(columns,d.shape)],axis=1)
+    keep = numpy.argpartition(dq,k-1,axis=1)[:,:k]
+    nearest[rows] = numpy.take_along_axis(dq,keep,axis=1)
+    index[rows] = numpy.take_along_axis(iq,keep,axis=1)
+
+def savedistancematrix(filename,data,weights=None,dist='e',verbose=False,chunk_rows=None,max_memory=None,n_jobs=None,binary=False,dtype=float):
+    """Computes the distance matrix for a given data set and stores it in a file.
+    
+    The matrix is written directly to the file through a numpy.memmap, one
+    block of rows at a time, so it never has to be held in memory.  The file
+    starts with a human readable header which records the number of data
+    points, the dtype of the stored distances, the distance alias, and a hash
+    of the weights.  The header is followed by the lower half of the matrix
+    (excluding the main diaganol) stored row after row, i.e. the same order as
+    the rows returned by distancematrix.  Since the matrix is symmetric this
+    is also the upper half of the matrix stored column after column.
+    
+    Parameters:
+        filename : string
+            The name of the file where the distance matrix is to be stored.
+        data : ndarray or sparse matrix
+            Rank 2 array. Each row is assumed to represent a single data point.
+            See distances.pdist for the use of a scipy.sparse matrix.
+        weights : ndarray
+            Optional.  If given, a rank 1 array with length equal to the number
+            of columns in data.  Entries specify the weight for each dimension
+            in the distance function.
+        dist : string
+            Specifies the desired distance function by it's alias.
+        verbose : boolean
+            If true periodic updates on progress will be printed to the screen.
+        chunk_rows : integer
+            Optional.  The number of rows computed in each block.
+        max_memory : integer
+            Optional.  Approximate number of bytes that each intermediate array
+            used to compute a block may occupy.  Ignored if chunk_rows is given.
+        n_jobs : integer
+            Optional.  The number of processes used to compute the blocks.  -1
+            uses one process per cpu.  Each process writes its blocks straight
+            into the file.
+        binary : boolean
+            If true, data containing only 0, 1 and nan is packed into bits to
+            compute the h, t, y, j, d and z distances.  See distances.pdist.
+        dtype : data-type
+            The data type used to compute and store the distances.
+    See Also:
+        distancematrix, loaddistancematrix
+    """
+    n = distances._npoints(data)
+    size = n*(n-1)//2
+    header = 'cluster distance matrix\nN: %i\ndtype: %s\ndist: %s\nweights: %s\n' % (n,numpy.dtype(dtype).str,distances.getmetric(dist).alias,_weightshash(weights))
+    header = header.encode('ascii')
+    if len(header) > headersize:
+        raise ValueError('The distance matrix file header is longer than %i bytes, use a shorter alias for the distance.' % headersize)
+    if size > 0:
+        out = numpy.memmap(filename,dtype=dtype,mode='w+',offset=headersize,shape=(size,))
+        distancematrix(data,weights,dist,verbose,out,chunk_rows,max_memory,n_jobs,binary,dtype)
+        out.flush()
+        del out
+    else:
+        open(filename,'wb').close()
+    with open(filename,'r+b') as f:
+        f.write(header.ljust(headersize))
+    return
+
+def loaddistancematrix(filename,weights=None,dist=None,mode='r'):
+    """Loads a distance matrix stored using savedistancematrix.
+    
+    The distances are not read into memory.  Instead, the matrix is backed by
+    a numpy.memmap of the file and so can be passed to any function which
+    accepts the output of distancematrix (e.g. hierarch.aggtreecluster,
+    silhouette, or the medoid centroid methods).
+    
+    Parameters:
+        filename : string
+            The name of the file where the distance matrix is stored.
+        weights : ndarray
+            Optional.  If given, these weights are checked against those used
+            to compute the stored matrix.
+        dist : string
+            Optional.  If given, this distance alias is checked against the one
+            used to compute the stored matrix.
+        mode : string
+            The mode used to open the numpy.memmap.  See numpy.memmap for
+            options.
+    Returns:
+        dm : CondensedDistanceMatrix
+            The distance matrix, backed by a numpy.memmap of the file.
+    See Also:
+        distancematrix, savedistancematrix
+    """
+    with open(filename,'rb') as f:
+        header = f.read(headersize).decode('ascii').split('\n')
+    if header[0] != 'cluster distance matrix':
+        raise ValueError('%s is not a distance matrix file.' % filename)
+    info = {}
+    for i in header[1:]:
+        if ': ' in i:
+            info[i[:i.index(': ')]] = i[i.index(': ')+2:]
+    n = int(info['N'])
+    if not (dist is None) and distances.getmetric(dist).alias != info['dist']:
+        raise ValueError('Stored distance matrix uses distance %s, not %s.' % (info['dist'],distances.getmetric(dist).alias))
+    if not (weights is None) and _weightshash(weights) != info['weights']:
+        raise ValueError('Stored distance matrix uses different weights.')
+    size = n*(n-1)//2
+    if size > 0:
+        dm = numpy.memmap(filename,dtype=info['dtype'],mode=mode,offset=headersize,shape=(size,))
+    else:
+        dm = numpy.zeros(0,dtype=info['dtype'])
+    if n == 0:
+        dm = CondensedDistanceMatrix([])
+    else:
+        dm = CondensedDistanceMatrix(dm)
     return dm
 
+def _weightshash(weights):
+    """Hash identifying a set of weights in a distance matrix file header."""
+    if weights is None:
+        return 'None'
+    return hashlib.sha1(numpy.asarray(weights,dtype='<f8').tobytes()).hexdigest()
+
 def silhouette(point,levs,dm=None,data=None,weight=None,dist='e'):
     """Variation on the silhouette coefficient that works for fuzzy clustering.
     
@@ -156,7 +544,7 @@ def silhouette(point,levs,dm=None,data=None,weight=None,dist='e'):
             Rank 2 array contianing entries indicating the membership level of
             each point in each cluster. levs[i][j] is the level to which the 
             ith data point belongs to the jth cluster.
-        dm : list of ndarrays or ndarray
+        dm : CondensedDistanceMatrix or list of ndarrays or ndarray
             Optional.  The distance matrix for the data (i.e. the results of a 
             distancematrix or fulldistancematrix call).  If not provided data is
             required.
@@ -174,18 +562,15 @@ def silhouette(point,levs,dm=None,data=None,weight=None,dist='e'):
             The silhouette coefficient for the given point in the data set.
     """
     if dm is None:
-        d = []
-        for i in range(len(data)):
-            d.append(distances.distance(data[point],data[i],weight,dist))
-        d = numpy.array(d)
+        data = numpy.asarray(data,dtype=float)
+        d = distances.kernel(dist,weight)(data[point:point+1],data)[0]
+    elif type(dm) is CondensedDistanceMatrix:
+        d = dm.row(point)
     elif type(dm) is list:
-        d = []
-        for i in range(len(dm)):
-            if i == point:
-                d.append(0)
-            else:
-                d.append(dm[max([i,point])][min([i,point])])
-        d = numpy.array(d)
+        d = numpy.zeros(len(dm))
+        d[:point] = dm[point]
+        for i in range(point+1,len(dm)):
+            d[i] = dm[i][point]
     else:
         d = dm[point]
     s = 1 - d
@@ -269,8 +654,9 @@ def singleclustercentroid(data,lev,p=1.,method='a',weights=None,distancematrix=N
     singleclustercentroid(numpy.transpose(data),...).
 
     Parameters:
-        data : ndarray
-            Rank 2 array containing the data set.
+        data : ndarray or sparse matrix
+            Rank 2 array containing the data set.  If data is a scipy.sparse
+            matrix only the arithmetic mean is available.
         lev : ndarray
             Rank 1 array that contains the list of weights that specify how 
             important a particular point is in determining the location of the
@@ -301,7 +687,7 @@ def singleclustercentroid(data,lev,p=1.,method='a',weights=None,distancematrix=N
             of rows in data.  Entries specify the weight for each dimension in 
             the distance function.  Only needed if a medoid method is being 
             used and dimensions are not equally weighted.
-        distancematrix : ndarray
+        distancematrix : ndarray or CondensedDistanceMatrix or list of ndarrays
             Optional.  Used to save time when calculating centroids using a
             medoid (o) method.  Passing distancematrix prevents this function
             from calculating it and thus this option is mostly useful when
@@ -321,6 +707,10 @@ def singleclustercentroid(data,lev,p=1.,method='a',weights=None,distancematrix=N
     See Also:
         distances.distance
     """
+    if scipy.sparse.issparse(data):
+        if method != 'a':
+            raise ValueError('Only the arithmetic mean is supported for sparse data.')
+        return 1.*(data.T @ lev**p)/numpy.sum(lev**p)
     lev = lev[:,numpy.newaxis]
     if method == 'a':
         centroid = _support.mean(data,lev**p,axis=0,NN=False)
@@ -341,13 +731,45 @@ def singleclustercentroid(data,lev,p=1.,method='a',weights=None,distancematrix=N
             d = fulldistancematrix(data,weights,method[1:])
         else:
             d = distancematrix
-        d = list(_support.mean(d,lev**p,axis=0,NN=False))
+        if type(d) is list or type(d) is CondensedDistanceMatrix:
+            d = list(_trilmean(d,lev[:,0]**p))
+        else:
+            d = list(_support.mean(d,lev**p,axis=0,NN=False))
         i = d.index(min(d))
         centroid = data[i]
     else:
         raise ValueError('Method type unsupported.')
     return centroid
 
+def _trilmean(dm,w):
+    """Weighted mean of each column of a distance matrix given as its lower half.
+    
+    Equivalent to _support.mean(full,w[:,numpy.newaxis],axis=0,NN=False) where
+    full is the full distance matrix, but works row by row so that the full
+    matrix is never formed.
+    
+    Parameters:
+        dm : CondensedDistanceMatrix or list of ndarray
+            The lower left half of the distance matrix, as returned by
+            distancematrix.
+        w : ndarray
+            Rank 1 array with the weight of each row.
+    Returns:
+        result : ndarray
+            The weighted mean of each column.
+    """
+    total = numpy.zeros(len(dm))
+    count = numpy.zeros(len(dm))
+    for i in range(len(dm)):
+        row = numpy.asarray(dm[i],dtype=float)
+        valid = ~numpy.isnan(row)
+        row = numpy.where(valid,row,0)
+        total[:i] += w[i]*row
+        count[:i] += w[i]*valid
+        total[i] += numpy.dot(w[:i],row)
+        count[i] += numpy.dot(w[:i],valid) + w[i]
+    return total/count
+
 def clustercentroids(data,levs,p=1.,method='a',weights=None,distancematrix=None):
     """Calculates the centroid of all clusters.
     
@@ -356,7 +778,7 @@ def clustercentroids(data,levs,p=1.,method='a',weights=None,distancematrix=None)
     numpy.transpose(clustercentroids(numpy.transpose(data),...).
 
     Parameters:
-        data : ndarray
+        data : ndarray or sparse matrix
             Rank 2 array containing the data set.
         levs : ndarray
             Rank 2 array indicating the membership level of each data point in
@@ -375,7 +797,7 @@ def clustercentroids(data,levs,p=1.,method='a',weights=None,distancematrix=None)
             of columns in data.  Entries specify the weight for each dimension
             in the distance function.  Only needed if a medoid method is being 
             used and dimensions are not equally weighted.
-        distancematrix : ndarray
+        distancematrix : ndarray or CondensedDistanceMatrix or list of ndarrays
             Optional.  Used to save time when calculating centroids using a
             medoid (o) method.  Passing distancematrix prevents this function
             from calculating it and thus this option is mostly useful when
@@ -454,34 +876,33 @@ def SEmatrix(data,levs,p=1.,method='a',dist='e',weights=None,cdata=None,distance
     """
     if cdata is None:
         cdata = clustercentroids(data,levs,p,method,weights,distancematrix)
-    sse = numpy.zeros((len(data),len(levs[0])),dtype=float)
-    for i in range(len(data)):
-        if cdata.dtype.type is numpy.object_:
-            for j in range(len(cdata)):
-                k = list(map(len,cdata[j]))
-                index = numpy.zeros_like(k)
-                d = numpy.zeros(numpy.prod(k))
-                for n in range(len(d)):
-                    cent = numpy.zeros(len(index))
-                    for m in range(len(index)):
-                        cent[m] = cdata[j,m][index[m]]
-                    d[n] = distances.distance(data[i],cent,dist=dist)
-                    index[0] += 1
-                    for m in range(len(index)-1):
-                        if index[m] == k[m]:
-                            index[m] = 0
-                            index[m+1] += 1
-                if link == 'm':
-                    sse[i][j] += levs[i][j]**p*(d.max())**2
-                elif link == 's':
-                    sse[i][j] += levs[i][j]**p*(d.min())**2
-                elif link == 'a':
-                    sse[i][j] += levs[i][j]**p*(numpy.mean(d))**2
-                else:
-                    raise ValueError('Link type not supported.')
-        else:
-            for j in range(len(cdata)):
-                sse[i][j] += levs[i][j]**p*(distances.distance(data[i],cdata[j],dist=dist))**2
+    if cdata.dtype.type is not numpy.object_:
+        sse = levs**p*distances.cdist(data,cdata,dist=dist)**2
+    else:
+        sse = numpy.zeros((len(data),len(levs[0])),dtype=float)
+        kernel = distances.kernel(dist)
+        prepared = distances.PreparedData(numpy.asarray(data,dtype=float))
+        for j in range(len(cdata)):
+            k = list(map(len,cdata[j]))
+            index = numpy.zeros_like(k)
+            cent = numpy.zeros((numpy.prod(k),len(index)))
+            for n in range(len(cent)):
+                for m in range(len(index)):
+                    cent[n][m] = cdata[j,m][index[m]]
+                index[0] += 1
+                for m in range(len(index)-1):
+                    if index[m] == k[m]:
+                        index[m] = 0
+                        index[m+1] += 1
+            d = kernel(prepared,cent)
+            if link == 'm':
+                sse[:,j] = levs[:,j]**p*(d.max(axis=1))**2
+            elif link == 's':
+                sse[:,j] = levs[:,j]**p*(d.min(axis=1))**2
+            elif link == 'a':
+                sse[:,j] = levs[:,j]**p*(numpy.mean(d,axis=1))**2
+            else:
+                raise ValueError('Link type not supported.')
     return sse
 
 def levscompare(levs1,levs2,rtol=1.0000000000000001e-005,atol=1e-008):
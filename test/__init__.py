@@ -6,6 +6,7 @@ flags which are simply passed to another function call).
 """
 
 import numpy
+import scipy.sparse
 import cluster
 import pickle
 import warnings
@@ -39,7 +40,7 @@ def distance(verbose=0,rtol=1.0000000000000001e-005,atol=1e-008,force=False):
     """Tests to see if distances submodule is working properly.
     
     This code catches and ignores the usual UserWarnings that using weights with
-    the spearman, kendall, and chebychev distances would raise.
+    the spearman and kendall distances would raise.
     
     Parameters:
         verbose : int
@@ -124,6 +125,247 @@ def distance(verbose=0,rtol=1.0000000000000001e-005,atol=1e-008,force=False):
                         print('FAIL: %s with missing data is outside tolerance' % i[1])
                     testfail_tol += 1
             testnum += 1
+        #pdist (data)
+        data = numpy.array([b,c,a],dtype=float)
+        for i in dist:
+            try:
+                dm = cluster.distances.pdist(data,weights,i[0])
+            except Exception as ex:
+                if not force:
+                    raise
+                else:
+                    testfail_ex += 1
+                    if verbose:
+                        print('FAIL: pdist with %s raises %s' % (i[1],type(ex).__name__))
+            else:
+                t = numpy.allclose(dm[2,0],distances_no_missing[i[0]],rtol,atol)
+                t = t and numpy.allclose(dm[2,1],distances_missing[i[0]],rtol,atol)
+                t = t and numpy.allclose(dm,numpy.transpose(dm),rtol,atol)
+                if t and verbose > 1:
+                    print('PASS: pdist with %s' % i[1])
+                elif not t:
+                    if verbose:
+                        print('FAIL: pdist with %s is outside tolerance' % i[1])
+                    testfail_tol += 1
+            testnum += 1
+        #cdist (a, data)
+        for i in dist:
+            try:
+                dm = cluster.distances.cdist(data[2:],data[:2],weights,i[0])
+            except Exception as ex:
+                if not force:
+                    raise
+                else:
+                    testfail_ex += 1
+                    if verbose:
+                        print('FAIL: cdist with %s raises %s' % (i[1],type(ex).__name__))
+            else:
+                t = numpy.allclose(dm[0,0],distances_no_missing[i[0]],rtol,atol)
+                t = t and numpy.allclose(dm[0,1],distances_missing[i[0]],rtol,atol)
+                if t and verbose > 1:
+                    print('PASS: cdist with %s' % i[1])
+                elif not t:
+                    if verbose:
+                        print('FAIL: cdist with %s is outside tolerance' % i[1])
+                    testfail_tol += 1
+            testnum += 1
+        #kendall (a, [b, c])
+        try:
+            d = cluster.distances.kendall(a,numpy.array([b,c]))
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: kendall from one point to many raises %s' % type(ex).__name__)
+        else:
+            t = numpy.allclose(d,[distances_no_missing['k'],distances_missing['k']],rtol,atol)
+            if t and verbose > 1:
+                print('PASS: kendall from one point to many')
+            elif not t:
+                if verbose:
+                    print('FAIL: kendall from one point to many is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
+        #pdist (binary)
+        binary = (numpy.array([a,b,c]) > numpy.nanmedian(a))*1.
+        binary[numpy.isnan([a,b,c])] = numpy.nan
+        for i in ['h','t','y','j','d','z']:
+            try:
+                dm = cluster.distances.pdist(binary,dist=i,binary=True)
+            except Exception as ex:
+                if not force:
+                    raise
+                else:
+                    testfail_ex += 1
+                    if verbose:
+                        print('FAIL: pdist with binary %s raises %s' % (i,type(ex).__name__))
+            else:
+                t = numpy.allclose(dm,cluster.distances.pdist(binary,dist=i),rtol,atol)
+                if t and verbose > 1:
+                    print('PASS: pdist with binary %s' % i)
+                elif not t:
+                    if verbose:
+                        print('FAIL: pdist with binary %s is outside tolerance' % i)
+                    testfail_tol += 1
+            testnum += 1
+        #PreparedData
+        try:
+            prepared = cluster.distances.PreparedData(numpy.array([a,b,c]),weights)
+            N = prepared.common(prepared)
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: PreparedData raises %s' % type(ex).__name__)
+        else:
+            valid = ~numpy.isnan([a,b,c])
+            t = numpy.allclose(N,[[numpy.sum(weights*i*j) for j in valid] for i in valid],rtol,atol)
+            t = t and numpy.allclose(prepared.counts,numpy.diag(N),rtol,atol)
+            if t and verbose > 1:
+                print('PASS: PreparedData')
+            elif not t:
+                if verbose:
+                    print('FAIL: PreparedData is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
+        #pdist (registered metric)
+        try:
+            if 'test' not in cluster.distances.metrics:
+                cluster.distances.registermetric('test',cluster.distances.euclidean)
+            dm = cluster.distances.pdist(numpy.array([b,c,a]),weights,'test')
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: pdist with a registered metric raises %s' % type(ex).__name__)
+        else:
+            t = numpy.allclose(dm[2,0],distances_no_missing['e'],rtol,atol)
+            t = t and numpy.allclose(dm[2,1],distances_missing['e'],rtol,atol)
+            if t and verbose > 1:
+                print('PASS: pdist with a registered metric')
+            elif not t:
+                if verbose:
+                    print('FAIL: pdist with a registered metric is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
+        #Metric.elementwise (registered metric)
+        try:
+            if 'testpair' not in cluster.distances.metrics:
+                cluster.distances.registermetric('testpair',lambda x,y,w: float(numpy.sqrt(numpy.sum(w*(x-y)**2)/numpy.sum(w))),metric=True,nan=False)
+            points = numpy.array([b,c,a])
+            d = cluster.distances.getmetric('testpair').elementwise(points[:,numpy.newaxis,:],points[numpy.newaxis,:,:],weights)
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: Metric.elementwise with a registered metric raises %s' % type(ex).__name__)
+        else:
+            t = numpy.allclose(d,cluster.distances.pdist(points,weights,'e'),rtol,atol)
+            if t and verbose > 1:
+                print('PASS: Metric.elementwise with a registered metric')
+            elif not t:
+                if verbose:
+                    print('FAIL: Metric.elementwise with a registered metric is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
+        #kernel
+        try:
+            kernel = cluster.distances.kernel('e',weights)
+            d = kernel(numpy.array([b,c],dtype=float),cluster.distances.PreparedData(numpy.array([a],dtype=float),weights))
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: kernel raises %s' % type(ex).__name__)
+        else:
+            t = numpy.allclose(d[:,0],[distances_no_missing['e'],distances_missing['e']],rtol,atol)
+            if t and verbose > 1:
+                print('PASS: kernel')
+            elif not t:
+                if verbose:
+                    print('FAIL: kernel is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
+        #pdist (fractional Minkowski and Chebychev)
+        try:
+            dm = cluster.distances.pdist(numpy.array([b,c,a]),weights,'L1.5')
+            dminf = cluster.distances.pdist(numpy.array([b,c,a]),weights,'Linf')
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: pdist with fractional Minkowski and Chebychev raises %s' % type(ex).__name__)
+        else:
+            valid = ~numpy.isnan(c)
+            t = numpy.allclose(dm[2,0],(numpy.sum(weights*numpy.abs(a-b)**1.5)/numpy.sum(weights))**(1/1.5),rtol,atol)
+            t = t and numpy.allclose(dm[2,1],(numpy.sum((weights*numpy.abs(a-c)**1.5)[valid])/numpy.sum(weights[valid]))**(1/1.5),rtol,atol)
+            t = t and numpy.allclose(dminf[2,:2],[distances_no_missing['Linf'],distances_missing['Linf']],rtol,atol)
+            if t and verbose > 1:
+                print('PASS: pdist with fractional Minkowski and Chebychev')
+            elif not t:
+                if verbose:
+                    print('FAIL: pdist with fractional Minkowski and Chebychev is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
+        #pdist (sparse)
+        for i in ['e','b','u','j']:
+            try:
+                dm = cluster.distances.pdist(scipy.sparse.csr_matrix(numpy.array([a,b],dtype=float)),weights,i)
+            except Exception as ex:
+                if not force:
+                    raise
+                else:
+                    testfail_ex += 1
+                    if verbose:
+                        print('FAIL: pdist with sparse %s raises %s' % (i,type(ex).__name__))
+            else:
+                t = numpy.allclose(dm[1,0],distances_no_missing[i],rtol,atol)
+                if t and verbose > 1:
+                    print('PASS: pdist with sparse %s' % i)
+                elif not t:
+                    if verbose:
+                        print('FAIL: pdist with sparse %s is outside tolerance' % i)
+                    testfail_tol += 1
+            testnum += 1
+        #pdisttiles (data, cutoff)
+        data = numpy.array([b,c,a,b],dtype=float)
+        try:
+            dm = cluster.distances.pdist(data,weights)
+            tiles = list(cluster.distances.pdisttiles(data,weights,chunk_rows=3))
+            pairs = list(cluster.distances.pdisttiles(data,weights,cutoff=numpy.median(dm),chunk_rows=3))
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: pdisttiles raises %s' % type(ex).__name__)
+        else:
+            t = all([numpy.allclose(d,dm[numpy.ix_(r,c)],rtol,atol) for r,c,d in tiles])
+            t = t and sum([d.size for r,c,d in tiles]) == 3*3+1*4
+            r,c = numpy.nonzero(numpy.tril(dm < numpy.median(dm),-1))
+            t = t and numpy.array_equal(numpy.concatenate([p[0] for p in pairs]),r)
+            t = t and numpy.array_equal(numpy.concatenate([p[1] for p in pairs]),c)
+            t = t and numpy.allclose(numpy.concatenate([p[2] for p in pairs]),dm[r,c],rtol,atol)
+            if t and verbose > 1:
+                print('PASS: pdisttiles')
+            elif not t:
+                if verbose:
+                    print('FAIL: pdisttiles is outside tolerance')
+                testfail_tol += 1
+        testnum += 1
     return testnum,testfail_ex,testfail_pf,testfail_tol
 
 
@@ -211,6 +453,139 @@ def stats(verbose=0,rtol=1.0000000000000001e-005,atol=1e-008,force=False):
                 print('FAIL: fulldistancematrix is outside tolerance')
             testfail_tol += 1
     testnum += 1
+    #distancematrix (data, out, chunk_rows)
+    out = numpy.zeros(len(data)*(len(data)-1)//2)
+    try:
+        dm = cluster.stats.distancematrix(data,out=out,chunk_rows=7)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: distancematrix in blocks raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(out,numpy.concatenate(distancematrix),rtol,atol)
+        if t and verbose > 1:
+            print('PASS: distancematrix in blocks')
+        elif not t:
+            if verbose:
+                print('FAIL: distancematrix in blocks is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #fulldistancematrix (data, out, max_memory)
+    fdm = numpy.zeros_like(fulldistancematrix)
+    def out(i,block):
+        fdm[i:i+len(block),:i+len(block)] = block
+    try:
+        cluster.stats.fulldistancematrix(data,out=out,max_memory=1000)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: fulldistancematrix in blocks raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(numpy.tril(fdm),numpy.tril(fulldistancematrix),rtol,atol)
+        if t and verbose > 1:
+            print('PASS: fulldistancematrix in blocks')
+        elif not t:
+            if verbose:
+                print('FAIL: fulldistancematrix in blocks is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #fulldistancematrix (data, n_jobs)
+    try:
+        fdm = cluster.stats.fulldistancematrix(data,chunk_rows=5,n_jobs=2)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: fulldistancematrix with multiple processes raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(fdm,fulldistancematrix,rtol,atol)
+        if t and verbose > 1:
+            print('PASS: fulldistancematrix with multiple processes')
+        elif not t:
+            if verbose:
+                print('FAIL: fulldistancematrix with multiple processes is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #fulldistancematrix (data, float32)
+    try:
+        fdm = cluster.stats.fulldistancematrix(data,dtype=numpy.float32)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: fulldistancematrix in single precision raises %s' % type(ex).__name__)
+    else:
+        t = fdm.dtype == numpy.float32 and numpy.allclose(fdm,fulldistancematrix,rtol,atol)
+        if t and verbose > 1:
+            print('PASS: fulldistancematrix in single precision')
+        elif not t:
+            if verbose:
+                print('FAIL: fulldistancematrix in single precision is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #distancegraph (data, radius), distancegraph (data, k)
+    try:
+        radiusgraph = cluster.stats.distancegraph(data,radius=0.3,chunk_rows=7).tocoo()
+        kgraph = cluster.stats.distancegraph(data,k=3,chunk_rows=7).tocoo()
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: distancegraph raises %s' % type(ex).__name__)
+    else:
+        lower = numpy.tril(fulldistancematrix <= 0.3,-1)
+        t = radiusgraph.nnz == 2*numpy.sum(lower)
+        t = t and numpy.all(lower[radiusgraph.row,radiusgraph.col]+lower[radiusgraph.col,radiusgraph.row])
+        t = t and numpy.allclose(radiusgraph.data,fulldistancematrix[radiusgraph.row,radiusgraph.col],rtol,atol)
+        nearest = fulldistancematrix + numpy.diag(numpy.full(len(data),numpy.inf))
+        t = t and numpy.array_equal(numpy.bincount(kgraph.row),numpy.full(len(data),3))
+        t = t and numpy.allclose(numpy.sort(kgraph.data.reshape((-1,3)),axis=1),numpy.sort(nearest,axis=1)[:,:3],rtol,atol)
+        if t and verbose > 1:
+            print('PASS: distancegraph')
+        elif not t:
+            if verbose:
+                print('FAIL: distancegraph is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #CondensedDistanceMatrix (fulldistancematrix)
+    try:
+        cdm = cluster.stats.CondensedDistanceMatrix(fulldistancematrix)
+        square = cdm.square()
+        row = cdm.row(5)
+        element = cdm[3,7]
+        single = cluster.stats.CondensedDistanceMatrix(numpy.zeros((1,1)))[0,0]
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: CondensedDistanceMatrix raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(square,fulldistancematrix,rtol,atol)
+        t = t and numpy.allclose(row,fulldistancematrix[5],rtol,atol)
+        t = t and numpy.allclose(element,fulldistancematrix[3,7],rtol,atol)
+        t = t and numpy.allclose(cdm.array,numpy.concatenate(distancematrix),rtol,atol)
+        t = t and single == 0
+        if t and verbose > 1:
+            print('PASS: CondensedDistanceMatrix')
+        elif not t:
+            if verbose:
+                print('FAIL: CondensedDistanceMatrix is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
     #silhouette (dm, levs)
     levs = numpy.load(dir + 'levs.pkl', allow_pickle=True, encoding='latin1')
     silhouette = numpy.load(dir + 'silhouette.pkl', allow_pickle=True, encoding='latin1')
@@ -231,7 +606,65 @@ def stats(verbose=0,rtol=1.0000000000000001e-005,atol=1e-008,force=False):
             if verbose:
                 print('FAIL: silhouette is outside tolerance')
             testfail_tol += 1
-    testnum += 1    
+    testnum += 1
+    #savedistancematrix (filename, data), loaddistancematrix (filename)
+    filename = 'dummy.dat'
+    try:
+        cluster.stats.savedistancematrix(dir + filename,data,chunk_rows=7)
+        dm = cluster.stats.loaddistancematrix(dir + filename,dist='e')
+        sil = cluster.stats.silhouette(1,levs,dm=dm)
+        cluster.stats.savedistancematrix(dir + 'pooled.dat',data,chunk_rows=7,n_jobs=2)
+        pooled = cluster.stats.loaddistancematrix(dir + 'pooled.dat')
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex +=1
+            if verbose:
+                print('FAIL: savedistancematrix/loaddistancematrix raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(numpy.concatenate(dm),numpy.concatenate(distancematrix),rtol,atol)
+        t = t and numpy.allclose(sil,silhouette,rtol,atol)
+        t = t and numpy.array_equal(pooled.array,dm.array)
+        if t and verbose > 1:
+            print('PASS: savedistancematrix/loaddistancematrix')
+        elif not t:
+            if verbose:
+                print('FAIL: savedistancematrix/loaddistancematrix is outside tolerance')
+            testfail_tol += 1
+        del dm
+        del pooled
+    testnum += 1
+    os.remove(dir + filename)
+    os.remove(dir + 'pooled.dat')
+    #savedistancematrix (filename, data, dist) with a header too long to store
+    alias = 'test' + 'x'*300
+    try:
+        if alias not in cluster.distances.metrics:
+            cluster.distances.registermetric(alias,cluster.distances.euclidean)
+        cluster.stats.savedistancematrix(dir + filename,data,dist=alias)
+    except ValueError:
+        t = not os.path.exists(dir + filename)
+        if t and verbose > 1:
+            print('PASS: savedistancematrix with a long alias')
+        elif not t:
+            if verbose:
+                print('FAIL: savedistancematrix with a long alias writes the file')
+            testfail_tol += 1
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: savedistancematrix with a long alias raises %s' % type(ex).__name__)
+    else:
+        if verbose:
+            print('FAIL: savedistancematrix with a long alias does not raise ValueError')
+        testfail_pf += 1
+    testnum += 1
+    if os.path.exists(dir + filename):
+        os.remove(dir + filename)
     #levscheck (levs)
     with open(dir + 'check1.pkl', 'rb') as f:
         check1 = pickle.load(f)
@@ -521,6 +954,134 @@ def hierarch(verbose=0,rtol=1.0000000000000001e-005,atol=1e-008,force=False):
                         print('FAIL: aggtreecluster with data given, %s, and %s' % (i[1],j[1]))
                     testfail_pf += 1
             testnum += 1
+    #neighbors.RPForest.neighbors(k)
+    try:
+        d,index = cluster.neighbors.RPForest(data,ntrees=20,leafsize=8,seed=0).neighbors(3)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: RPForest.neighbors raises %s' % type(ex).__name__)
+    else:
+        dm = cluster.stats.fulldistancematrix(data)
+        numpy.fill_diagonal(dm,numpy.inf)
+        t = numpy.allclose(d,numpy.sort(dm,axis=1)[:,:3],rtol,atol)
+        if t and verbose > 1:
+            print('PASS: RPForest.neighbors')
+        elif not t:
+            if verbose:
+                print('FAIL: RPForest.neighbors is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #neighbors.VPTree.query(points,k) and neighbors.VPTree.radius(points,r)
+    try:
+        vptree = cluster.neighbors.VPTree(data,dist='b',leafsize=4,seed=0)
+        d,index = vptree.query(data,3)
+        rd,rindex = vptree.radius(data,0.2)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: VPTree.query and VPTree.radius raise %s' % type(ex).__name__)
+    else:
+        dm = cluster.stats.fulldistancematrix(data,dist='b')
+        t = numpy.allclose(d,numpy.sort(dm,axis=1)[:,:3],rtol,atol)
+        t = t and all([numpy.array_equal(numpy.sort(rindex[i]),numpy.flatnonzero(dm[i] <= 0.2)) for i in range(len(data))])
+        if t and verbose > 1:
+            print('PASS: VPTree.query and VPTree.radius')
+        elif not t:
+            if verbose:
+                print('FAIL: VPTree.query and VPTree.radius are outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #neighbors.VPTree.query(points,k) and neighbors.VPTree.radius(points,r) with a registered metric
+    try:
+        if 'testpair' not in cluster.distances.metrics:
+            cluster.distances.registermetric('testpair',lambda x,y,w: float(numpy.sqrt(numpy.sum(w*(x-y)**2)/numpy.sum(w))),metric=True,nan=False)
+        vptree = cluster.neighbors.VPTree(data,dist='testpair',leafsize=4,seed=0)
+        d,index = vptree.query(data,3)
+        rd,rindex = vptree.radius(data,0.3)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: VPTree with a registered metric raises %s' % type(ex).__name__)
+    else:
+        dm = cluster.stats.fulldistancematrix(data,dist='e')
+        t = numpy.allclose(d,numpy.sort(dm,axis=1)[:,:3],rtol,atol)
+        t = t and all([numpy.array_equal(numpy.sort(rindex[i]),numpy.flatnonzero(dm[i] <= 0.3)) for i in range(len(data))])
+        if t and verbose > 1:
+            print('PASS: VPTree with a registered metric')
+        elif not t:
+            if verbose:
+                print('FAIL: VPTree with a registered metric is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #aggtreecluster(data,link,nneighbors)
+    try:
+        approx = cluster.hierarch.aggtreecluster(data=data,link='s',nneighbors=10)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: aggtreecluster with nneighbors raises %s' % type(ex).__name__)
+    else:
+        tr = cluster.hierarch.aggtreecluster(data=data,link='s')
+        t = numpy.allclose(approx.cophenetic('dist'),tr.cophenetic('dist'),rtol,atol)
+        if t and verbose > 1:
+            print('PASS: aggtreecluster with nneighbors')
+        elif not t:
+            if verbose:
+                print('FAIL: aggtreecluster with nneighbors is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #aggtreecluster(data,link,nneighbors) with a single data point
+    for i in [None,3]:
+        try:
+            cluster.hierarch.aggtreecluster(data=data[:1],link='s',nneighbors=i)
+        except ValueError:
+            if verbose > 1:
+                print('PASS: aggtreecluster of one data point with nneighbors=%s' % i)
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: aggtreecluster of one data point with nneighbors=%s raises %s' % (i,type(ex).__name__))
+        else:
+            if verbose:
+                print('FAIL: aggtreecluster of one data point with nneighbors=%s does not raise ValueError' % i)
+            testfail_pf += 1
+        testnum += 1
+    #aggtreecluster(distancematrix=distancegraph,link)
+    try:
+        approx = cluster.hierarch.aggtreecluster(distancematrix=cluster.stats.distancegraph(data,radius=0.4),link='s')
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: aggtreecluster with a sparse distancematrix raises %s' % type(ex).__name__)
+    else:
+        tr = cluster.hierarch.aggtreecluster(data=data,link='s')
+        t = numpy.allclose(approx.cophenetic('dist'),tr.cophenetic('dist'),rtol,atol)
+        if t and verbose > 1:
+            print('PASS: aggtreecluster with a sparse distancematrix')
+        elif not t:
+            if verbose:
+                print('FAIL: aggtreecluster with a sparse distancematrix is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
     #AggTree.save(filename)
     filename = 'dummy.pkl'
     try:
@@ -858,6 +1419,180 @@ def partition(verbose=0,rtol=1.0000000000000001e-005,atol=1e-008,force=False):
                 print('FAIL: kmeans is outside tolerance')
             testfail_tol += 1
     testnum += 1
+    #kmeans(data,nclusters,method,threshold) converged
+    try:
+        k = cluster.partition.kmeans(data,3,method='q',initial=initial,threshold=0)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: kmeans with the quadratic mean raises %s' % type(ex).__name__)
+    else:
+        cdata = cluster.stats.clustercentroids(data,k,1.,'q')
+        d = cluster.distances.cdist(data,cdata)
+        t = numpy.array_equal(numpy.argmin(d,axis=1),numpy.argmax(k,axis=1))
+        if t and verbose > 1:
+            print('PASS: kmeans with the quadratic mean')
+        elif not t:
+            if verbose:
+                print('FAIL: kmeans with the quadratic mean is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #kmeans(data,nclusters,initial,algorithm)
+    for i in ['elkan','hamerly']:
+        try:
+            k = cluster.partition.kmeans(data,3,initial=initial,algorithm=i)
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: kmeans with the %s algorithm raises %s' % (i,type(ex).__name__))
+        else:
+            t = numpy.allclose(k,kmeans,rtol,atol)
+            if t and verbose > 1:
+                print('PASS: kmeans with the %s algorithm' % i)
+            elif not t:
+                if verbose:
+                    print('FAIL: kmeans with the %s algorithm is outside tolerance' % i)
+                testfail_tol += 1
+        testnum += 1
+    #kmeans(data,nclusters,dist,initial,algorithm) with a registered metric
+    if 'testpair' not in cluster.distances.metrics:
+        cluster.distances.registermetric('testpair',lambda x,y,w: float(numpy.sqrt(numpy.sum(w*(x-y)**2)/numpy.sum(w))),metric=True,nan=False)
+    for i in ['elkan','hamerly']:
+        try:
+            k = cluster.partition.kmeans(data,3,dist='testpair',initial=initial,algorithm=i)
+        except Exception as ex:
+            if not force:
+                raise
+            else:
+                testfail_ex += 1
+                if verbose:
+                    print('FAIL: kmeans with the %s algorithm and a registered metric raises %s' % (i,type(ex).__name__))
+        else:
+            t = numpy.allclose(k,kmeans,rtol,atol)
+            if t and verbose > 1:
+                print('PASS: kmeans with the %s algorithm and a registered metric' % i)
+            elif not t:
+                if verbose:
+                    print('FAIL: kmeans with the %s algorithm and a registered metric is outside tolerance' % i)
+                testfail_tol += 1
+        testnum += 1
+    #kmeans(sparse data)
+    try:
+        k = cluster.partition.kmeans(scipy.sparse.csr_matrix(data),3,initial=initial)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: kmeans with sparse data raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(k,kmeans,rtol,atol)
+        if t and verbose > 1:
+            print('PASS: kmeans with sparse data')
+        elif not t:
+            if verbose:
+                print('FAIL: kmeans with sparse data is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #kmeans(data,nclusters,initial,approximate)
+    try:
+        k = cluster.partition.kmeans(data,3,initial=initial,approximate=True)
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: kmeans with approximate raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(k,kmeans,rtol,atol)
+        if t and verbose > 1:
+            print('PASS: kmeans with approximate')
+        elif not t:
+            if verbose:
+                print('FAIL: kmeans with approximate is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #minibatch_kmeans(data,nclusters,initial,batchsize,maxiter,seed)
+    blobs = numpy.array([[0.,0.],[1.,1.],[0.,1.]])[numpy.arange(60)%3] + 0.01*numpy.arange(60)[:,numpy.newaxis]%0.07
+    means = numpy.array([numpy.mean(blobs[i::3],axis=0) for i in range(3)])
+    try:
+        cdata = cluster.partition.minibatch_kmeans(blobs,3,initial=blobs[:3],batchsize=10,maxiter=50,seed=0)
+        batches = cluster.partition.minibatch_kmeans(iter([blobs[:30],blobs[30:]]),3,initial=blobs[:3])
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: minibatch_kmeans raises %s' % type(ex).__name__)
+    else:
+        t = numpy.allclose(cdata,means,0,0.05)
+        t = t and numpy.allclose(batches,means,rtol,atol)
+        if t and verbose > 1:
+            print('PASS: minibatch_kmeans')
+        elif not t:
+            if verbose:
+                print('FAIL: minibatch_kmeans is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #kmeans(data,nclusters,init)
+    try:
+        seeded = [cluster.partition.kmeans(10*blobs,3,init=init) for init in ['k-means++','k-means||']]
+        seeded.append(cluster.partition.cmeans(10*blobs,3,init='k-means++'))
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: kmeans with init raises %s' % type(ex).__name__)
+    else:
+        t = True
+        for levs in seeded:
+            nearest = numpy.argmax(levs,axis=1)
+            t = t and len(set(nearest[:3])) == 3 and numpy.all(nearest == nearest[numpy.arange(60)%3])
+        if t and verbose > 1:
+            print('PASS: kmeans with init')
+        elif not t:
+            if verbose:
+                print('FAIL: kmeans with init is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
+    #kmeans(data,nclusters,n_init,n_jobs,seed,select,diagnostics)
+    try:
+        levs,runs = cluster.partition.kmeans(10*blobs,3,n_init=6,seed=0,diagnostics=True)
+        pooled,pooledruns = cluster.partition.kmeans(10*blobs,3,n_init=6,n_jobs=2,seed=0,diagnostics=True)
+        modal,modalruns = cluster.partition.kmeans(10*blobs,3,n_init=6,seed=0,select='mode',diagnostics=True,init='k-means++')
+    except Exception as ex:
+        if not force:
+            raise
+        else:
+            testfail_ex += 1
+            if verbose:
+                print('FAIL: kmeans with n_init raises %s' % type(ex).__name__)
+    else:
+        t = numpy.all(levs == pooled) and numpy.all(runs == pooledruns)
+        t = t and len(runs) == 6 and numpy.count_nonzero(runs.selected) == 1
+        t = t and runs.sse[runs.selected][0] == numpy.min(runs.sse)
+        t = t and numpy.allclose(runs.sse[runs.selected][0],numpy.sum(cluster.stats.SEmatrix(10*blobs,levs)),rtol,atol)
+        t = t and modalruns.matches[modalruns.selected][0] == numpy.max(modalruns.matches)
+        nearest = numpy.argmax(modal,axis=1)
+        t = t and len(set(nearest[:3])) == 3 and numpy.all(nearest == nearest[numpy.arange(60)%3])
+        if t and verbose > 1:
+            print('PASS: kmeans with n_init')
+        elif not t:
+            if verbose:
+                print('FAIL: kmeans with n_init is outside tolerance')
+            testfail_tol += 1
+    testnum += 1
     #cmeans(data,nclusters,p,initial,rtol,atol)
     cmeans = numpy.load(dir + 'cmeans.pkl', allow_pickle=True, encoding='latin1')
     try: